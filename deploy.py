@@ -1,17 +1,230 @@
 import os
+import sys
 import subprocess
 
+# waiters.py is passed to the processing job as an input next to the script
+sys.path.append("/opt/ml/processing/utils")
+from waiters import ENDPOINT_SUCCESS, Waiter, WaiterError, endpoint_poller, endpoint_waiter
+
 def install_library(library):
     subprocess.call(f'pip install {library}', shell=True)
 
+# endpoint tag holding the fingerprint of the training data of the deployed model (read by the trigger Lambda)
+FINGERPRINT_TAG = 'data-fingerprint'
+# endpoint tag holding the fingerprint of the deployment: model, inference code and instances
+DEPLOYMENT_TAG = 'deployment-fingerprint'
+
+# statuses ending a rollback of SageMaker, 'RollingBack' itself is not terminal
+ROLLBACK_FAILURE = ('Failed', 'OutOfService')
+
+
+def model_data_contents(boto_session, model_data):
+    """
+    Manifest and item ids of a model.tar.gz on S3, streamed until both members
+    were read. Returns (manifest, item_ids), empty / None when not in the archive
+    """
+    import io
+    import json
+    import tarfile
+    import numpy as np
+    
+    manifest, item_ids = {}, None
+    bucket, key = model_data[len('s3://'):].split('/', 1)
+    body = boto_session.client('s3').get_object(Bucket=bucket, Key=key)['Body']
+    with tarfile.open(fileobj=body, mode='r|gz') as tar:
+        for member in tar:
+            name = member.name.lstrip('./')
+            if name == 'manifest.json':
+                manifest = json.load(tar.extractfile(member))
+            elif name == 'item_ids.npy':
+                # the stream can not seek, np.load reads from a copy in memory
+                item_ids = np.load(io.BytesIO(tar.extractfile(member).read()), allow_pickle=False)
+            if manifest and item_ids is not None:
+                break
+    return manifest, item_ids
+
+
+def probe_payload(args, item_ids):
+    """
+    Request of the probe: --probe_payload when given, otherwise the default
+    recommendations of an item of the new model
+    """
+    import json
+    
+    if args.probe_payload:
+        return args.probe_payload
+    if item_ids is None or len(item_ids) == 0:
+        raise ValueError(f"No item ids in {args.model_data}, --probe_payload is required")
+    return json.dumps({'itemId': int(item_ids[len(item_ids) // 2])})
+
+
+def deployment_fingerprint(manifest, entry_script, args):
+    """
+    Fingerprint of a deployment: the model (training data, hyperparameters and training code),
+    the inference code and the serving configuration, None when the model has no fingerprint
+    """
+    import json
+    import hashlib
+    
+    if not manifest.get('model_fingerprint'):
+        return None
+    with open(entry_script, 'rb') as f:
+        inference_code = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+    content = {'model': manifest['model_fingerprint'], 'inference_code': inference_code,
+               'instance_type': args.instance_type, 'instance_count': args.instance_count,
+               'exclusion_s3_uri': args.exclusion_s3_uri}
+    # only when set, the fingerprints of the SKLearn container deployments are unchanged
+    if args.serving_image_uri:
+        content['serving_image_uri'] = args.serving_image_uri
+    content = json.dumps(content, sort_keys=True)
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def endpoint_tags(sagemaker_boto_client, endpoint_name):
+    """
+    Tags of the endpoint, empty if the endpoint does not exist or is not in service
+    """
+    endpoints = sagemaker_boto_client.list_endpoints(NameContains=endpoint_name)['Endpoints']
+    endpoint = next((endpoint for endpoint in endpoints if endpoint['EndpointName'] == endpoint_name), None)
+    if endpoint is None or endpoint['EndpointStatus'] != 'InService':
+        return {}
+    
+    tags = sagemaker_boto_client.list_tags(ResourceArn=endpoint['EndpointArn'])['Tags']
+    return {tag['Key']: tag['Value'] for tag in tags}
+
+
+def tag_endpoint_fingerprint(sagemaker_boto_client, endpoint_name, fingerprints):
+    """
+    Tags the endpoint with the fingerprints of its deployment, {tag: fingerprint}
+    """
+    tags = [{'Key': tag, 'Value': value} for tag, value in fingerprints.items() if value is not None]
+    if not tags:
+        return
+    endpoint_arn = sagemaker_boto_client.describe_endpoint(EndpointName=endpoint_name)['EndpointArn']
+    sagemaker_boto_client.add_tags(ResourceArn=endpoint_arn, Tags=tags)
+
+
+def probe_endpoint(runtime_client, endpoint_name, payload, n_requests=20, max_latency_ms=1000.0):
+    """
+    Health and latency probe of the endpoint: every request must succeed and
+    the p95 latency must stay under max_latency_ms. Returns (passed, summary)
+    """
+    import json
+    import time
+    
+    latencies = []
+    for _ in range(n_requests):
+        start = time.perf_counter()
+        try:
+            response = runtime_client.invoke_endpoint(EndpointName=endpoint_name, ContentType='application/json',
+                                                      Accept='application/json', Body=payload)
+            body = json.loads(response['Body'].read())
+        except Exception as e:
+            return False, f'request failed: {e}'
+        if not isinstance(body, dict) or not isinstance(body.get('rec'), list):
+            return False, f'unexpected response: {str(body)[:200]}'
+        latencies.append((time.perf_counter() - start) * 1000)
+    
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+    return p95 <= max_latency_ms, f'p95 latency {p95:.1f} ms over {n_requests} requests (max {max_latency_ms} ms)'
+
+
+def deployment_config(args):
+    """
+    Blue/green update policy: traffic shifted all at once, as a canary or linearly,
+    automatically rolled back by SageMaker when one of the alarms fires meanwhile
+    """
+    routing = {'Type': args.traffic_routing, 'WaitIntervalInSeconds': args.wait_interval}
+    if args.traffic_routing == 'CANARY':
+        routing['CanarySize'] = {'Type': 'CAPACITY_PERCENT', 'Value': args.traffic_percent}
+    elif args.traffic_routing == 'LINEAR':
+        routing['LinearStepSize'] = {'Type': 'CAPACITY_PERCENT', 'Value': args.traffic_percent}
+    
+    config = {
+        'BlueGreenUpdatePolicy': {
+            'TrafficRoutingConfiguration': routing,
+            'TerminationWaitInSeconds': args.termination_wait,
+        }
+    }
+    alarms = [alarm for alarm in (args.rollback_alarms or '').split(',') if alarm]
+    if alarms:
+        config['AutoRollbackConfiguration'] = {'Alarms': [{'AlarmName': alarm} for alarm in alarms]}
+    return config
+
+
+def wait_in_service(sagemaker_boto_client, endpoint_name, timeout):
+    """
+    Waits (backoff polling) until the endpoint finished creating or updating,
+    returns the endpoint config it is serving
+    """
+    endpoint_waiter(sagemaker_boto_client, endpoint_name, timeout=timeout).wait([endpoint_name])
+    return sagemaker_boto_client.describe_endpoint(EndpointName=endpoint_name)['EndpointConfigName']
+
+
+def wait_rolled_back(sagemaker_boto_client, endpoint_name, timeout):
+    """
+    Waits until a failed or alarmed update was rolled back and the endpoint is
+    in service again, returns the endpoint config it is serving, None if the
+    endpoint did not come back
+    """
+    waiter = Waiter(endpoint_poller(sagemaker_boto_client, endpoint_name), ENDPOINT_SUCCESS, ROLLBACK_FAILURE,
+                    timeout=timeout)
+    try:
+        waiter.wait([endpoint_name])
+    except WaiterError:
+        return None
+    return sagemaker_boto_client.describe_endpoint(EndpointName=endpoint_name)['EndpointConfigName']
+
+
+def preflight_probe(sagemaker_boto_client, runtime_client, model_name, payload, args, logger):
+    """
+    Probes the new model on a temporary one instance endpoint before any live
+    traffic is shifted to it, the endpoint is deleted afterwards. Returns (passed, summary)
+    """
+    import time
+    import uuid
+    from botocore.exceptions import ClientError
+    
+    probe_name = f"{args.endpoint_name[:34]}-probe-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    sagemaker_boto_client.create_endpoint_config(
+        EndpointConfigName=probe_name,
+        ProductionVariants=[{
+            'VariantName': 'AllTraffic',
+            'ModelName': model_name,
+            'InitialInstanceCount': 1,
+            'InstanceType': args.instance_type,
+            'InitialVariantWeight': 1.0,
+        }],
+    )
+    try:
+        sagemaker_boto_client.create_endpoint(EndpointName=probe_name, EndpointConfigName=probe_name)
+        logger.info(f"\n ===== Probing the new model on {probe_name} ===== \n")
+        try:
+            wait_in_service(sagemaker_boto_client, probe_name, args.timeout)
+        except WaiterError as e:
+            return False, f'probe endpoint not in service: {e}'
+        return probe_endpoint(runtime_client, probe_name, payload, args.probe_requests, args.max_latency_ms)
+    finally:
+        for delete, kwargs in ((sagemaker_boto_client.delete_endpoint, {'EndpointName': probe_name}),
+                               (sagemaker_boto_client.delete_endpoint_config, {'EndpointConfigName': probe_name})):
+            try:
+                delete(**kwargs)
+            except ClientError as e:
+                logger.info(f"Could not delete {probe_name}: {e}")
+
+
 def deploy_endpoint(args):    
+    import time
+    import uuid
     import boto3
     boto3.setup_default_session(region_name=os.environ["AWS_REGION"])
     boto_session = boto3.Session(region_name=os.environ["AWS_REGION"])
     
     import sagemaker
+    from sagemaker.model import Model
     from sagemaker.sklearn import SKLearnModel
-    import logger
+    import logging
     
     # Creating an object
     logger = logging.getLogger()
@@ -34,15 +247,175 @@ def deploy_endpoint(args):
     
     sagemaker_boto_client = boto_session.client("sagemaker")
     
+    # the same model (data, hyperparameters, training code) with the same inference code
+    # and instances is already serving, no redeploy
+    manifest, item_ids = model_data_contents(boto_session, model_data)
+    fingerprints = {FINGERPRINT_TAG: manifest.get('data_fingerprint'),
+                    DEPLOYMENT_TAG: deployment_fingerprint(manifest, entry_script, args)}
+    logger.info(f"fingerprints: {fingerprints}")
+    if fingerprints[DEPLOYMENT_TAG] is not None and \
+            fingerprints[DEPLOYMENT_TAG] == endpoint_tags(sagemaker_boto_client, endpoint_name).get(DEPLOYMENT_TAG):
+        logger.info("\n ===== Model and inference code unchanged since the deployment, endpoint kept ===== \n")
+        return
+    
+    # the live exclusions outlive the instances and the blue/green fleets
+    env = {'EXCLUSION_S3_URI': args.exclusion_s3_uri} if args.exclusion_s3_uri else None
+
     # Create a model
-    model = SKLearnModel(
+    if args.serving_image_uri:
+        # scoring/Dockerfile image: nginx and gunicorn workers sharing the memory mapped model,
+        # the inference code is the copy built into the image
+        model = Model(
+                        image_uri=args.serving_image_uri,
                         role=sm_role,
                         model_data=model_data,
-                        framework_version="1.0-1",
-                        py_version="py3",
-                        entry_point=entry_script
+                        env=env
                     )
+    else:
+        model = SKLearnModel(
+                            role=sm_role,
+                            model_data=model_data,
+                            framework_version="1.0-1",
+                            py_version="py3",
+                            entry_point=entry_script,
+                            env=env
+                        )
+    
+    existing_endpoints = [endpoint for endpoint in
+                          sagemaker_boto_client.list_endpoints(NameContains=endpoint_name)["Endpoints"]
+                          if endpoint["EndpointName"] == endpoint_name]
+    
+    if args.deploy_mode == 'recreate':
+        recreate_endpoint(sagemaker_boto_client, model, endpoint_name, existing_endpoints, args, logger)
+        tag_endpoint_fingerprint(sagemaker_boto_client, endpoint_name, fingerprints)
+        logger.info("\n ========== Endpoint Created Successfully ========== \n")
+        return
+    
+    # blue/green: the new model gets its own endpoint config, the old one keeps serving until the switch
+    payload = probe_payload(args, item_ids) if args.probe_requests > 0 else None
+    model.create(instance_type=args.instance_type)
+    config_name = f"{endpoint_name[:40]}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    sagemaker_boto_client.create_endpoint_config(
+        EndpointConfigName=config_name,
+        ProductionVariants=[{
+            'VariantName': 'AllTraffic',
+            'ModelName': model.name,
+            'InitialInstanceCount': args.instance_count,
+            'InstanceType': args.instance_type,
+            'InitialVariantWeight': 1.0,
+        }],
+    )
+    logger.info(f"\n ===== Endpoint config {config_name} created for model {model.name} ===== \n")
+    
+    # the new model is probed before it takes any live traffic, a failure costs no exposure
+    if args.probe_requests > 0:
+        passed, summary = preflight_probe(sagemaker_boto_client, boto_session.client('sagemaker-runtime'), model.name,
+                                          payload, args, logger)
+        logger.info(f"Probe of the new model with {payload}: {summary}")
+        if not passed:
+            discard_deployment(sagemaker_boto_client, config_name, model.name, logger)
+            raise RuntimeError(f"New model of {endpoint_name} failed the probe ({summary}), endpoint not updated")
+    
+    if not existing_endpoints:
+        logger.info("\n\t ===== NO such Endpoint /// Creating new endpoint ===== \n\t")
+        sagemaker_boto_client.create_endpoint(EndpointName=endpoint_name, EndpointConfigName=config_name)
+        wait_in_service(sagemaker_boto_client, endpoint_name, args.timeout)
+        tag_endpoint_fingerprint(sagemaker_boto_client, endpoint_name, fingerprints)
+        logger.info("\n ========== Endpoint Created Successfully ========== \n")
+        return
+    
+    previous_config = sagemaker_boto_client.describe_endpoint(EndpointName=endpoint_name)['EndpointConfigName']
+    logger.info(f"\n\t ===== Updating endpoint from {previous_config} to {config_name} ===== \n\t")
+    sagemaker_boto_client.update_endpoint(EndpointName=endpoint_name, EndpointConfigName=config_name,
+                                          DeploymentConfig=deployment_config(args))
+    
+    try:
+        serving_config = wait_in_service(sagemaker_boto_client, endpoint_name, args.timeout)
+    except WaiterError as e:
+        # SageMaker rolls a failed or alarmed update back to the old fleet, the
+        # new config and model are only deleted once the endpoint is back on it
+        logger.info(f"Endpoint update failed: {e}, waiting for the rollback")
+        serving_config = wait_rolled_back(sagemaker_boto_client, endpoint_name, args.timeout)
+    if serving_config != config_name:
+        if serving_config == previous_config:
+            discard_deployment(sagemaker_boto_client, config_name, model.name, logger)
+        raise RuntimeError(f"Endpoint {endpoint_name} update failed, serving {serving_config or 'nothing'}")
+    
+    tag_endpoint_fingerprint(sagemaker_boto_client, endpoint_name, fingerprints)
+    
+    # the --retain_configs newest previous configs (and their models) are kept for a manual rollback
+    delete_old_deployments(sagemaker_boto_client, endpoint_name, config_name, args.retain_configs, logger)
+    
+    logger.info("\n ========== Endpoint Updated Successfully ========== \n")
+
+
+def publish_deployed_model(model_data, deployed_model_uri):
+    """
+    Copies the deployed model.tar.gz to a stable S3 location, read back by the
+    next incremental training through its `model` channel
+    """
+    import boto3
     
+    source_bucket, source_key = model_data[len('s3://'):].split('/', 1)
+    bucket, key = deployed_model_uri[len('s3://'):].split('/', 1)
+    if key.endswith('/'):
+        key += 'model.tar.gz'
+    boto3.client('s3', region_name=os.environ["AWS_REGION"]).copy({'Bucket': source_bucket, 'Key': source_key}, bucket, key)
+
+
+def config_models(sagemaker_boto_client, config_name):
+    """
+    Models of the production variants of an endpoint config
+    """
+    config = sagemaker_boto_client.describe_endpoint_config(EndpointConfigName=config_name)
+    return [variant['ModelName'] for variant in config['ProductionVariants']]
+
+
+def discard_deployment(sagemaker_boto_client, config_name, model_name, logger):
+    """
+    Deletes the endpoint config and model of a deployment that did not go live
+    """
+    from botocore.exceptions import ClientError
+    
+    try:
+        sagemaker_boto_client.delete_endpoint_config(EndpointConfigName=config_name)
+        sagemaker_boto_client.delete_model(ModelName=model_name)
+    except ClientError as e:
+        logger.info(f"Could not delete {config_name} / {model_name}: {e}")
+
+
+def delete_old_deployments(sagemaker_boto_client, endpoint_name, serving_config, retain, logger):
+    """
+    Deletes the endpoint configs created by earlier blue/green deployments of the
+    endpoint and their models, except the serving config and the `retain` newest others
+    """
+    configs = []
+    paginator = sagemaker_boto_client.get_paginator('list_endpoint_configs')
+    for page in paginator.paginate(NameContains=endpoint_name):
+        configs += [config for config in page['EndpointConfigs']
+                    if config['EndpointConfigName'] == endpoint_name
+                    or config['EndpointConfigName'].startswith(f"{endpoint_name[:40]}-")]
+    
+    configs.sort(key=lambda config: config['CreationTime'], reverse=True)
+    previous = [config['EndpointConfigName'] for config in configs if config['EndpointConfigName'] != serving_config]
+    kept, deleted = [serving_config] + previous[:retain], previous[retain:]
+    
+    # a model still used by a kept config is not deleted
+    used_models = {model for name in kept for model in config_models(sagemaker_boto_client, name)}
+    for name in deleted:
+        models = [model for model in config_models(sagemaker_boto_client, name) if model not in used_models]
+        sagemaker_boto_client.delete_endpoint_config(EndpointConfigName=name)
+        for model in models:
+            sagemaker_boto_client.delete_model(ModelName=model)
+        # models shared by several deleted configs are deleted once
+        used_models.update(models)
+        logger.info(f"Deleted the endpoint config {name} and its models {models}")
+
+
+def recreate_endpoint(sagemaker_boto_client, model, endpoint_name, existing_endpoints, args, logger):
+    """
+    Legacy deployment: deletes the endpoint and its config, then deploys the model again (downtime)
+    """
     existing_configs = sagemaker_boto_client.list_endpoint_configs(NameContains=endpoint_name)[
         "EndpointConfigs"
     ]
@@ -55,10 +428,6 @@ def deploy_endpoint(args):
         logger.info("\n ==== No such config ==== \n")
         pass
     
-    existing_endpoints = sagemaker_boto_client.list_endpoints(NameContains=endpoint_name)[
-        "Endpoints"
-    ]
-    
     if existing_endpoints:
         logger.info("\n\t ===== Deleting Endpoint ===== \n\t")
         # Delete the endpoint
@@ -71,17 +440,12 @@ def deploy_endpoint(args):
         logger.info("\n\t ===== Endpoint deleted successfully ===== \n\t")
         
         logger.info("\n\t ===== Creating new endpoint ===== \n\t")
-        
-        # deploy model
-        deploy_model = model.deploy(initial_instance_count=1, instance_type='ml.m5.xlarge', endpoint_name=endpoint_name)
     else:
         logger.info("\n\t ===== NO such Endpoint /// Creating new endpoint ===== \n\t")
 
-        # deploy model
-        deploy_model = model.deploy(initial_instance_count=1, instance_type='ml.m5.xlarge', endpoint_name=endpoint_name)
-
-    
-    logger.info("\n ========== Endpoint Created Successfully ========== \n")
+    # deploy model
+    deploy_model = model.deploy(initial_instance_count=args.instance_count, instance_type=args.instance_type,
+                                endpoint_name=endpoint_name)
 
 
 
@@ -101,9 +465,35 @@ if __name__ == "__main__":
     parser.add_argument("--inference_prefix", type=str)
     parser.add_argument("--sm_role", type=str)
     parser.add_argument("--endpoint_name", type=str)
+    parser.add_argument("--deploy_mode", type=str, default="blue_green", choices=["blue_green", "recreate"])
+    parser.add_argument("--instance_type", type=str, default="ml.m5.xlarge")
+    parser.add_argument("--instance_count", type=int, default=1)
+    # traffic shifting of the blue/green update
+    parser.add_argument("--traffic_routing", type=str, default="ALL_AT_ONCE", choices=["ALL_AT_ONCE", "CANARY", "LINEAR"])
+    parser.add_argument("--traffic_percent", type=int, default=10, help="canary size or linear step (% of capacity)")
+    parser.add_argument("--wait_interval", type=int, default=300, help="seconds between the traffic shifting steps")
+    parser.add_argument("--termination_wait", type=int, default=600,
+                        help="seconds the old fleet is kept after the switch, the alarms roll back to it meanwhile")
+    parser.add_argument("--rollback_alarms", type=str, default="", help="comma separated CloudWatch alarm names")
+    # probe of the new model on a temporary endpoint before the switch, 0 requests to skip it
+    # default: the default recommendations of an item of the new model (from its item_ids.npy)
+    parser.add_argument("--probe_payload", type=str, default="")
+    parser.add_argument("--probe_requests", type=int, default=20)
+    parser.add_argument("--max_latency_ms", type=float, default=1000.0)
+    parser.add_argument("--timeout", type=float, default=3600, help="seconds to wait for the endpoint to be in service")
+    # retention: previous endpoint configs (and their models) kept for a manual rollback, the older ones are deleted
+    parser.add_argument("--retain_configs", type=int, default=1)
+    # stable copy of the serving model, the previous state of the next incremental training
+    parser.add_argument("--deployed_model_uri", type=str, default="")
+    # S3 prefix persisting the live exclusions (sold artworks) of the endpoint
+    parser.add_argument("--exclusion_s3_uri", type=str, default="")
+    # ECR image built from scoring/Dockerfile, default the SKLearn framework container running inference.py
+    parser.add_argument("--serving_image_uri", type=str, default="")
     
     args = parser.parse_args()
     
     deploy_endpoint(args)
+    if args.deployed_model_uri:
+        publish_deployed_model(args.model_data, args.deployed_model_uri)
     
     
\ No newline at end of file
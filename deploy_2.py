@@ -8,6 +8,10 @@ import pathlib
 
 import boto3
 
+# waiters.py is passed to the processing job as an input next to the script
+sys.path.append("/opt/ml/processing/utils")
+from waiters import Waiter, WaiterError, describe_poller
+
 
 
 print(sys.argv)
@@ -38,23 +42,31 @@ def deploy(args):
 
     endpoint_arn = endpoint_response["EndpointArn"]
 
-    max_time = time.time() + 15 * 60  # 15 min
-    while time.time() < max_time:
-        describe_endpoint = sagemaker_boto_client.describe_endpoint(EndpointArn=endpoint_arn)
-        status = describe_endpoint["EndpointProperties"]["Status"]
-
-        if status == "IN_ERROR":
-            sys.exit(1)
+    # polls with backoff and jitter until in service, 15 min at most
+    waiter = Waiter(
+        describe_poller(
+            lambda arn: sagemaker_boto_client.describe_endpoint(EndpointArn=arn),
+            lambda response: response["EndpointProperties"]["Status"],
+        ),
+        success=["IN_SERVICE"],
+        failure=["IN_ERROR"],
+        delay=5,
+        max_delay=30,
+        timeout=15 * 60,
+    )
+    try:
+        waiter.wait([endpoint_arn])
+    except WaiterError as e:
+        print(f"Endpoint not in service: {e}")
+        sys.exit(1)
 
-        if status == "IN_SERVICE":
-            endpoint_arn_output_dir = "/opt/ml/processing/endpoint_arn"
-            pathlib.Path(endpoint_arn_output_dir).mkdir(parents=True, exist_ok=True)
+    endpoint_arn_output_dir = "/opt/ml/processing/endpoint_arn"
+    pathlib.Path(endpoint_arn_output_dir).mkdir(parents=True, exist_ok=True)
 
-            print(f"Writing out endpoint arn {endpoint_arn}")
-            endpoint_arn_path = f"{endpoint_arn_output_dir}/endpoint_arn.txt"
-            with open(endpoint_arn_path, "w") as f:
-                f.write(endpoint_arn)
-            break
+    print(f"Writing out endpoint arn {endpoint_arn}")
+    endpoint_arn_path = f"{endpoint_arn_output_dir}/endpoint_arn.txt"
+    with open(endpoint_arn_path, "w") as f:
+        f.write(endpoint_arn)
 
 
 if __name__ == "__main__":
@@ -6,18 +6,33 @@ import time
 import os
 from random import randint
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import sagemaker
 import pandas as pd
 
+from waiters import Waiter, WaiterError
+
 
 #Initialise AWS Clients
 lambda_client = boto3.client('lambda')
 iam_client = boto3.client('iam')
 s3_client = boto3.client('s3')
 s3_resource = boto3.resource('s3')
+dynamodb_client = boto3.client('dynamodb')
+events_client = boto3.client('events')
+sqs_client = boto3.client('sqs')
 
 iam_desc = 'IAM Policy for Lambda triggering AWS SageMaker Pipeline'
+
+# managed policies of the Lambda functions' IAM role
+lambda_role_policies = [
+    'arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole',
+    'arn:aws:iam::aws:policy/AmazonSageMakerFullAccess',
+    'arn:aws:iam::aws:policy/AmazonEventBridgeFullAccess',
+    'arn:aws:iam::aws:policy/AmazonSNSFullAccess',
+    'arn:aws:iam::aws:policy/CloudWatchFullAccess',
+]
 # fcn_desc = 'AWS Lambda function for automatically triggering AWS SageMaker Pipeline.'
 
         
@@ -36,46 +51,112 @@ iam_trust_policy = {
 }
 
 
+def create_idempotency_table(table_name):
+    """Creates (or reuses) the DynamoDB table of the trigger's idempotency records, returns its ARN"""
+    print(f'Creating the DynamoDB table {table_name} ...')
+    try:
+        dynamodb_client.create_table(
+                TableName=table_name,
+                AttributeDefinitions=[{'AttributeName': 'pipeline_name', 'AttributeType': 'S'}],
+                KeySchema=[{'AttributeName': 'pipeline_name', 'KeyType': 'HASH'}],
+                BillingMode='PAY_PER_REQUEST'
+            )
+    except dynamodb_client.exceptions.ResourceInUseException:
+        print('The DynamoDB table already exists, reusing it')
+    dynamodb_client.get_waiter('table_exists').wait(TableName=table_name, WaiterConfig={'Delay': 2, 'MaxAttempts': 60})
+    print('SUCCESS: DynamoDB table is active!')
+    return dynamodb_client.describe_table(TableName=table_name)['Table']['TableArn']
+
+
+def create_debounce_queue(queue_name, visibility_timeout=900):
+    """
+    Creates (or reuses) the SQS queue of the trigger's delayed rechecks (DEBOUNCE_QUEUE_URL),
+    returns its URL and ARN. The visibility timeout must not be shorter than the Lambda timeout
+    """
+    print(f'Creating the SQS queue {queue_name} ...')
+    queue_url = sqs_client.create_queue(
+            QueueName=queue_name,
+            Attributes={'VisibilityTimeout': str(visibility_timeout), 'MessageRetentionPeriod': '86400'}
+        )['QueueUrl']
+    queue_arn = sqs_client.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['QueueArn'])['Attributes']['QueueArn']
+    print('SUCCESS: SQS queue is ready!')
+    return queue_url, queue_arn
+
+
+def create_queue_trigger(fcn_name, queue_arn, batch_size=10):
+    """Event source mapping delivering the delayed rechecks of the queue to the Lambda"""
+    print('Creating the SQS trigger of the Lambda function ...')
+    try:
+        lambda_client.create_event_source_mapping(EventSourceArn=queue_arn, FunctionName=fcn_name,
+                                                  BatchSize=batch_size, Enabled=True)
+    except lambda_client.exceptions.ResourceConflictException:
+        print('The queue already triggers the function')
+    print('SUCCESS: Successfully created the SQS trigger!')
+
+
+def add_trigger_policy(role_name, table_arn, bucket, policy_name='pipeline-trigger-idempotency', queue_arn=None):
+    """
+    Inline policy of the Lambda role: the idempotency records in DynamoDB, the
+    uploaded training data read for the fingerprint and the queue of the delayed
+    rechecks if any, put_role_policy is idempotent
+    """
+    policy = {
+        'Version': '2012-10-17',
+        'Statement': [
+            {
+                'Effect': 'Allow',
+                'Action': ['dynamodb:GetItem', 'dynamodb:PutItem', 'dynamodb:UpdateItem'],
+                'Resource': table_arn
+            },
+            {
+                'Effect': 'Allow',
+                'Action': 's3:GetObject',
+                'Resource': f'arn:aws:s3:::{bucket}/*'
+            }
+        ]
+    }
+    if queue_arn:
+        policy['Statement'].append({
+            'Effect': 'Allow',
+            'Action': ['sqs:SendMessage', 'sqs:ReceiveMessage', 'sqs:DeleteMessage', 'sqs:GetQueueAttributes'],
+            'Resource': queue_arn
+        })
+    iam_client.put_role_policy(RoleName=role_name, PolicyName=policy_name, PolicyDocument=json.dumps(policy))
+    print(f'SUCCESS: Policy {policy_name} added to the role {role_name}!')
+
+
 #Define function to allow Amazon S3 to trigger AWS Lambda
 def allow_s3(fcn_name,bucket_arn,account_num):
     print('Adding permissions to Amazon S3 ...')
-    response = lambda_client.add_permission(
-            FunctionName=fcn_name,
-            StatementId=f"S3-Trigger-Lambda-{int(time.time())}",
-            Action='lambda:InvokeFunction',
-            Principal= 's3.amazonaws.com',
-            SourceArn=bucket_arn,
-            SourceAccount=account_num
-        )
+    try:
+        # one statement per bucket, so a re-run finds it instead of adding another one
+        response = lambda_client.add_permission(
+                FunctionName=fcn_name,
+                StatementId=f"S3-Trigger-Lambda-{bucket_arn.split(':')[-1].replace('.', '-')}",
+                Action='lambda:InvokeFunction',
+                Principal= 's3.amazonaws.com',
+                SourceArn=bucket_arn,
+                SourceAccount=account_num
+            )
+    except lambda_client.exceptions.ResourceConflictException:
+        print('Amazon S3 is already allowed to invoke the function')
     print('SUCCESS: Successfully added permissions to Amazon S3!')
 
         
 
-def add_permissions(name):
+def add_permissions(name, policy_arns=lambda_role_policies, max_workers=8):
     print("Adding permissions to AWS Lambda function's IAM role ...")
-    add_execution_role = iam_client.attach_role_policy(
-            RoleName=name,
-            PolicyArn='arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole'
-        )
+    # attaching is idempotent, only the missing policies are attached, concurrently
+    attached = set()
+    for page in iam_client.get_paginator('list_attached_role_policies').paginate(RoleName=name):
+        attached.update(policy['PolicyArn'] for policy in page['AttachedPolicies'])
     
-    add_execution_role = iam_client.attach_role_policy(
-                RoleName=name,
-                PolicyArn='arn:aws:iam::aws:policy/AmazonSageMakerFullAccess'
-            )
-    add_execution_role = iam_client.attach_role_policy(
-            RoleName=name,
-            PolicyArn='arn:aws:iam::aws:policy/AmazonEventBridgeFullAccess'
-        )
-    add_execution_role = iam_client.attach_role_policy(
-            RoleName=name,
-            PolicyArn='arn:aws:iam::aws:policy/AmazonSNSFullAccess'
-        )
-    add_execution_role = iam_client.attach_role_policy(
-            RoleName=name,
-            PolicyArn='arn:aws:iam::aws:policy/CloudWatchFullAccess'
-        )
+    missing = [policy_arn for policy_arn in policy_arns if policy_arn not in attached]
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(missing)))) as pool:
+        list(pool.map(lambda policy_arn: iam_client.attach_role_policy(RoleName=name, PolicyArn=policy_arn), missing))
     
-    print("SUCCESS: Successfully added permissions AWS Lambda function's IAM role!")
+    print(f"SUCCESS: Successfully added permissions AWS Lambda function's IAM role! "
+          f"({len(missing)} attached, {len(policy_arns) - len(missing)} already attached)")
 
 
 def attach_sns_policy(role_name, sns_policy_name):
@@ -121,15 +202,12 @@ def create_sns_policy(role_name, sns_policy_name, region, account_id, fcn_name,
 
     #     sns_policy_name='lambda-sns-trigger-policy'
 
-        # Call the list_policies() method to get a list of all policies in the account
-        response = iam_client.list_policies()
-
-        # Loop through the policies and check if the policy name or ARN exists
-        for policy in response['Policies']:
-            if policy['PolicyName'] == sns_policy_name:
-                print(f"\n The policy {sns_policy_name} already exists. \n")
-                break
-        else:
+        # Look the customer managed policy up by its ARN instead of scanning the policy list
+        policy_arn = f"arn:aws:iam::{account_id}:policy/{sns_policy_name}"
+        try:
+            iam_client.get_policy(PolicyArn=policy_arn)
+            print(f"\n The policy {sns_policy_name} already exists. \n")
+        except iam_client.exceptions.NoSuchEntityException:
             print(f"The policy {sns_policy_name} does not exist and creating new policy...")
 
             sns_policy_response = iam_client.create_policy(
@@ -144,13 +222,18 @@ def create_sns_policy(role_name, sns_policy_name, region, account_id, fcn_name,
 # creating role
 def create_role(role_name):
     print('Creating an IAM role for AWS Lambda function ...')
-    create_iam_role = iam_client.create_role(
-        RoleName=role_name,
-        AssumeRolePolicyDocument=json.dumps(iam_trust_policy),
-        Description=iam_desc
-        )
-    print('SUCCESS: Successfully created IAM role for AWS Lambda function!')
-    time.sleep(10)
+    try:
+        create_iam_role = iam_client.create_role(
+            RoleName=role_name,
+            AssumeRolePolicyDocument=json.dumps(iam_trust_policy),
+            Description=iam_desc
+            )
+        print('SUCCESS: Successfully created IAM role for AWS Lambda function!')
+    except iam_client.exceptions.EntityAlreadyExistsException:
+        create_iam_role = iam_client.get_role(RoleName=role_name)
+        print('The IAM role already exists, reusing it')
+    # readiness polling instead of a fixed sleep
+    iam_client.get_waiter('role_exists').wait(RoleName=role_name, WaiterConfig={'Delay': 1, 'MaxAttempts': 30})
     add_permissions(role_name)
     return {
             'arn': create_iam_role['Role']['Arn'],
@@ -158,21 +241,62 @@ def create_role(role_name):
         }  
 
 
-def create_lambda(module_name, fcn_name, fcn_desc, fcn_code, role_arn):
+def create_lambda(module_name, fcn_name, fcn_desc, fcn_code, role_arn, timeout=10, memory_size=128,
+                  ready_timeout=120, environment=None):
     print('Creating AWS Lambda function ...')
-    new_fcn = lambda_client.create_function(
-            FunctionName=fcn_name,
-            Runtime='python3.8',
-            Role=role_arn,
-            Handler=f'{module_name}.lambda_handler',
-            Code=dict(ZipFile=fcn_code),
-            Description=fcn_desc,
-            Timeout=10,
-            MemorySize=128,
-            Publish=True
-        )
+    result = {}
+    # environment variables of the function (PIPELINE_NAME, IDEMPOTENCY_TABLE, ENDPOINT_NAME, ...)
+    environment = {'Variables': dict(environment or {})}
+    
+    def create(pending):
+        try:
+            result.update(lambda_client.create_function(
+                    FunctionName=fcn_name,
+                    Runtime='python3.8',
+                    Role=role_arn,
+                    Handler=f'{module_name}.lambda_handler',
+                    Code=dict(ZipFile=fcn_code),
+                    Description=fcn_desc,
+                    Timeout=timeout,
+                    MemorySize=memory_size,
+                    Environment=environment,
+                    Publish=True
+                ))
+            return {fcn_name: 'Created'}
+        except lambda_client.exceptions.InvalidParameterValueException as e:
+            # a new role can not be assumed by Lambda until IAM propagated it
+            if 'cannot be assumed' not in str(e):
+                raise
+            return {fcn_name: 'RoleNotReady'}
+        except lambda_client.exceptions.ResourceConflictException:
+            # re-run: the function exists, only its code and configuration are updated
+            lambda_client.update_function_code(FunctionName=fcn_name, ZipFile=fcn_code, Publish=True)
+            function_ready(fcn_name, ready_timeout)
+            result.update(lambda_client.update_function_configuration(
+                    FunctionName=fcn_name, Role=role_arn, Handler=f'{module_name}.lambda_handler',
+                    Description=fcn_desc, Timeout=timeout, MemorySize=memory_size, Environment=environment
+                ))
+            return {fcn_name: 'Updated'}
+    
+    try:
+        Waiter(create, success=['Created', 'Updated'], delay=1, max_delay=8, timeout=ready_timeout).wait([fcn_name])
+    except WaiterError as e:
+        raise RuntimeError(f'The IAM role {role_arn} could not be assumed by Lambda: {e}')
+    function_ready(fcn_name, ready_timeout)
     print('SUCCESS: Successfully created AWS Lambda function!')
-    return new_fcn['FunctionArn']
+    return result['FunctionArn']
+
+
+def function_ready(fcn_name, ready_timeout=120):
+    """Polls the function until it is active and its last update is finished"""
+    def status(pending):
+        configuration = lambda_client.get_function_configuration(FunctionName=fcn_name)
+        if configuration['State'] == 'Failed' or configuration.get('LastUpdateStatus') == 'Failed':
+            return {fcn_name: 'Failed'}
+        ready = configuration['State'] == 'Active' and configuration.get('LastUpdateStatus', 'Successful') == 'Successful'
+        return {fcn_name: 'Ready' if ready else 'Pending'}
+    
+    Waiter(status, success=['Ready'], failure=['Failed'], delay=1, max_delay=8, timeout=ready_timeout).wait([fcn_name])
 
 
 def add_notif(bucket, prefix, lambda_fcn_arn):
@@ -206,6 +330,36 @@ def add_notif(bucket, prefix, lambda_fcn_arn):
         )
     print('SUCCESS: Successfully added notifications to Amazon S3 Bucket!')
     
+def create_pipeline_status_trigger(fcn_name, lambda_fcn_arn, pipeline_name, account_num,
+                                   rule_name='ContentSMPipelineFinishedRule'):
+    """
+    EventBridge rule invoking the Lambda when an execution of the pipeline finished,
+    the uploads queued while it was running are then started
+    """
+    print('Creating the EventBridge rule on the pipeline execution status ...')
+    pattern = {
+        'source': ['aws.sagemaker'],
+        'detail-type': ['SageMaker Model Building Pipeline Execution Status Change'],
+        'detail': {'currentPipelineExecutionStatus': ['Succeeded', 'Failed', 'Stopped']},
+    }
+    rule_arn = events_client.put_rule(Name=rule_name, EventPattern=json.dumps(pattern), State='ENABLED',
+                                      Description=f'Drains the uploads queued during the executions of {pipeline_name}')['RuleArn']
+    try:
+        lambda_client.add_permission(
+                FunctionName=fcn_name,
+                StatementId=f'Events-{rule_name}',
+                Action='lambda:InvokeFunction',
+                Principal='events.amazonaws.com',
+                SourceArn=rule_arn,
+                SourceAccount=account_num
+            )
+    except lambda_client.exceptions.ResourceConflictException:
+        print('EventBridge is already allowed to invoke the function')
+    events_client.put_targets(Rule=rule_name, Targets=[{'Id': f'{fcn_name}-target', 'Arn': lambda_fcn_arn}])
+    print('SUCCESS: Successfully created the pipeline status rule!')
+    return rule_arn
+
+
 def create_s3_trigger(fcn_name,bucket,prefix, account_num, lambda_fcn_arn):
     bucket_arn = f"arn:aws:s3:::{bucket}"
     allow_s3(fcn_name,bucket_arn,account_num)
@@ -1,11 +1,24 @@
+import os
+import csv
 import json
+import uuid
+import zlib
+import codecs
+import hashlib
 import boto3
 import datetime
 import logging
+import threading
 import time
+from decimal import Decimal
+from urllib.parse import unquote_plus
+from botocore.exceptions import ClientError
+
+import waiters
 
 s3 = boto3.resource('s3')
 sm = boto3.client('sagemaker')
+sqs = boto3.client('sqs')
 # Connect to SES (Simple Email Service)
 ses = boto3.client('ses')
 time_created = datetime.datetime.now()
@@ -16,19 +29,235 @@ logger = logging.getLogger()
 # Setting the threshold of logger to DEBUG
 logger.setLevel(logging.INFO)
 
+# uploads closer than this (seconds) are coalesced into a single pipeline execution
+QUIET_WINDOW_SECONDS = float(os.environ.get("QUIET_WINDOW_SECONDS", "60"))
+# longest delay of an SQS message, the quiet window of the delayed rechecks (DEBOUNCE_QUEUE_URL) is capped to it
+MAX_RECHECK_DELAY_SECONDS = 900
+# an invocation claiming the start holds it until the execution started, at most this long (seconds)
+CLAIM_LEASE_SECONDS = float(os.environ.get("CLAIM_LEASE_SECONDS", "300"))
+# object suffixes that are training data
+TRIGGER_SUFFIXES = tuple(os.environ.get("TRIGGER_SUFFIXES", ".csv,.parquet").split(","))
+# pipeline execution statuses meaning an execution is already running or queued
+ACTIVE_STATUSES = ("Executing",)
+# seconds to wait for the started execution to finish, 0 to return right after starting it
+WAIT_FOR_EXECUTION_SECONDS = float(os.environ.get("WAIT_FOR_EXECUTION_SECONDS", "0"))
+# pipeline execution statuses after which the uploads queued meanwhile are drained
+FINISHED_STATUSES = ("Succeeded", "Failed", "Stopped")
+PIPELINE_STATUS_DETAIL_TYPE = "SageMaker Model Building Pipeline Execution Status Change"
+# endpoint serving the model of the pipeline, its tag holds the fingerprint of the deployed training data
+ENDPOINT_NAME = os.environ.get("ENDPOINT_NAME")
+FINGERPRINT_TAG = "data-fingerprint"
 
-# check the pipeline execution status
-def check_pipeline_status(sm, pipeline_execution_arn):
+# Copy of train/fingerprint.py (the Lambda is deployed as a single file), both must stay identical
+FINGERPRINT_VERSION = "v1"
+FINGERPRINT_COLUMNS = ["artwork_id", "artist_id", "artwork_medium", "materials", "artwork_year", "artwork_price"]
+NUMERIC_COLUMNS = ("artwork_id", "artwork_year", "artwork_price")
+NA_VALUES = {"", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+             "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"}
+HASH_MODULUS = 2 ** 128
 
-    # Get the response of latest execution of the pipeline
-    pipeline_arn_response = sm.describe_pipeline_execution(
-        PipelineExecutionArn=pipeline_execution_arn
-    )
 
-    # Extract the status of the latest execution
-    status = pipeline_arn_response['PipelineExecutionStatus']
+def normalize_value(column, value):
+    """normalized text of a raw value of a fit column, '' for missing values"""
+    value = "" if value is None else str(value).strip()
+    if value in NA_VALUES:
+        return ""
+    if column not in NUMERIC_COLUMNS:
+        return value
+
+    try:
+        number = float(value)
+    except ValueError:
+        return value
+    if number != number:
+        return ""
+    if column == "artwork_id" and number.is_integer():
+        return str(int(number))
+    return repr(number)
+
+
+class DataFingerprint:
+    """
+    Order independent content hash of the normalized fit columns (sum of the row hashes)
+    """
+
+    def __init__(self):
+        self.n_rows = 0
+        self.total = 0
+
+    def add_row(self, values):
+        row = [normalize_value(column, values.get(column)) for column in FINGERPRINT_COLUMNS]
+        if not row[0]:
+            return
+        digest = hashlib.blake2b("\x1f".join(row).encode("utf-8"), digest_size=16).digest()
+        self.total = (self.total + int.from_bytes(digest, "big")) % HASH_MODULUS
+        self.n_rows += 1
+
+    def add_csv(self, lines):
+        reader = csv.reader(lines)
+        header = next(reader, None)
+        if header is None:
+            return
+        header = [name.lstrip("\ufeff").strip().lower() for name in header]
+        columns = [(position, name) for position, name in enumerate(header) if name in FINGERPRINT_COLUMNS]
+        for record in reader:
+            if record:
+                self.add_row({name: record[position] for position, name in columns if position < len(record)})
+
+    def hexdigest(self):
+        return f"{FINGERPRINT_VERSION}-{self.n_rows}-{self.total:032x}"
+
 
-    return status
+class InMemoryIdempotencyStore:
+    """
+    Idempotency records of the pipeline trigger kept in memory: local
+    stand-in of DynamoDBIdempotencyStore (tests, single container), with
+    the same conditional semantics
+    """
+
+    def __init__(self):
+        self.records = {}
+        self.lock = threading.Lock()
+
+    def get(self, pipeline_name):
+        with self.lock:
+            record = self.records.get(pipeline_name)
+            return dict(record) if record else None
+
+    def record_upload(self, pipeline_name, token, now, keys):
+        """marks the invocation as the latest upload of the pipeline and queues its keys"""
+        with self.lock:
+            record = self.records.setdefault(pipeline_name, {"pipeline_name": pipeline_name})
+            record["last_upload_token"] = token
+            record["last_upload_time"] = now
+            record["pending_keys"] = record.get("pending_keys", []) + list(keys)
+
+    def claim(self, pipeline_name, token, now, lease):
+        """
+        claims the start of an execution, only for the latest upload and when no other
+        claim is alive. Returns the coalesced keys, None when the claim is refused
+        """
+        with self.lock:
+            record = self.records.get(pipeline_name, {})
+            if record.get("last_upload_token") != token or record.get("claim_time", float("-inf")) >= now - lease:
+                return None
+            keys = record.pop("pending_keys", [])
+            record["claim_token"], record["claim_time"] = token, now
+            return keys
+
+    def release(self, pipeline_name, token):
+        """releases the claim without starting an execution"""
+        with self.lock:
+            record = self.records.get(pipeline_name, {})
+            if record.get("claim_token") == token:
+                record.pop("claim_time", None)
+
+    def discard_pending(self, pipeline_name, token):
+        """drops the queued keys, only if no newer upload arrived. True when dropped"""
+        with self.lock:
+            record = self.records.get(pipeline_name, {})
+            if record.get("last_upload_token") != token:
+                return False
+            record.pop("pending_keys", None)
+            return True
+
+    def record_execution(self, pipeline_name, token, execution_arn, now):
+        """records the started execution and releases the claim"""
+        with self.lock:
+            record = self.records.setdefault(pipeline_name, {"pipeline_name": pipeline_name})
+            record["execution_arn"], record["execution_time"] = execution_arn, now
+            if record.get("claim_token") == token:
+                record.pop("claim_time", None)
+
+
+class DynamoDBIdempotencyStore:
+    """
+    Idempotency records of the pipeline trigger in a DynamoDB table
+    (partition key 'pipeline_name'), shared by the concurrent invocations
+    """
+
+    def __init__(self, table_name):
+        self.table = boto3.resource("dynamodb").Table(table_name)
+
+    def get(self, pipeline_name):
+        return self.table.get_item(Key={"pipeline_name": pipeline_name}, ConsistentRead=True).get("Item")
+
+    def record_upload(self, pipeline_name, token, now, keys):
+        self.table.update_item(
+            Key={"pipeline_name": pipeline_name},
+            UpdateExpression="SET last_upload_token = :token, last_upload_time = :now, "
+                             "pending_keys = list_append(if_not_exists(pending_keys, :empty), :keys)",
+            ExpressionAttributeValues={":token": token, ":now": Decimal(str(now)), ":empty": [], ":keys": list(keys)},
+        )
+
+    def claim(self, pipeline_name, token, now, lease):
+        try:
+            response = self.table.update_item(
+                Key={"pipeline_name": pipeline_name},
+                UpdateExpression="SET claim_token = :token, claim_time = :now REMOVE pending_keys",
+                ConditionExpression="last_upload_token = :token AND "
+                                    "(attribute_not_exists(claim_time) OR claim_time < :expired)",
+                ExpressionAttributeValues={":token": token, ":now": Decimal(str(now)), ":expired": Decimal(str(now - lease))},
+                ReturnValues="ALL_OLD",
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return None
+            raise
+        return response.get("Attributes", {}).get("pending_keys", [])
+
+    def release(self, pipeline_name, token):
+        try:
+            self.table.update_item(
+                Key={"pipeline_name": pipeline_name},
+                UpdateExpression="REMOVE claim_time",
+                ConditionExpression="claim_token = :token",
+                ExpressionAttributeValues={":token": token},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+
+    def discard_pending(self, pipeline_name, token):
+        try:
+            self.table.update_item(
+                Key={"pipeline_name": pipeline_name},
+                UpdateExpression="REMOVE pending_keys",
+                ConditionExpression="last_upload_token = :token",
+                ExpressionAttributeValues={":token": token},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            raise
+        return True
+
+    def record_execution(self, pipeline_name, token, execution_arn, now):
+        self.table.update_item(
+            Key={"pipeline_name": pipeline_name},
+            UpdateExpression="SET execution_arn = :arn, execution_time = :now REMOVE claim_time",
+            ExpressionAttributeValues={":arn": execution_arn, ":now": Decimal(str(now))},
+        )
+
+
+# the in memory store lives as long as the Lambda container
+local_store = InMemoryIdempotencyStore()
+
+
+def idempotency_store():
+    """DynamoDB store when IDEMPOTENCY_TABLE is set, the in memory stand-in otherwise"""
+    table_name = os.environ.get("IDEMPOTENCY_TABLE")
+    return DynamoDBIdempotencyStore(table_name) if table_name else local_store
+
+
+# statuses of pipeline executions once they all finished, or at the deadline (batched polls with backoff)
+def check_pipeline_status(sm, pipeline_name, pipeline_execution_arns, timeout=60):
+    waiter = waiters.pipeline_execution_waiter(sm, pipeline_name, timeout=timeout)
+    try:
+        return waiter.wait(pipeline_execution_arns, fail_fast=False)
+    except waiters.WaiterError as e:
+        logger.info("%s", e)
+        return e.statuses
 
 
 # send email notification on successful execution of pipeline
@@ -67,6 +296,209 @@ def send_email_notification(ses, subject, body, source, recipient):
     return response
 
 
+# training data uploads of an S3 event
+def uploaded_objects(event):
+    uploads = []
+    for record in event.get('Records', []):
+        if 's3' not in record:
+            continue
+        bucket = record['s3']['bucket']['name']
+        key = unquote_plus(record['s3']['object']['key'])
+        if key.lower().endswith(TRIGGER_SUFFIXES):
+            uploads.append(f"s3://{bucket}/{key}")
+    return uploads
+
+
+# text lines of a streamed S3 object, gzip files decompressed on the fly
+def object_lines(body, compressed=False):
+    decompressor = zlib.decompressobj(wbits=31) if compressed else None
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = ''
+    for chunk in body.iter_chunks(1 << 20):
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+        lines = (pending + decoder.decode(chunk)).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+# fingerprint of the fit columns of the uploaded files, None when a file can not be read here (Parquet, zip, ...)
+def uploads_fingerprint(s3, uploads):
+    fingerprint = DataFingerprint()
+    for upload in uploads:
+        bucket, key = upload[len('s3://'):].split('/', 1)
+        if not key.lower().endswith(('.csv', '.csv.gz')):
+            return None
+        body = s3.Object(bucket, key).get()['Body']
+        fingerprint.add_csv(object_lines(body, compressed=key.lower().endswith('.gz')))
+    return fingerprint.hexdigest()
+
+
+# fingerprint of the training data of the model deployed on the endpoint, None if not known
+def deployed_fingerprint(sm, endpoint_name):
+    if not endpoint_name:
+        return None
+    try:
+        endpoint_arn = sm.describe_endpoint(EndpointName=endpoint_name)['EndpointArn']
+        tags = sm.list_tags(ResourceArn=endpoint_arn)['Tags']
+    except ClientError as e:
+        logger.info("No fingerprint for the endpoint %s: %s", endpoint_name, e)
+        return None
+    return next((tag['Value'] for tag in tags if tag['Key'] == FINGERPRINT_TAG), None)
+
+
+# True when the uploads hold the same training data as the deployed model, False when unknown or unreadable
+def unchanged_data(sm, s3, uploads, endpoint_name):
+    try:
+        fingerprint = uploads_fingerprint(s3, uploads)
+        logger.info("Fingerprint of the uploaded data: %s", fingerprint)
+        return fingerprint is not None and fingerprint == deployed_fingerprint(sm, endpoint_name)
+    except Exception as e:
+        logger.warning("Could not fingerprint the uploads, starting the pipeline anyway: %s", e)
+        return False
+
+
+# True when an execution of the pipeline is already running or queued
+def pipeline_active(sm, pipeline_name):
+    executions = sm.list_pipeline_executions(
+        PipelineName=pipeline_name, SortBy='CreationTime', SortOrder='Descending', MaxResults=10
+    )['PipelineExecutionSummaries']
+    return any(execution['PipelineExecutionStatus'] in ACTIVE_STATUSES for execution in executions)
+
+
+# SQS queue of the delayed rechecks, None to wait for the quiet window in the invocation
+def debounce_queue():
+    queue_url = os.environ.get("DEBOUNCE_QUEUE_URL")
+    if queue_url and not os.environ.get("IDEMPOTENCY_TABLE"):
+        # the recheck may run in another container, which does not see the in memory records
+        logger.warning("DEBOUNCE_QUEUE_URL needs IDEMPOTENCY_TABLE, waiting for the quiet window in the invocation")
+        return None
+    return queue_url
+
+
+# schedules the trailing edge check of an upload, a message delivered once the quiet window elapsed
+def schedule_recheck(sqs, queue_url, pipeline_name, token, uploads):
+    delay = int(min(max(QUIET_WINDOW_SECONDS, 0), MAX_RECHECK_DELAY_SECONDS))
+    if delay < QUIET_WINDOW_SECONDS:
+        logger.warning("Quiet window of %ss capped to the SQS delay limit of %ss", QUIET_WINDOW_SECONDS, delay)
+    sqs.send_message(
+        QueueUrl=queue_url,
+        MessageBody=json.dumps({'pipeline_name': pipeline_name, 'token': token, 'uploads': uploads}),
+        DelaySeconds=delay
+    )
+
+
+# waits for the quiet window, True when no newer upload arrived meanwhile
+def quiet_after(store, pipeline_name, token, context, sleep=time.sleep):
+    window = QUIET_WINDOW_SECONDS
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        # keeping time to start the pipeline
+        remaining = max(context.get_remaining_time_in_millis() / 1000 - 15, 0)
+        if remaining < window:
+            logger.warning("Quiet window clamped from %ss to %ss by the Lambda timeout, closer uploads may start "
+                           "separate executions: raise the timeout or set DEBOUNCE_QUEUE_URL", window, remaining)
+            window = remaining
+    sleep(window)
+
+    record = store.get(pipeline_name) or {}
+    return record.get('last_upload_token') == token
+
+
+# debounced, deduplicated start of the pipeline for the uploads of an event
+def trigger_pipeline(sm, store, pipeline_name, uploads, token, context=None, sleep=time.sleep, clock=time.time,
+                     s3=None, endpoint_name=ENDPOINT_NAME, sqs=None, queue_url=None):
+    store.record_upload(pipeline_name, token, clock(), uploads)
+
+    if queue_url:
+        # the quiet window is waited by the queue, no invocation is held (and billed) meanwhile
+        schedule_recheck(sqs, queue_url, pipeline_name, token, uploads)
+        return {'statusCode': 200, 'msg': 'recheck scheduled'}
+
+    # trailing edge of the burst: only the invocation of the last upload goes on
+    if not quiet_after(store, pipeline_name, token, context, sleep):
+        logger.info("Coalesced with a newer upload: %s", uploads)
+        return {'statusCode': 200, 'msg': 'coalesced'}
+
+    return start_pipeline(sm, store, pipeline_name, uploads, token, clock, s3, endpoint_name)
+
+
+# delayed trailing edge check of an upload, the pipeline starts only when no newer upload arrived since
+def recheck_pipeline(sm, store, pipeline_name, message, clock=time.time, s3=None, endpoint_name=ENDPOINT_NAME):
+    if message.get('pipeline_name') != pipeline_name:
+        return {'statusCode': 200, 'msg': 'other pipeline'}
+
+    uploads = message.get('uploads') or []
+    if (store.get(pipeline_name) or {}).get('last_upload_token') != message['token']:
+        logger.info("Coalesced with a newer upload: %s", uploads)
+        return {'statusCode': 200, 'msg': 'coalesced'}
+
+    return start_pipeline(sm, store, pipeline_name, uploads, message['token'], clock, s3, endpoint_name)
+
+
+# start of the pipeline once the quiet window elapsed, unless running, unchanged or claimed by another invocation
+def start_pipeline(sm, store, pipeline_name, uploads, token, clock=time.time, s3=None, endpoint_name=ENDPOINT_NAME):
+    if pipeline_active(sm, pipeline_name):
+        logger.info("An execution of %s is already running, not starting another one", pipeline_name)
+        return {'statusCode': 200, 'msg': 'skipped: execution already running'}
+
+    # no-op data drops (same rows as the deployed model was trained on) do not retrain,
+    # checked before claiming so nothing is held while the uploads are read
+    if s3 is not None and endpoint_name:
+        pending = list(dict.fromkeys((store.get(pipeline_name) or {}).get('pending_keys') or uploads))
+        if pending and unchanged_data(sm, s3, pending, endpoint_name):
+            if not store.discard_pending(pipeline_name, token):
+                logger.info("Coalesced with a newer upload: %s", uploads)
+                return {'statusCode': 200, 'msg': 'coalesced'}
+            logger.info("Training data unchanged since the deployed model, not starting %s", pipeline_name)
+            return {'statusCode': 200, 'msg': 'skipped: training data unchanged'}
+
+    keys = store.claim(pipeline_name, token, clock(), CLAIM_LEASE_SECONDS)
+    if keys is None:
+        logger.info("Another invocation is starting %s", pipeline_name)
+        return {'statusCode': 200, 'msg': 'skipped: start already claimed'}
+
+    keys = list(dict.fromkeys(keys or uploads))
+    if not keys:
+        store.release(pipeline_name, token)
+        logger.info("No pending uploads for %s", pipeline_name)
+        return {'statusCode': 200, 'msg': 'nothing pending'}
+    logger.info("Starting %s for %d uploaded files: %s", pipeline_name, len(keys), keys)
+
+    #Start the pipeline execution
+    pipeline_exec_response = sm.start_pipeline_execution(
+                    PipelineName=pipeline_name,
+                    PipelineExecutionDisplayName=f"{keys[-1].split('/')[-1].split('.')[0].replace('_','')}"[:82] or 'upload',
+                    PipelineExecutionDescription=' '.join(keys)[:3072],
+                    ClientRequestToken=token[:128]
+                    )
+    logger.info('Response: %s', pipeline_exec_response)
+
+    store.record_execution(pipeline_name, token, pipeline_exec_response['PipelineExecutionArn'], clock())
+
+    return {'statusCode': 200, 'msg': pipeline_exec_response}
+
+
+# uploads queued while an execution was running, started once it finished
+def drain_pending(sm, store, pipeline_name, event, token, context=None, sleep=time.sleep, clock=time.time, s3=None,
+                  sqs=None, queue_url=None):
+    detail = event.get('detail', {})
+    if detail.get('pipelineArn', '').split('/')[-1].lower() != pipeline_name.lower():
+        return {'statusCode': 200, 'msg': 'other pipeline'}
+    if detail.get('currentPipelineExecutionStatus') not in FINISHED_STATUSES:
+        return {'statusCode': 200, 'msg': 'execution not finished'}
+
+    pending = (store.get(pipeline_name) or {}).get('pending_keys') or []
+    if not pending:
+        return {'statusCode': 200, 'msg': 'nothing pending'}
+
+    logger.info("Execution of %s finished, %d uploads pending: %s", pipeline_name, len(pending), pending)
+    return trigger_pipeline(sm, store, pipeline_name, [], token, context, sleep, clock, s3, sqs=sqs, queue_url=queue_url)
+
+
 def lambda_handler(event, context):
     
     response = {}
@@ -83,27 +515,39 @@ def lambda_handler(event, context):
 
         logger.info("Event is %s", event)
 
-        #Get location for where the new data (csv) file was uploaded
-        data_bucket = event['Records'][0]['s3']['bucket']['name']
-        data_key = event['Records'][0]['s3']['object']['key']
+        token = getattr(context, 'aws_request_id', None) or str(uuid.uuid4())
 
-        logger.info("A new file named %s was just uploaded to Amazon S3 in %s", data_key, data_bucket)
+        # EventBridge rule on the pipeline execution status changes
+        if event.get('detail-type') == PIPELINE_STATUS_DETAIL_TYPE:
+            return drain_pending(sm, idempotency_store(), pipeline_name, event, token, context, s3=s3, sqs=sqs,
+                                 queue_url=debounce_queue())
 
-        #Start the pipeline execution
-        pipeline_exec_response = sm.start_pipeline_execution(
-                        PipelineName=pipeline_name,
-                        PipelineExecutionDisplayName=f"{data_key.split('/')[-1].replace('_','').replace('.csv','')}",
-                        PipelineExecutionDescription=data_key
-                        )
-        logger.info('Response: %s', pipeline_exec_response)
-        
-        pipeline_arn = pipeline_exec_response['PipelineExecutionArn']
+        # delayed rechecks of the uploads, delivered by the DEBOUNCE_QUEUE_URL queue
+        messages = [json.loads(record['body']) for record in event.get('Records', [])
+                    if record.get('eventSource') == 'aws:sqs']
+        if messages:
+            store = idempotency_store()
+            responses = [recheck_pipeline(sm, store, pipeline_name, message, s3=s3) for message in messages]
+            return responses[-1]
 
-#         pipeline_status = check_pipeline_status(sm, pipeline_arn)
-#         logger.info('Pipeline status: %s', pipeline_status)
-        
-        response={'statusCode': 200,
-                 'msg': pipeline_exec_response}
+        #Get the locations of all the new data files of the event
+        uploads = uploaded_objects(event)
+        if not uploads:
+            logger.info("No training data file in the event")
+            return {'statusCode': 200, 'msg': 'no training data uploaded'}
+
+        logger.info("%d new files were just uploaded to Amazon S3: %s", len(uploads), uploads)
+
+        response = trigger_pipeline(sm, idempotency_store(), pipeline_name, uploads, token, context, s3=s3, sqs=sqs,
+                                    queue_url=debounce_queue())
+
+        execution_arn = response['msg'].get('PipelineExecutionArn') if isinstance(response['msg'], dict) else None
+        if execution_arn and WAIT_FOR_EXECUTION_SECONDS > 0:
+            timeout = WAIT_FOR_EXECUTION_SECONDS
+            if hasattr(context, 'get_remaining_time_in_millis'):
+                timeout = min(timeout, max(context.get_remaining_time_in_millis() / 1000 - 5, 0))
+            pipeline_status = check_pipeline_status(sm, pipeline_name, [execution_arn], timeout)
+            logger.info('Pipeline status: %s', pipeline_status)
         
         return response
             
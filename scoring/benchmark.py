@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+"""
+Load test of the scoring handlers (input_fn -> predict_fn -> output_fn) on a
+model artifact, with synthetic skewed item id traffic. Runs in process and
+against a local HTTP stand-in of the serving container (or any --url serving
+/invocations), and reports the throughput, latency percentiles, model load
+time and memory.
+
+    python benchmark.py --model-dir /opt/ml/model --requests 20000 --concurrency 1 4 16
+    python benchmark.py --model-dir model --mode http --url http://localhost:8080
+"""
+import json
+import time
+import argparse
+import socket
+import resource
+import threading
+import http.client
+from urllib.parse import urlparse
+from multiprocessing import Process
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import inference
+
+
+def rss_mb(pid='self'):
+    """
+    Resident memory of a process in MiB
+
+    ---------- Input ---------------
+    pid: process id, 'self' for this process
+
+    ---------- output ---------------
+    rss: resident set size (MiB), peak RSS of this process when /proc is not available
+
+    """
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def synthetic_requests(item_ids, n_requests, zipf_a=1.2, batch_size=0, unknown_rate=0.0, seed=0):
+    """
+    JSON request bodies with a skewed (Zipf) popularity over the items
+
+    ---------- Input ---------------
+    item_ids: item ids of the model
+    n_requests: number of requests
+    zipf_a: Zipf exponent, the larger the more skewed the traffic
+    batch_size: item ids per request, 0 for single {"itemId": ...} requests
+    unknown_rate: share of the item ids that are not in the model
+    seed: random seed
+
+    ---------- output ---------------
+    bodies: list of encoded JSON bodies
+
+    """
+    rng = np.random.default_rng(seed)
+    item_ids = np.asarray(item_ids)
+    popularity = rng.permutation(len(item_ids))
+
+    n_ids = n_requests * max(batch_size, 1)
+    ranks = (rng.zipf(zipf_a, n_ids) - 1) % len(item_ids)
+    ids = item_ids[popularity[ranks]].astype(np.int64)
+    unknown = rng.random(n_ids) < unknown_rate
+    ids[unknown] = -1 - rng.integers(0, 1 << 30, unknown.sum())
+    ids = ids.tolist()
+
+    if batch_size == 0:
+        return [json.dumps({'itemId': item_id}).encode('utf-8') for item_id in ids]
+    return [json.dumps({'itemIds': ids[start:start + batch_size]}).encode('utf-8')
+            for start in range(0, n_ids, batch_size)]
+
+
+def invoke(model, body, content_type='application/json', accept='application/json'):
+    """
+    Runs the handlers on one request like the serving container does
+
+    ---------- output ---------------
+    response: encoded response body
+
+    """
+    prediction = inference.output_fn(inference.predict_fn(inference.input_fn(body, content_type), model), accept)
+    if isinstance(prediction, (bytes, str)):
+        return prediction if isinstance(prediction, bytes) else prediction.encode('utf-8')
+    return json.dumps(prediction, default=str).encode('utf-8')
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    /ping and /invocations of the serving container on top of the handlers
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # headers and body are written separately, Nagle would delay the body by an ack
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def respond(self, status, body=b'', content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.respond(200 if self.path == '/ping' else 404)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path != '/invocations':
+            return self.respond(404)
+        try:
+            response = invoke(self.server.model, body, self.headers.get('Content-Type', 'application/json'),
+                              self.headers.get('Accept', 'application/json'))
+        except Exception as e:
+            return self.respond(400, str(e).encode('utf-8'), 'text/plain')
+        self.respond(200, response, self.headers.get('Accept', 'application/json'))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_stand_in(model_dir, port):
+    """
+    Local HTTP stand-in of the serving container, run in its own process
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), StandInHandler)
+    server.daemon_threads = True
+    server.model = inference.model_fn(model_dir)
+    server.serve_forever()
+
+
+def wait_until_ready(url, timeout=120):
+    """
+    Polls /ping until the server answers
+    """
+    target = urlparse(url)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection(target.hostname, target.port, timeout=1)
+            connection.request('GET', '/ping')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f'{url} did not answer /ping within {timeout}s')
+
+
+def http_sender(url):
+    """
+    Function posting a body to /invocations, one keep-alive connection per thread
+    """
+    target = urlparse(url)
+    local = threading.local()
+
+    def send(body):
+        if getattr(local, 'connection', None) is None:
+            local.connection = http.client.HTTPConnection(target.hostname, target.port, timeout=30)
+        try:
+            local.connection.request('POST', '/invocations', body=body,
+                                     headers={'Content-Type': 'application/json', 'Accept': 'application/json'})
+            response = local.connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            local.connection = None
+            raise
+        if response.status != 200:
+            raise RuntimeError(f'HTTP {response.status}')
+
+    return send
+
+
+def run_load(send, bodies, concurrency):
+    """
+    Sends all the requests with `concurrency` client threads
+
+    ---------- Input ---------------
+    send: function sending one request body
+    bodies: request bodies
+    concurrency: number of client threads
+
+    ---------- output ---------------
+    latencies: latency of every successful request (seconds)
+    elapsed: wall clock time of the run (seconds)
+    errors: number of failed requests
+
+    """
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+
+    def client(worker):
+        for body in bodies[worker::concurrency]:
+            start = time.perf_counter()
+            try:
+                send(body)
+            except Exception:
+                errors[worker] += 1
+                continue
+            latencies[worker].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(worker,)) for worker in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return np.concatenate([np.asarray(worker_latencies) for worker_latencies in latencies]), elapsed, sum(errors)
+
+
+def report(mode, concurrency, latencies, elapsed, errors, rss):
+    """
+    Prints one result row
+    """
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000 if len(latencies) else (np.nan,) * 3
+    print(f'{mode:>10} {concurrency:>6} {len(latencies) / elapsed:>10.0f} {p50:>9.3f} {p95:>9.3f} {p99:>9.3f} '
+          f'{errors:>7} {rss:>9.1f}')
+
+
+def benchmark(args):
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    model = inference.model_fn(args.model_dir)
+    load_time = time.perf_counter() - start
+    print(f'Model: {args.model_dir}, {len(model.item_ids)} items, loaded in {load_time:.3f}s, '
+          f'RSS {rss_before:.1f} -> {rss_mb():.1f} MiB')
+
+    bodies = synthetic_requests(model.item_ids, args.requests, args.zipf, args.batch_size, args.unknown_rate)
+    print(f'{args.requests} requests, batch size {args.batch_size}, zipf {args.zipf}')
+    print(f'{"mode":>10} {"conc.":>6} {"req/s":>10} {"p50 (ms)":>9} {"p95 (ms)":>9} {"p99 (ms)":>9} '
+          f'{"errors":>7} {"RSS (MiB)":>9}')
+
+    if 'inprocess' in args.mode:
+        for concurrency in args.concurrency:
+            latencies, elapsed, errors = run_load(lambda body: invoke(model, body), bodies, concurrency)
+            report('inprocess', concurrency, latencies, elapsed, errors, rss_mb())
+
+    if 'http' in args.mode:
+        server, url = None, args.url
+        if url is None:
+            url = f'http://127.0.0.1:{args.port}'
+            server = Process(target=serve_stand_in, args=(args.model_dir, args.port), daemon=True)
+            server.start()
+        try:
+            wait_until_ready(url)
+            send = http_sender(url)
+            for concurrency in args.concurrency:
+                latencies, elapsed, errors = run_load(send, bodies, concurrency)
+                report('http', concurrency, latencies, elapsed, errors, rss_mb(server.pid) if server else np.nan)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model-dir', type=str, default='/opt/ml/model')
+    parser.add_argument('--mode', type=str, nargs='+', choices=['inprocess', 'http'], default=['inprocess', 'http'])
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--batch-size', type=int, default=0)
+    parser.add_argument('--zipf', type=float, default=1.2)
+    parser.add_argument('--unknown-rate', type=float, default=0.0)
+    parser.add_argument('--url', type=str, default=None, help='running server, the local stand-in is used otherwise')
+    parser.add_argument('--port', type=int, default=8089)
+    args = parser.parse_args()
+
+    benchmark(args)
@@ -1,60 +1,1200 @@
 #inferencing code starts here .....
 import os
+import re
+import sys
 import json
+import time
+import random
+import io
+import zlib
+import fcntl
+import threading
 import numpy as np
+from collections import OrderedDict
 from joblib import load
+from scipy import sparse
 from sagemaker_inference import content_types, decoder
 from sagemaker_inference import encoder
+from sagemaker_inference import errors
 
 # prefix = "/opt/ml/"
 # model_dir = os.path.join(prefix, "model")
 
+# compact model artifact written by train/artwork_content_recsys.py
+ARTIFACT_MANIFEST = "manifest.json"
+LEGACY_MODEL = "artwork_content_model.pkl"
+
+JSON_LINES = ("application/jsonlines", "application/x-jsonlines", "application/jsonl")
+# bulk scoring: item id arrays in, neighbour id matrices [B, k] (-1 padded) out
+CSV = "text/csv"
+NPY = "application/x-npy"
+
+# optional request parameters: number of recommendations and attribute filters
+DEFAULT_K = 10
+FILTERS = ("exclude_same_artist", "same_medium", "medium", "min_price", "max_price")
+
+# logging and metrics, configured through the endpoint environment
+LOG_SAMPLE_RATE = float(os.environ.get("SCORING_LOG_SAMPLE_RATE", "0.01"))
+METRICS_INTERVAL = float(os.environ.get("SCORING_METRICS_INTERVAL", "60"))
+METRICS_NAMESPACE = os.environ.get("SCORING_METRICS_NAMESPACE", "ArtworkContent/Inference")
+
+# hot reload: new artifacts are published as versioned subdirectories of the watched path
+MODEL_WATCH_PATH = os.environ.get("MODEL_WATCH_PATH")
+MODEL_RELOAD_INTERVAL = float(os.environ.get("MODEL_RELOAD_INTERVAL", "30"))
+
+# pre-serialized default responses: LRU size, and whether all items are encoded at load time
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "100000"))
+RESPONSE_CACHE_PRELOAD = os.environ.get("RESPONSE_CACHE_PRELOAD", "false").lower() == "true"
+
+# live exclusions (sold / withdrawn artworks), shared by the worker processes through files, empty to disable
+EXCLUSION_DIR = os.environ.get("EXCLUSION_DIR", "/tmp/artwork_exclusions")
+# durable copy of the exclusion updates (s3://bucket/prefix/), replayed by new instances and
+# pulled every EXCLUSION_SYNC_INTERVAL seconds; without it the exclusions live only as long as the instance
+EXCLUSION_S3_URI = os.environ.get("EXCLUSION_S3_URI")
+EXCLUSION_SYNC_INTERVAL = float(os.environ.get("EXCLUSION_SYNC_INTERVAL", "60"))
+# the update log is folded into a snapshot (last state of every item) once it holds this many stored updates
+# or bytes; the snapshot is also written to the store, a new instance only replays the updates made after it
+EXCLUSION_COMPACT_UPDATES = int(os.environ.get("EXCLUSION_COMPACT_UPDATES", "1000"))
+EXCLUSION_COMPACT_BYTES = int(os.environ.get("EXCLUSION_COMPACT_BYTES", str(1 << 20)))
+
+
+class RequestError(errors.GenericInferenceToolkitError, ValueError):
+    """Invalid request (bad parameter, unknown item), answered with a 4xx status instead of a server error"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(status_code, message)
+
+    def __str__(self):
+        return self.message
+
+
+def request_k(value, max_k):
+    """Number of recommendations of a request: a positive integer, clamped to the stored top K"""
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    elif isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, (int, np.integer)) or value < 1:
+        raise RequestError(f"k must be a positive integer, got {value!r}")
+    return min(int(value), max_k)
+
+
+def request_item_id(value):
+    """Item id of a request as an int, RequestError when it is not an integer"""
+    try:
+        if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+            raise ValueError(value)
+        return int(value)
+    except (TypeError, ValueError):
+        raise RequestError(f"itemId must be an integer, got {value!r}")
+
+
+def request_item_ids(value, name="itemIds"):
+    """Item ids of a request as a list of ints, RequestError when it is not a list of integers"""
+    if not isinstance(value, (list, tuple)):
+        raise RequestError(f"{name} must be a list of item ids, got {value!r}")
+    return [request_item_id(item_id) for item_id in value]
+
+
+def request_price(name, value):
+    """Price bound of a filter as a float, RequestError when it is not a number"""
+    try:
+        if isinstance(value, bool):
+            raise ValueError(value)
+        price = float(value)
+    except (TypeError, ValueError):
+        raise RequestError(f"{name} must be a number, got {value!r}")
+    if np.isnan(price):
+        raise RequestError(f"{name} must be a number, got {value!r}")
+    return price
+
+
+class ArtworkModel:
+    """
+    Ranked neighbours of every artwork: item id index [N], neighbour
+    positions [N, K] (-1 for padding) and scores [N, K]. The arrays are
+    memory mapped, so loading is constant time and the pages are shared
+    between the worker processes.
+    """
+
+    def __init__(self, item_ids, neighbours, scores, sorted_ids=False, attributes=None, medium_vocabulary=None,
+                 matrix=None, squared_norms=None, feature_encoder=None, metric="cosine"):
+        self.item_ids = item_ids
+        self.neighbours = neighbours
+        self.scores = scores
+        self.sorted_ids = sorted_ids
+        self.index = None if sorted_ids else {item_id: position for position, item_id in enumerate(item_ids.tolist())}
+        # per item prices, years, medium_codes and artist_codes used by the filters
+        self.attributes = attributes
+        self.medium_codes = {medium: code for code, medium in enumerate(medium_vocabulary or [])}
+        # encoded catalog [N, F] and feature pipeline of new items, for the cold start recommendations
+        self.matrix = matrix
+        self.squared_norms = squared_norms
+        self.feature_encoder = feature_encoder
+        self.metric = metric
+        # JSON bytes of the default responses, dropped with the model on a reload
+        self.response_cache = ResponseCache(self)
+        # sold / withdrawn items skipped by the lookups, see ExclusionBitmap
+        self.exclusions = None
+
+    @classmethod
+    def from_artifact(cls, model_dir):
+        with open(os.path.join(model_dir, ARTIFACT_MANIFEST)) as f:
+            manifest = json.load(f)
+
+        files = manifest["files"]
+        arrays = {name: np.load(os.path.join(model_dir, file), mmap_mode="r") for name, file in files.items()}
+
+        attributes = {name: arrays[name] for name in ("prices", "years", "medium_codes", "artist_codes") if name in arrays}
+
+        matrix, feature_encoder = None, None
+        if manifest.get("cold_start") and "matrix_data" in arrays:
+            matrix = sparse.csr_matrix((arrays["matrix_data"], arrays["matrix_indices"], arrays["matrix_indptr"]),
+                                       shape=(manifest["n_items"], manifest["n_features"]), copy=False)
+            with open(os.path.join(model_dir, manifest["cold_start"])) as f:
+                feature_encoder = FeatureEncoder(json.load(f))
+
+        return cls(arrays["item_ids"], arrays["neighbours"], arrays["scores"], manifest.get("sorted_ids", False),
+                   attributes or None, manifest.get("medium_vocabulary"), matrix, arrays.get("squared_norms"),
+                   feature_encoder, manifest.get("metric", "cosine"))
+
+    @classmethod
+    def from_pickle(cls, model_path):
+        # legacy artifact: dictionary of item id -> [[item id, score, rank], ...]
+        results = load(model_path)
+
+        item_ids = np.array(sorted(results), dtype=np.int64)
+        top_k = max((len(result) for result in results.values()), default=0)
+        neighbours = np.full((len(item_ids), top_k), -1, dtype=np.int64)
+        scores = np.zeros((len(item_ids), top_k), dtype=np.float32)
+
+        for position, item_id in enumerate(item_ids.tolist()):
+            result = results[item_id]
+            if result:
+                neighbours[position, :len(result)] = [row[0] for row in result]
+                scores[position, :len(result)] = [row[1] for row in result]
+
+        # stored neighbour ids -> positions in the item index
+        valid = neighbours >= 0
+        positions = np.searchsorted(item_ids, neighbours[valid])
+        positions[positions >= len(item_ids)] = 0
+        known = item_ids[positions] == neighbours[valid]
+        neighbours[valid] = np.where(known, positions, -1)
+
+        return cls(item_ids, neighbours.astype(np.int32), scores, sorted_ids=True)
+
+    def positions(self, item_ids):
+        """Positions of the given item ids in the item index, -1 when unknown"""
+        item_ids = np.asarray(item_ids, dtype=np.int64)
+
+        if not self.sorted_ids:
+            return np.array([self.index.get(item_id, -1) for item_id in item_ids.tolist()], dtype=np.int64)
+
+        positions = np.searchsorted(self.item_ids, item_ids)
+        positions[positions >= len(self.item_ids)] = 0
+        return np.where(self.item_ids[positions] == item_ids, positions, -1)
+
+    def recommendations(self, item_id, k=DEFAULT_K, filters=None):
+        """Top k recommended item ids of an item, KeyError when the item is not in the model"""
+        rec = self.batch_recommendations([item_id], k=k, filters=filters)[0]
+        if rec is None:
+            raise KeyError(item_id)
+        return rec
+
+    def filter_mask(self, neighbours, filters, query_artists, query_mediums):
+        """Neighbours [B, K] passing the filters, given the artist and medium codes [B] of the queries"""
+        keep = neighbours >= 0
+        neighbours = np.where(keep, neighbours, 0)
+
+        if filters.get("exclude_same_artist"):
+            query_artists = np.asarray(query_artists)[:, None]
+            keep &= (self.attributes["artist_codes"][neighbours] != query_artists) | (query_artists < 0)
+
+        if filters.get("same_medium"):
+            keep &= self.attributes["medium_codes"][neighbours] == np.asarray(query_mediums)[:, None]
+
+        if filters.get("medium") is not None:
+            wanted = filters["medium"] if isinstance(filters["medium"], list) else [filters["medium"]]
+            codes = [self.medium_codes[medium] for medium in wanted if medium in self.medium_codes]
+            keep &= np.isin(self.attributes["medium_codes"][neighbours], codes)
+
+        # items without a price never pass a price filter
+        if filters.get("min_price") is not None:
+            keep &= self.attributes["prices"][neighbours] >= float(filters["min_price"])
+        if filters.get("max_price") is not None:
+            keep &= self.attributes["prices"][neighbours] <= float(filters["max_price"])
+
+        return keep
+
+    def top_k_ids(self, positions, k=DEFAULT_K, filters=None):
+        """Top k recommended item ids [B, <=k] of the query positions [B] and the number of valid ids per row"""
+        excluding = self.exclusions is not None and self.exclusions.active()
+        walk = bool(filters) or excluding
+
+        if walk:
+            # walk the whole stored list (K columns at most) and keep the first k passing neighbours
+            neighbours = self.neighbours[positions]
+            if filters:
+                if self.attributes is None:
+                    raise ValueError("filters need a model artifact with item attributes")
+                valid = self.filter_mask(neighbours, filters, self.attributes["artist_codes"][positions],
+                                         self.attributes["medium_codes"][positions])
+            else:
+                valid = neighbours >= 0
+            if excluding:
+                valid &= ~self.exclusions.excluded(np.where(valid, neighbours, 0))
+            valid &= np.cumsum(valid, axis=1) <= k
+        else:
+            # one gather for the whole batch, the -1 padding is only at the end of the rows
+            neighbours = self.neighbours[positions, :k]
+            valid = neighbours >= 0
+
+        ids = self.item_ids[np.where(valid, neighbours, 0)]
+        if walk:
+            # moving the passing neighbours to the front of the rows
+            order = np.argsort(~valid, axis=1, kind="stable")[:, :k]
+            ids = np.take_along_axis(ids, order, axis=1)
+        return ids, valid.sum(axis=1)
+
+    def batch_recommendations(self, item_ids, k=DEFAULT_K, filters=None):
+        """Top k recommended item ids of every item in one vectorized lookup, None for unknown items"""
+        positions = self.positions(item_ids)
+        known = positions >= 0
+
+        ids, counts = self.top_k_ids(positions[known], k, filters)
+        counts = counts.tolist()
+        ids = ids.tolist()
+
+        recs = [None] * len(positions)
+        for row, position in enumerate(np.flatnonzero(known).tolist()):
+            recs[position] = ids[row][:counts[row]]
+        return recs
+
+    def neighbour_ids(self, item_ids, k=DEFAULT_K, filters=None):
+        """Top k recommended item ids [B, k] of every item as one array, -1 for unknown items and padding"""
+        positions = self.positions(item_ids)
+        known = positions >= 0
+
+        ids, counts = self.top_k_ids(positions[known], k, filters)
+        neighbours = np.full((len(positions), k), -1, dtype=np.int64)
+        neighbours[known, :ids.shape[1]] = np.where(np.arange(ids.shape[1]) < counts[:, None], ids, -1)
+        return neighbours
+
+    def similarity_scores(self, intersection, query_norm):
+        """Similarity of a query to every item from their dot products, like the training metric"""
+        if self.metric == "cosine":
+            numerator, denominator = intersection, np.sqrt(query_norm * self.squared_norms)
+        elif self.metric == "dice":
+            numerator, denominator = 2 * intersection, query_norm + self.squared_norms
+        else:
+            numerator, denominator = intersection, query_norm + self.squared_norms - intersection
+
+        scores = np.zeros(len(intersection), dtype=np.float64)
+        np.divide(numerator, denominator, out=scores, where=denominator > 0)
+        return scores
+
+    def cold_start_recommendations(self, attributes, k=DEFAULT_K, filters=None):
+        """
+        Top k recommended item ids of a new item from its raw attributes: one sparse
+        matrix-vector product over the catalog, then the training top-K and re-ranking
+        """
+        if self.feature_encoder is None:
+            raise ValueError("cold start needs a model artifact with the encoded catalog")
+
+        features, weights = self.feature_encoder.encode(attributes)
+        query = np.zeros(self.matrix.shape[1], dtype=np.float64)
+        query[features] = weights
+        scores = self.similarity_scores(self.matrix @ query, float(weights @ weights))
+
+        # the stored list length (at least k) of best scored items
+        n_candidates = min(max(k, self.neighbours.shape[1]), len(scores))
+        if n_candidates == 0:
+            return []
+        kth = -np.partition(-scores, n_candidates - 1)[n_candidates - 1]
+        candidates = np.flatnonzero(scores >= kth)
+
+        medium = self.medium_codes.get(str(attributes.get("artwork_medium")), -1)
+        artist = self.feature_encoder.primary_artist(attributes.get("artist_id"))
+
+        if self.attributes is not None:
+            # re-ranking of the training: score, same medium, closest year, closest price, item position.
+            # All the items tied at the kth score are ranked before the cut, like the training top-K
+            year, price = self.feature_encoder.number(attributes.get("artwork_year")), \
+                self.feature_encoder.number(attributes.get("artwork_price"))
+            same_medium = (self.attributes["medium_codes"][candidates] == medium) & (medium != -1)
+            year_sort = np.abs(self.attributes["years"][candidates] - year)
+            price_sort = np.abs(self.attributes["prices"][candidates] - price)
+            order = np.lexsort((candidates, price_sort, year_sort, -same_medium.astype(np.int8), -scores[candidates]))
+        else:
+            order = np.lexsort((candidates, -scores[candidates]))
+        candidates = candidates[order][:n_candidates]
+
+        if filters:
+            if self.attributes is None:
+                raise ValueError("filters need a model artifact with item attributes")
+            candidates = candidates[self.filter_mask(candidates[None, :], filters, [artist], [medium])[0]]
+
+        if self.exclusions is not None and self.exclusions.active():
+            candidates = candidates[~self.exclusions.excluded(candidates)]
+
+        return self.item_ids[candidates[:k]].tolist()
+
+
+class FeatureEncoder:
+    """
+    Feature pipeline of the training (materials grouping, year and price
+    buckets, artist split, one hot encoding) replayed on the raw attributes
+    of a new artwork, from the state saved with the artifact. Values unseen
+    at training time have no active feature, like in the training encoder.
+    """
+
+    def __init__(self, state):
+        encoder = state["encoder"]
+        self.columns = encoder["columns"]
+        self.weights = encoder["feature_weights"]
+        self.year_bins = state["year_bins"]
+        self.price_bins = state["price_bins"]
+        self.materials_map = state["materials_map"]
+        self.artist_codes = {artist: code for code, artist in enumerate(state["artist_vocabulary"])}
+
+        # '<column>' -> value -> feature position, in the encoder column order
+        self.features, offset = {}, 0
+        for column in self.columns:
+            vocabulary = encoder["vocabularies"][column]
+            self.features[column] = {value: offset + position for position, value in enumerate(vocabulary)}
+            offset += len(vocabulary)
+
+    @staticmethod
+    def number(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return np.nan
+
+    def bucket(self, value, bins):
+        """label of the (right closed) bin of a value, None outside the training range"""
+        value = self.number(value)
+        edges = bins["edges"] if bins else []
+        if np.isnan(value) or not edges or value < edges[0] or value > edges[-1]:
+            return None
+        return bins["labels"][max(int(np.searchsorted(edges, value, side="left")) - 1, 0)]
+
+    def material(self, text):
+        """grouped material value of a raw material text"""
+        if text is None:
+            return None
+        text = str(text)
+        if text in self.materials_map:
+            return self.materials_map[text]
+        # unseen text: its lower case words, kept when they match a training value
+        value = "_".join(re.findall(r"[a-z0-9]+", text.lower()))
+        return value if value in self.features.get("materials", {}) else None
+
+    def artists(self, artist_id):
+        """artist ids of an artwork, '12,34' for several artists"""
+        return [] if artist_id is None else str(artist_id).split(",")
+
+    def primary_artist(self, artist_id):
+        artists = self.artists(artist_id)
+        return self.artist_codes.get(artists[0].strip(), -1) if artists else -1
+
+    def values(self, attributes):
+        """encoded column -> value of a new artwork"""
+        values = {
+            "artwork_medium": attributes.get("artwork_medium"),
+            "materials": self.material(attributes.get("materials")),
+            "artwork_year": self.bucket(attributes.get("artwork_year"), self.year_bins),
+            "artwork_price": self.bucket(attributes.get("artwork_price"), self.price_bins),
+        }
+        # the first artist is the 'artist_id' column, the next ones artist1, artist2, ...
+        for position, artist in enumerate(self.artists(attributes.get("artist_id"))):
+            values["artist_id" if position == 0 else f"artist{position}"] = artist
+        return values
+
+    def encode(self, attributes):
+        """active feature positions and weights of a new artwork"""
+        features, weights = [], []
+        for column, value in self.values(attributes).items():
+            position = self.features.get(column, {}).get(str(value)) if value is not None else None
+            if position is not None:
+                features.append(position)
+                weights.append(float(self.weights.get(column, 1.0)))
+        return np.array(features, dtype=np.int64), np.array(weights, dtype=np.float64)
+
+
+class ResponseCache:
+    """
+    Bounded LRU of the encoded JSON bytes of the default response
+    ({"rec": top DEFAULT_K ids}) of every requested item. The traffic is
+    skewed towards popular artworks, so most default requests are served
+    without building a list or encoding JSON. The cache can also be
+    filled for all the items (up to its size) when the model loads.
+    """
+
+    def __init__(self, model, max_items=RESPONSE_CACHE_SIZE):
+        self.model = model
+        self.max_items = max_items
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # generation of the exclusions the entries were built with
+        self.generation = 0
+
+    @staticmethod
+    def encode(rec):
+        return json.dumps({"rec": rec}).encode("utf-8")
+
+    def put(self, item_id, body):
+        with self.lock:
+            self.entries[item_id] = body
+            self.entries.move_to_end(item_id)
+            while len(self.entries) > self.max_items:
+                self.entries.popitem(last=False)
+
+    def preload(self, batch_size=10000):
+        if self.model.exclusions is not None:
+            self.generation = self.model.exclusions.generation
+        n_items = min(len(self.model.item_ids), self.max_items)
+        for start in range(0, n_items, batch_size):
+            item_ids = self.model.item_ids[start:min(start + batch_size, n_items)].tolist()
+            for item_id, rec in zip(item_ids, self.model.batch_recommendations(item_ids)):
+                self.put(item_id, self.encode(rec))
+
+    def get(self, item_id):
+        """Encoded default response of an item, KeyError when the item is not in the model"""
+        exclusions = self.model.exclusions
+        with self.lock:
+            # the cached responses are stale once the exclusions change
+            if exclusions is not None and exclusions.generation != self.generation:
+                self.entries.clear()
+                self.generation = exclusions.generation
+            body = self.entries.get(item_id)
+            if body is not None:
+                self.entries.move_to_end(item_id)
+
+        if body is not None:
+            metrics.increment("response_cache_hits")
+            return body
+
+        metrics.increment("response_cache_misses")
+        body = self.encode(self.model.recommendations(item_id))
+        if self.max_items > 0:
+            self.put(item_id, body)
+        return body
+
+
+class ExclusionStore:
+    """
+    Exclusion updates persisted on S3, one object per update named by its
+    time (no read-modify-write between the instances), so a listing returns
+    them in update order. The bitmaps of ExclusionBitmap are local files of
+    an instance: a redeployed endpoint, a replaced instance or the new fleet
+    of a blue/green update starts from the latest snapshot (the excluded item
+    ids as of its last_key, written by the instances when they compact their
+    log) and replays the updates written after it.
+    """
+
+    # updates written up to this long before the last applied one are listed again (clock skew, slow puts)
+    MARGIN_NS = 300 * 10 ** 9
+    SNAPSHOT = "snapshot.json"
+
+    def __init__(self, uri, client=None):
+        self.bucket, _, self.prefix = uri[len("s3://"):].partition("/")
+        if self.prefix and not self.prefix.endswith("/"):
+            self.prefix += "/"
+        self.client = client
+
+    def s3(self):
+        if self.client is None:
+            import boto3
+            self.client = boto3.client("s3")
+        return self.client
+
+    def new_key(self):
+        return f"{self.prefix}{time.time_ns():020d}-{os.getpid()}-{random.getrandbits(32):08x}.log"
+
+    def put(self, key, lines):
+        self.s3().put_object(Bucket=self.bucket, Key=key, Body=lines.encode("utf-8"))
+
+    @staticmethod
+    def key_ns(key):
+        """write time of an update key"""
+        return int(key.rsplit("/", 1)[-1][:20])
+
+    def updates(self, last_key=None, applied=()):
+        """(key, text) of the updates written since shortly before last_key, in update order, but the applied keys"""
+        kwargs = {"Bucket": self.bucket, "Prefix": self.prefix}
+        if last_key:
+            kwargs["StartAfter"] = f"{self.prefix}{max(self.key_ns(last_key) - self.MARGIN_NS, 0):020d}"
+        for page in self.s3().get_paginator("list_objects_v2").paginate(**kwargs):
+            for item in page.get("Contents", []):
+                # the snapshot sorts after the updates
+                if not item["Key"].endswith(".log") or item["Key"] in applied:
+                    continue
+                body = self.s3().get_object(Bucket=self.bucket, Key=item["Key"])["Body"]
+                yield item["Key"], body.read().decode("utf-8")
+
+    def snapshot(self):
+        """latest snapshot {'last_key', 'keys', 'excluded'}, None before the first one"""
+        key = self.prefix + self.SNAPSHOT
+        listing = self.s3().list_objects_v2(Bucket=self.bucket, Prefix=key, MaxKeys=1)
+        if not listing.get("Contents"):
+            return None
+        return json.loads(self.s3().get_object(Bucket=self.bucket, Key=key)["Body"].read())
+
+    def put_snapshot(self, snapshot):
+        # several instances may write one, any of them is a consistent starting point
+        self.s3().put_object(Bucket=self.bucket, Key=self.prefix + self.SNAPSHOT,
+                             Body=json.dumps(snapshot).encode("utf-8"))
+
+
+class ExclusionBitmap:
+    """
+    Sold or withdrawn artworks as a bitmap over the item index of a model,
+    updated at runtime without reloading the model. The bitmap is a file
+    mapped by every worker process (an update made through one worker is
+    seen by all of them); its 8 byte header is a generation counter bumped
+    on every update, used to invalidate the cached responses. The updates
+    are also appended to a log, replayed when a new model builds its bitmap,
+    and written to the ExclusionStore when one is configured. The log is
+    folded into a snapshot file once it holds compact_updates stored updates
+    (or compact_bytes), and the snapshot is written to the store as well.
+
+    The exclude / restore requests come through /invocations, so each one
+    reaches a single instance: its workers see the update at once, the other
+    instances at their next sync (up to EXCLUSION_SYNC_INTERVAL seconds later),
+    and never without EXCLUSION_S3_URI. Callers must not expect an excluded
+    item to disappear from every response right after the acknowledgement.
+    """
+
+    HEADER = 8
+
+    def __init__(self, model, directory=EXCLUSION_DIR, store=None, compact_updates=EXCLUSION_COMPACT_UPDATES,
+                 compact_bytes=EXCLUSION_COMPACT_BYTES):
+        self.model = model
+        self.directory = directory
+        self.store = store
+        self.compact_updates = compact_updates
+        self.compact_bytes = compact_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        # one bitmap per item index
+        item_ids = np.ascontiguousarray(model.item_ids, dtype=np.int64)
+        key = f"{len(item_ids)}_{zlib.crc32(item_ids.view(np.uint8)):08x}"
+        self.path = os.path.join(directory, f"bitmap_{key}.bin")
+        self.log_path = os.path.join(directory, "exclusions.log")
+        # keys of the stored updates already in the log
+        self.applied_path = os.path.join(directory, "applied_keys.log")
+        # the log folded into the last state of every item, see compact
+        self.snapshot_path = os.path.join(directory, "snapshot.json")
+        n_bytes = max((len(item_ids) + 7) // 8, 1)
+
+        with self.locked():
+            if not os.path.exists(self.path):
+                self.create(n_bytes)
+
+        self.header = np.memmap(self.path, dtype=np.uint64, mode="r+", shape=(1,))
+        self.bits = np.memmap(self.path, dtype=np.uint8, mode="r+", offset=self.HEADER, shape=(n_bytes,))
+        self.seen_generation, self.any_excluded = None, False
+
+        # updates made on other instances (or before this instance started)
+        if self.store is not None:
+            self.sync()
+
+    def locked(self):
+        """exclusive lock between the worker processes, for the updates"""
+        lock = open(os.path.join(self.directory, ".lock"), "a")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def create(self, n_bytes):
+        """builds the bitmap of the model from the snapshot and the update log, written aside then renamed"""
+        bits = np.zeros(n_bytes, dtype=np.uint8)
+        self.set_bits(bits, self.excluded_ids(), True)
+
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(np.zeros(1, dtype=np.uint64).tobytes())
+            f.write(bits.tobytes())
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def parse(lines):
+        """last update of every item in the log lines, item id -> excluded"""
+        return dict((int(line[1:]), line[0] == "+") for line in lines if line.strip())
+
+    def read_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return {"last_key": None, "keys": [], "excluded": []}
+        with open(self.snapshot_path) as f:
+            return json.load(f)
+
+    def write_snapshot(self, snapshot):
+        tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def excluded_ids(self, snapshot=None):
+        """excluded item ids, the snapshot then the last update of every item in the log"""
+        snapshot = snapshot or self.read_snapshot()
+        state = dict.fromkeys(snapshot["excluded"], True)
+        if os.path.exists(self.log_path):
+            with open(self.log_path) as f:
+                state.update(self.parse(f))
+        return [item_id for item_id, excluded in state.items() if excluded]
+
+    def set_bits(self, bits, item_ids, excluded):
+        positions = self.model.positions(item_ids)
+        positions = positions[positions >= 0]
+        masks = np.left_shift(1, positions & 7).astype(np.uint8)
+        if excluded:
+            np.bitwise_or.at(bits, positions >> 3, masks)
+        else:
+            np.bitwise_and.at(bits, positions >> 3, ~masks)
+
+    def rebuild(self):
+        """bitmap set again from the snapshot and the log, with the lock held"""
+        bits = np.zeros(len(self.bits), dtype=np.uint8)
+        self.set_bits(bits, self.excluded_ids(), True)
+        self.bits[:] = bits
+
+    @property
+    def generation(self):
+        return int(self.header[0])
+
+    def active(self):
+        """True when at least one item is excluded, rescanned only after an update"""
+        generation = self.generation
+        if generation != self.seen_generation:
+            self.seen_generation, self.any_excluded = generation, bool(self.bits.any())
+        return self.any_excluded
+
+    def excluded(self, positions):
+        """exclusion flags of the given item positions (any shape)"""
+        positions = np.asarray(positions)
+        return ((self.bits[positions >> 3] >> (positions & 7).astype(np.uint8)) & 1).astype(bool)
+
+    def update(self, item_ids, excluded=True):
+        """
+        Excludes (or restores) items, ids not in this model are only logged for the next models
+
+        ---------- output ---------------
+        count: number of excluded items of the model
+        """
+        item_ids = [int(item_id) for item_id in item_ids]
+        lines = "".join(f"{'+' if excluded else '-'}{item_id}\n" for item_id in item_ids)
+        key = self.store.new_key() if self.store is not None else None
+        snapshot = None
+        with self.locked():
+            with open(self.log_path, "a") as f:
+                f.write(lines)
+            if key is not None:
+                with open(self.applied_path, "a") as f:
+                    f.write(key + "\n")
+            self.set_bits(self.bits, item_ids, excluded)
+            self.header[0] += 1
+            self.bits.flush()
+            self.header.flush()
+            if self.compact_due():
+                snapshot = self.compact()
+
+        if key is not None:
+            # the update is applied locally, an error lets the caller retry it (updates are idempotent)
+            try:
+                self.store.put(key, lines)
+            except Exception as e:
+                metrics.increment("exclusion_store_errors")
+                logger.error("exclusion_store_failed", key=key, error=repr(e))
+                raise
+        self.publish(snapshot)
+        return self.count()
+
+    def sync(self):
+        """
+        Applies the stored updates missing from the local log, in update order. An instance
+        without any stored update yet starts from the latest snapshot of the store
+
+        ---------- output ---------------
+        n_updates: number of updates applied
+        """
+        with self.locked():
+            applied = self.applied_keys()
+        # S3 reads outside the lock, the updates of the other workers are not blocked meanwhile
+        snapshot = self.store.snapshot() if not applied else None
+        if snapshot is not None:
+            applied = set(snapshot["keys"])
+            last_key = snapshot["last_key"]
+        else:
+            last_key = max(applied, default=None)
+        updates = list(self.store.updates(last_key, applied))
+        if not updates and snapshot is None:
+            return 0
+
+        compacted = None
+        with self.locked():
+            local = self.read_snapshot()
+            if snapshot is not None and local["last_key"] is None:
+                # the log stays on top of the stored snapshot, items excluded before the store was used stay excluded
+                excluded = sorted(set(snapshot["excluded"]) | set(local["excluded"]))
+                self.write_snapshot({"last_key": snapshot["last_key"], "keys": snapshot["keys"], "excluded": excluded})
+                self.rebuild()
+            applied = self.applied_keys()
+            updates = [(key, text) for key, text in updates if key not in applied]
+            if updates:
+                lines = "".join(text for _, text in updates)
+                with open(self.log_path, "a") as f:
+                    f.write(lines)
+                with open(self.applied_path, "a") as f:
+                    f.write("".join(key + "\n" for key, _ in updates))
+                state = self.parse(lines.splitlines())
+                for excluded in (True, False):
+                    self.set_bits(self.bits, [item_id for item_id, value in state.items() if value == excluded],
+                                  excluded)
+            self.header[0] += 1
+            self.bits.flush()
+            self.header.flush()
+            if self.compact_due():
+                compacted = self.compact()
+
+        self.publish(compacted)
+        metrics.increment("exclusion_updates_synced", len(updates))
+        return len(updates)
+
+    def logged_keys(self):
+        """keys of the stored updates in the log"""
+        if not os.path.exists(self.applied_path):
+            return set()
+        with open(self.applied_path) as f:
+            return {line.strip() for line in f if line.strip()}
+
+    def applied_keys(self):
+        """keys of the stored updates in the log, and the recent ones folded into the snapshot"""
+        return self.logged_keys() | set(self.read_snapshot()["keys"])
+
+    def compact_due(self):
+        if os.path.exists(self.log_path) and os.path.getsize(self.log_path) > self.compact_bytes:
+            return True
+        return len(self.logged_keys()) > self.compact_updates
+
+    def compact(self):
+        """
+        Folds the log into the snapshot file (excluded item ids and the keys of the updates
+        it holds), with the lock held. Only the keys within ExclusionStore.MARGIN_NS of the
+        last one are kept, the older ones are not listed again
+
+        ---------- output ---------------
+        snapshot: the new snapshot
+        """
+        snapshot = self.read_snapshot()
+        excluded = sorted(self.excluded_ids(snapshot))
+        keys = self.applied_keys()
+        last_key = max(keys, key=ExclusionStore.key_ns, default=None)
+        if last_key is not None:
+            oldest_ns = ExclusionStore.key_ns(last_key) - ExclusionStore.MARGIN_NS
+            keys = {key for key in keys if ExclusionStore.key_ns(key) >= oldest_ns}
+
+        snapshot = {"last_key": last_key, "keys": sorted(keys), "excluded": excluded}
+        self.write_snapshot(snapshot)
+        # a crash before the removal replays the log on top of the snapshot, with the same result
+        for path in (self.log_path, self.applied_path):
+            if os.path.exists(path):
+                os.remove(path)
+        metrics.increment("exclusion_compactions")
+        return snapshot
+
+    def publish(self, snapshot):
+        """writes a compacted snapshot to the store, a failure only delays the next one"""
+        if snapshot is None or self.store is None or snapshot["last_key"] is None:
+            return
+        try:
+            self.store.put_snapshot(snapshot)
+        except Exception as e:
+            metrics.increment("exclusion_store_errors")
+            logger.error("exclusion_snapshot_failed", last_key=snapshot["last_key"], error=repr(e))
+
+    def count(self):
+        return int(np.unpackbits(self.bits).sum())
+
+
+class SampledLogger:
+    """
+    Structured (one JSON object per line) request logger. Only a sample
+    of the request events is written, errors are always written, so the
+    handlers do not pay a synchronous stdout write on every call.
+    """
+
+    def __init__(self, sample_rate=LOG_SAMPLE_RATE, stream=None):
+        self.sample_rate = sample_rate
+        self.stream = stream or sys.stdout
+
+    def sampled(self):
+        return self.sample_rate >= 1 or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def write(self, level, event, fields):
+        record = {"level": level, "event": event, "time": round(time.time(), 3)}
+        record.update(fields)
+        self.stream.write(json.dumps(record, default=str) + "\n")
+
+    def info(self, event, **fields):
+        if self.sampled():
+            self.write("INFO", event, fields)
+
+    def error(self, event, **fields):
+        self.write("ERROR", event, fields)
+
+
+class StageMetrics:
+    """
+    Per stage latency histograms (decode, lookup, encode, model_load)
+    aggregated in memory and written in one CloudWatch embedded metric
+    format document every METRICS_INTERVAL seconds, on the next request.
+    """
+
+    # upper bounds (ms) of the histogram buckets, the bucket value is its upper bound
+    BUCKETS = np.array([0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 60000])
+
+    # rate metrics (percent) derived from the counters of the interval: name -> (hits, misses)
+    RATES = {"response_cache_hit_rate": ("response_cache_hits", "response_cache_misses")}
+
+    def __init__(self, namespace=METRICS_NAMESPACE, interval=METRICS_INTERVAL, stream=None):
+        self.namespace = namespace
+        self.interval = interval
+        self.stream = stream or sys.stdout
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.last_flush = time.time()
+
+    def record(self, stage, seconds):
+        bucket = min(int(np.searchsorted(self.BUCKETS, seconds * 1000.0)), len(self.BUCKETS) - 1)
+        with self.lock:
+            counts = self.histograms.setdefault(stage, np.zeros(len(self.BUCKETS), dtype=np.int64))
+            counts[bucket] += 1
+        self.maybe_flush()
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def maybe_flush(self):
+        if time.time() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            histograms, self.histograms = self.histograms, {}
+            counters, self.counters = self.counters, {}
+            self.last_flush = time.time()
+
+        if not histograms and not counters:
+            return
+
+        document = {"_aws": {"Timestamp": int(self.last_flush * 1000), "CloudWatchMetrics": [
+            {"Namespace": self.namespace, "Dimensions": [[]], "Metrics": []}]}}
+        metrics = document["_aws"]["CloudWatchMetrics"][0]["Metrics"]
+
+        for stage, counts in histograms.items():
+            used = np.flatnonzero(counts)
+            name = f"{stage}_latency"
+            metrics.append({"Name": name, "Unit": "Milliseconds"})
+            document[name] = {"Values": self.BUCKETS[used].tolist(), "Counts": counts[used].tolist()}
+
+        for name, value in counters.items():
+            metrics.append({"Name": name, "Unit": "Count"})
+            document[name] = value
+
+        for name, (hits, misses) in self.RATES.items():
+            total = counters.get(hits, 0) + counters.get(misses, 0)
+            if total:
+                metrics.append({"Name": name, "Unit": "Percent"})
+                document[name] = round(100.0 * counters.get(hits, 0) / total, 2)
+
+        self.stream.write(json.dumps(document) + "\n")
+
+
+logger = SampledLogger()
+metrics = StageMetrics()
+exclusion_store = ExclusionStore(EXCLUSION_S3_URI) if EXCLUSION_S3_URI else None
+
+
+def load_model(model_dir):
+    start_time = time.time()
+
+    if os.path.exists(os.path.join(model_dir, ARTIFACT_MANIFEST)):
+        model = ArtworkModel.from_artifact(model_dir)
+    else:
+        model = ArtworkModel.from_pickle(os.path.join(model_dir, LEGACY_MODEL))
+
+    if EXCLUSION_DIR:
+        model.exclusions = ExclusionBitmap(model, store=exclusion_store)
+
+    if RESPONSE_CACHE_PRELOAD:
+        model.response_cache.preload()
+
+    load_time = time.time() - start_time
+    metrics.record("model_load", load_time)
+    logger.write("INFO", "model_loaded", {"path": model_dir, "seconds": round(load_time, 3), "items": len(model.item_ids)})
+    return model
+
+
+def validate_model(model):
+    """Consistency checks of a loaded model before it serves traffic, ValueError when broken"""
+    n_items = len(model.item_ids)
+    if n_items == 0:
+        raise ValueError("model has no items")
+    if model.neighbours.shape[0] != n_items or model.scores.shape != model.neighbours.shape:
+        raise ValueError(f"inconsistent shapes: {n_items} items, neighbours {model.neighbours.shape}, "
+                         f"scores {model.scores.shape}")
+    if model.neighbours.size and not (-1 <= int(model.neighbours.min()) and int(model.neighbours.max()) < n_items):
+        raise ValueError("neighbour positions out of range")
+    if model.sorted_ids and n_items > 1 and not np.all(model.item_ids[1:] > model.item_ids[:-1]):
+        raise ValueError("item ids are not sorted")
+
+    # probe lookup of the first item
+    model.recommendations(int(model.item_ids[0]))
+
+
+class ModelHandle:
+    """
+    Reference to the model currently served. A background thread watches
+    MODEL_WATCH_PATH for new artifacts (versioned subdirectories, the
+    last one in name order wins), loads and validates them off the request
+    path, then swaps the reference. Requests take a reference once
+    (handle.current) and keep serving from the old model meanwhile.
+    Artifacts must not be rewritten in place, the old model maps their files.
+    """
+
+    def __init__(self, model, model_dir, watch_path=MODEL_WATCH_PATH, interval=MODEL_RELOAD_INTERVAL):
+        self.current = model
+        self.model_dir = model_dir
+        self.version = 0
+        self.watch_path = watch_path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.watcher_pid = None
+        # artifacts that failed the validation are not retried
+        self.rejected = set()
+
+    def __getattr__(self, name):
+        # the handle can be used in place of the model
+        return getattr(self.current, name)
+
+    def latest_artifact(self):
+        if not self.watch_path or not os.path.isdir(self.watch_path):
+            return None
+        if os.path.exists(os.path.join(self.watch_path, ARTIFACT_MANIFEST)):
+            return self.watch_path
+
+        # the manifest is written last, a subdirectory without it is still being published
+        versions = [os.path.join(self.watch_path, name) for name in sorted(os.listdir(self.watch_path))]
+        versions = [path for path in versions if os.path.exists(os.path.join(path, ARTIFACT_MANIFEST))]
+        return versions[-1] if versions else None
+
+    def reload(self, model_dir):
+        """Loads, validates and swaps in the artifact of model_dir, the current model is kept on failure"""
+        with self.lock:
+            try:
+                model = load_model(model_dir)
+                validate_model(model)
+            except Exception as e:
+                self.rejected.add(model_dir)
+                metrics.increment("model_reload_errors")
+                logger.error("model_reload_failed", path=model_dir, error=repr(e))
+                return False
+
+            self.current, self.model_dir = model, model_dir
+            self.version += 1
+            metrics.increment("model_reloads")
+            logger.write("INFO", "model_swapped", {"path": model_dir, "version": self.version})
+            return True
+
+    def check(self):
+        latest = self.latest_artifact()
+        if latest is not None and latest != self.model_dir and latest not in self.rejected:
+            return self.reload(latest)
+        return False
+
+    def watch(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error("model_watch_failed", error=repr(e))
+
+    def sync_exclusions(self):
+        while True:
+            time.sleep(EXCLUSION_SYNC_INTERVAL)
+            try:
+                if self.current.exclusions is not None:
+                    self.current.exclusions.sync()
+            except Exception as e:
+                logger.error("exclusion_sync_failed", error=repr(e))
+
+    def ensure_watcher(self):
+        """Starts the watcher threads once per process (threads do not survive a fork)"""
+        if self.watcher_pid == os.getpid():
+            return
+        self.watcher_pid = os.getpid()
+        if self.watch_path and self.interval > 0:
+            threading.Thread(target=self.watch, name="model-watcher", daemon=True).start()
+        if exclusion_store is not None and EXCLUSION_SYNC_INTERVAL > 0:
+            threading.Thread(target=self.sync_exclusions, name="exclusion-sync", daemon=True).start()
+
 
 """
 Deserialize fitted model
 """
 def model_fn(model_dir):
-    model_path = os.path.join(model_dir, "artwork_content_model.pkl")
-    model = load(model_path)
-    print("Model Loaded ..\n")
-    return model
+    handle = ModelHandle(load_model(model_dir), model_dir)
+    # a newer artifact may already be published in the watched path
+    handle.check()
+    handle.ensure_watcher()
+    return handle
 
 
 """
 input_fn
     request_body: The body of the request sent to the model.
     request_content_type: (string) specifies the format/variable type of the request
+    raises RequestError: 415 for an unsupported content type, 400 for a body that cannot be parsed
 """
 def input_fn(request_body, request_content_type):
-    print('request body: ', request_body)
-    if request_content_type == 'application/json':
-        request_body = json.loads(request_body)
-        return request_body
-    else:
-        raise ValueError("This model only supports application/json input")
+    start_time = time.perf_counter()
+    logger.info('request', content_type=request_content_type, body=request_body)
+
+    if request_content_type not in ('application/json', CSV, NPY) + JSON_LINES:
+        logger.error('unsupported_content_type', content_type=request_content_type)
+        raise RequestError("This model only supports application/json, application/jsonlines, "
+                           "text/csv and application/x-npy input", 415)
+
+    try:
+        if request_content_type == 'application/json':
+            request_body = json.loads(request_body)
+            # a bare list of item ids is a batch request
+            if isinstance(request_body, list):
+                request_body = {'itemIds': request_body}
+            if not isinstance(request_body, dict):
+                raise RequestError("the request must be a JSON object or a list of item ids")
+        elif request_content_type in JSON_LINES:
+            # Batch Transform: one {"itemId": ...} record per line
+            if isinstance(request_body, bytes):
+                request_body = request_body.decode('utf-8')
+            records = [json.loads(line) for line in request_body.splitlines() if line.strip()]
+            if not all(isinstance(record, dict) and 'itemId' in record for record in records):
+                raise RequestError("every JSON Lines record must be an object with an itemId")
+            # k and the filters are read from the first record, they apply to the whole batch
+            request = {name: value for name, value in (records[0] if records else {}).items() if name != 'itemId'}
+            request['itemIds'] = [record['itemId'] for record in records]
+            request_body = request
+        elif request_content_type == CSV:
+            # item ids separated by commas and/or new lines, parsed straight into an array
+            if isinstance(request_body, bytes):
+                request_body = request_body.decode('utf-8')
+            item_ids = np.loadtxt(io.StringIO(request_body.replace(',', '\n')), dtype=np.int64, ndmin=1)
+            request_body = {'itemIds': item_ids}
+        else:
+            item_ids = np.load(io.BytesIO(request_body), allow_pickle=False)
+            request_body = {'itemIds': item_ids.astype(np.int64, copy=False).ravel()}
+    except RequestError:
+        raise
+    except (ValueError, TypeError, OSError) as e:
+        # malformed JSON, non UTF-8 bytes, non integer ids or a broken npy array
+        logger.error('request_decode_failed', content_type=request_content_type, error=repr(e))
+        raise RequestError(f"cannot parse the {request_content_type} request: {e}")
+
+    metrics.record('decode', time.perf_counter() - start_time)
+    return request_body
 
         
 """
 predict_fn
-    input_data: returned array from input_fn above
+    input_data: returned array from input_fn above, {'itemId': id} or {'itemIds': [id, ...]},
+        {'exclude': [id, ...]} / {'restore': [id, ...]} update the live exclusions (sold artworks)
+        of the instance answering, the other instances apply them at their next sync (see ExclusionBitmap),
+        a new artwork can send its raw 'attributes' (artwork_medium, materials, artwork_year,
+        artwork_price, artist_id), used when the itemId is missing or not in the model,
+        optionally with 'k' and the filters: 'exclude_same_artist', 'same_medium',
+        'medium' (name or list of names), 'min_price', 'max_price'
     model (mch content model) returned model loaded from model_fn above
+    default single item requests return the encoded JSON bytes of the response cache,
+    invalid requests raise RequestError: 400 for a bad k / itemId / price bound / exclude or restore id,
+    404 for an unknown itemId without attributes
 """
 # return prediction based on loaded model (from the step above) and an input payload
 def predict_fn(input_data, model):
+    start_time = time.perf_counter()
     rec = []
     response = {}
-    
-    print("input data: ", input_data)
-    item_id = int(input_data['itemId'])
-    
-    try:
-        rec = [i[0] for i in model[item_id]][:10]
-    except Exception as e:
-        rec = [type(input_data),str(e)]
-        
-    response = {'rec': rec}
-    
-    print('\n response: ', response)
+
+    # one model reference for the whole request, a hot reload may swap the handle meanwhile
+    if isinstance(model, ModelHandle):
+        model.ensure_watcher()
+        model = model.current
+
+    # optional number of recommendations and attribute filters
+    k = request_k(input_data.get('k', DEFAULT_K), model.neighbours.shape[1])
+    filters = {name: input_data[name] for name in FILTERS if input_data.get(name) is not None}
+    for name in ('min_price', 'max_price'):
+        if name in filters:
+            filters[name] = request_price(name, filters[name])
+
+    if 'exclude' in input_data or 'restore' in input_data:
+        # inventory update: {"exclude": [ids]} for sold / withdrawn artworks, {"restore": [ids]} to undo
+        if model.exclusions is None:
+            raise ValueError("exclusions are disabled (EXCLUSION_DIR)")
+        # all the ids are checked before any update
+        updates = {name: request_item_ids(input_data[name], name) for name in ('exclude', 'restore')
+                   if input_data.get(name) is not None}
+        if updates.get('exclude'):
+            model.exclusions.update(updates['exclude'], excluded=True)
+        if updates.get('restore'):
+            model.exclusions.update(updates['restore'], excluded=False)
+        response = {'excluded': model.exclusions.count()}
+        logger.write('INFO', 'exclusions_updated', {'exclude': len(input_data.get('exclude') or []),
+                                                    'restore': len(input_data.get('restore') or []),
+                                                    'excluded': response['excluded']})
+    elif isinstance(input_data.get('itemIds'), np.ndarray):
+        # array request (csv / npy): neighbour id matrix, no per item python objects
+        response = {'neighbours': model.neighbour_ids(input_data['itemIds'], k=k, filters=filters)}
+        metrics.increment('batch_items', len(input_data['itemIds']))
+    elif 'itemIds' in input_data:
+        # batch request: one recommendation list per item, empty for unknown items
+        item_ids = request_item_ids(input_data['itemIds'])
+        recs = model.batch_recommendations(item_ids, k=k, filters=filters)
+        response = {'recs': [rec if rec is not None else [] for rec in recs]}
+        metrics.increment('batch_items', len(item_ids))
+    else:
+        item_id = input_data.get('itemId')
+        attributes = input_data.get('attributes')
+
+        try:
+            if item_id is None and attributes is None:
+                raise RequestError("the request needs an itemId, itemIds or attributes")
+            known = item_id is not None and model.positions([request_item_id(item_id)])[0] >= 0
+            if known:
+                if k == DEFAULT_K and not filters:
+                    # default request: pre-serialized JSON bytes, passed through by output_fn
+                    response = model.response_cache.get(int(item_id))
+                else:
+                    rec = model.recommendations(int(item_id), k=k, filters=filters)
+            elif attributes is not None:
+                # new artwork, not in the model yet: neighbours computed from its raw attributes
+                cold_start_time = time.perf_counter()
+                rec = model.cold_start_recommendations(attributes, k=k, filters=filters)
+                metrics.record('cold_start', time.perf_counter() - cold_start_time)
+            else:
+                raise RequestError(f"unknown itemId {item_id}, send its attributes for a cold start", 404)
+        except Exception as e:
+            logger.error('prediction_failed', item_id=item_id, error=repr(e))
+            metrics.increment('request_errors' if isinstance(e, RequestError) else 'prediction_errors')
+            raise
+
+        if not response:
+            response = {'rec': rec}
+
+    metrics.record('lookup', time.perf_counter() - start_time)
+    logger.info('prediction', input=input_data, response=response)
     return response
 
 
@@ -62,6 +1202,46 @@ def predict_fn(input_data, model):
 After invoking predict_fn, the model server invokes output_fn, passing in the return-value from 
 predict_fn and the InvokeEndpoint requested response content-type.
 """
+def neighbours_matrix(prediction):
+    """Neighbour id matrix [B, k] of any prediction, -1 padded"""
+    if 'neighbours' in prediction:
+        return prediction['neighbours']
+
+    recs = prediction['recs'] if 'recs' in prediction else [prediction['rec']]
+    recs = [rec if all(isinstance(item_id, int) for item_id in rec) else [] for rec in recs]
+    neighbours = np.full((len(recs), max((len(rec) for rec in recs), default=0)), -1, dtype=np.int64)
+    for row, rec in enumerate(recs):
+        neighbours[row, :len(rec)] = rec
+    return neighbours
+
+
 def output_fn(prediction, content_type):
-    print('\n prediction results \n', prediction)
-    return prediction
\ No newline at end of file
+    start_time = time.perf_counter()
+
+    if isinstance(prediction, dict) and not {'neighbours', 'recs', 'rec'} & prediction.keys():
+        # exclude / restore acknowledgement, JSON whatever the accepted type
+        prediction = json.dumps(prediction)
+    elif content_type in (CSV, NPY):
+        if isinstance(prediction, bytes):
+            prediction = json.loads(prediction)
+        neighbours = neighbours_matrix(prediction)
+        buffer = io.BytesIO()
+        if content_type == NPY:
+            np.save(buffer, neighbours, allow_pickle=False)
+        else:
+            np.savetxt(buffer, neighbours, fmt='%d', delimiter=',')
+        prediction = buffer.getvalue()
+    elif isinstance(prediction, bytes):
+        # already encoded by the response cache
+        pass
+    elif 'neighbours' in prediction:
+        # array request answered in JSON
+        neighbours = prediction['neighbours']
+        recs = [row[:count] for row, count in zip(neighbours.tolist(), (neighbours >= 0).sum(axis=1).tolist())]
+        prediction = '\n'.join(json.dumps({'rec': rec}) for rec in recs) if content_type in JSON_LINES else {'recs': recs}
+    elif content_type in JSON_LINES and 'recs' in prediction:
+        # Batch Transform: one {"rec": [...]} line per input record
+        prediction = '\n'.join(json.dumps({'rec': rec}) for rec in prediction['recs'])
+
+    metrics.record('encode', time.perf_counter() - start_time)
+    return prediction
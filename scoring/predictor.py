@@ -0,0 +1,61 @@
+# This is the file that implements a flask server to do inferences. It's the file that you will modify to
+# implement the scoring for your own algorithm.
+
+from __future__ import print_function
+
+import os
+import json
+
+import flask
+
+import inference
+
+prefix = '/opt/ml/'
+model_path = os.environ.get('SM_MODEL_DIR', os.path.join(prefix, 'model'))
+
+# The model is loaded when the module is imported. gunicorn imports it once in the
+# master process (--preload) before forking the workers, and the artifact arrays are
+# memory mapped, so the workers share the pages of a single copy of the model.
+# The hot reload watcher is started lazily in every worker by predict_fn.
+model = inference.ModelHandle(inference.load_model(model_path), model_path)
+model.check()
+
+# The flask app for serving predictions
+app = flask.Flask(__name__)
+
+
+@app.route('/ping', methods=['GET'])
+def ping():
+    """Determine if the container is working and healthy. In this sample container, we declare
+    it healthy if we can load the model successfully."""
+    health = model.current is not None
+
+    status = 200 if health else 404
+    return flask.Response(response='\n', status=status, mimetype='application/json')
+
+
+@app.route('/invocations', methods=['POST'])
+def transformation():
+    """Do an inference on a single request. The request goes through the input_fn,
+    predict_fn and output_fn handlers of inference.py, like in the SageMaker framework containers.
+    """
+    content_type = flask.request.mimetype or 'application/json'
+    accept = flask.request.headers.get('Accept', 'application/json')
+    if accept in ('', '*/*'):
+        accept = 'application/json'
+
+    try:
+        data = inference.input_fn(flask.request.get_data(), content_type)
+        prediction = inference.output_fn(inference.predict_fn(data, model), accept)
+    except inference.RequestError as e:
+        # unsupported content type (415), unparsable body or invalid parameter (400), unknown item (404)
+        return flask.Response(response=json.dumps({'error': str(e)}), status=e.status_code,
+                              mimetype='application/json')
+    if not isinstance(prediction, (bytes, str)):
+        prediction = json.dumps(prediction, default=str)
+
+    # exclude / restore acknowledgements are JSON whatever the accepted type
+    if 'exclude' in data or 'restore' in data:
+        accept = 'application/json'
+
+    return flask.Response(response=prediction, status=200, mimetype=accept)
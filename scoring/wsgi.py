@@ -0,0 +1,16 @@
+import os
+
+# gevent workers: the standard library must be patched before the app is imported, which happens
+# in the gunicorn master with --preload (boto3 clients, locks and the model loading). Patching
+# only in the forked workers leaves those objects unpatched
+if os.environ.get('MODEL_SERVER_WORKER_CLASS', 'gthread') == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+import predictor as myapp
+
+# This is just a simple wrapper for gunicorn to find your app.
+# If you want to change the algorithm file, simply change "predictor" above to the
+# new file.
+
+app = myapp.app
@@ -0,0 +1,12 @@
+import os
+import sys
+
+# the Lambda and the utilities are top level modules of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+# the training modules import each other as top level modules of train/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'train'))
+# the inference handlers are top level modules of scoring/ in the serving container
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scoring'))
+
+# the Lambda module creates its boto3 clients at import time
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
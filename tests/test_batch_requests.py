@@ -0,0 +1,65 @@
+import io
+import json
+
+import numpy as np
+import pytest
+
+pytest.importorskip('sagemaker_inference')
+import inference
+from inference import ArtworkModel
+
+
+def model(n_items=30, top_k=12, seed=0):
+    rng = np.random.default_rng(seed)
+    item_ids = np.arange(1000, 1000 + 3 * n_items, 3, dtype=np.int64)
+    neighbours = np.stack([rng.permutation(np.delete(np.arange(n_items), row))[:top_k] for row in range(n_items)])
+    # the last item has a short (padded) list
+    neighbours[-1, 5:] = -1
+    return ArtworkModel(item_ids, neighbours.astype(np.int32), np.ones(neighbours.shape, dtype=np.float32),
+                        sorted_ids=True)
+
+
+def invoke(served, body, content_type, accept):
+    return inference.output_fn(inference.predict_fn(inference.input_fn(body, content_type), served), accept)
+
+
+def test_every_batch_format_returns_the_single_item_lists():
+    served = model()
+    item_ids = served.item_ids.tolist()[::-1] + [7]
+    expected = [served.recommendations(item_id, k=4) if item_id != 7 else [] for item_id in item_ids]
+
+    batch = invoke(served, json.dumps({'itemIds': item_ids, 'k': 4}).encode(), 'application/json', 'application/json')
+    assert batch == {'recs': expected}
+    # a bare list of ids uses the default k
+    assert invoke(served, json.dumps(item_ids).encode(), 'application/json', 'application/json') == \
+        {'recs': [served.recommendations(item_id) if item_id != 7 else [] for item_id in item_ids]}
+
+    lines = '\n'.join(json.dumps({'itemId': item_id, 'k': 4}) for item_id in item_ids).encode()
+    output = invoke(served, lines, 'application/jsonlines', 'application/jsonlines')
+    assert [json.loads(line)['rec'] for line in output.splitlines()] == expected
+
+    # csv and npy answer a -1 padded id matrix
+    padded = np.array([rec + [-1] * (4 - len(rec)) for rec in expected])
+    csv = ('\n'.join(str(item_id) for item_id in item_ids) + '\n').encode()
+    request = inference.input_fn(csv, 'text/csv')
+    request['k'] = 4
+    output = inference.output_fn(inference.predict_fn(request, served), 'text/csv')
+    assert np.array_equal(np.loadtxt(io.BytesIO(output), dtype=np.int64, delimiter=','), padded)
+
+    buffer = io.BytesIO()
+    np.save(buffer, np.array(item_ids, dtype=np.int64))
+    request = inference.input_fn(buffer.getvalue(), 'application/x-npy')
+    request['k'] = 4
+    prediction = inference.predict_fn(request, served)
+    assert np.array_equal(np.load(io.BytesIO(inference.output_fn(prediction, 'application/x-npy'))), padded)
+    # an array request answered in JSON drops the padding
+    assert inference.output_fn(prediction, 'application/json') == {'recs': expected}
+
+
+def test_a_padded_list_is_not_filled_with_other_items():
+    served = model()
+    short = int(served.item_ids[-1])
+
+    assert served.recommendations(short, k=10) == served.item_ids[served.neighbours[-1, :5]].tolist()
+    assert served.batch_recommendations([short, 5], k=10) == [served.recommendations(short, k=10), None]
+    assert served.neighbour_ids([short], k=8)[0].tolist()[5:] == [-1, -1, -1]
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('sagemaker_inference')
+import inference
+from inference import ArtworkModel
+from test_incremental_training import raw_catalog, fit
+
+ATTRIBUTES = {'ARTWORK_MEDIUM': 'artwork_medium', 'MATERIALS': 'materials', 'ARTWORK_YEAR': 'artwork_year',
+              'ARTWORK_PRICE': 'artwork_price', 'ARTIST_ID': 'artist_id'}
+
+
+@pytest.fixture(scope='module')
+def served(tmp_path_factory):
+    data = raw_catalog(400)
+    model, _ = fit(data)
+    artifact = tmp_path_factory.mktemp('artifact')
+    model.save_artifact(str(artifact))
+    return data, ArtworkModel.from_artifact(str(artifact))
+
+
+def test_cold_start_of_a_known_item_returns_its_stored_list(served):
+    data, model = served
+    top_k = model.neighbours.shape[1]
+
+    tied_cuts = 0
+    for row in data.sample(80, random_state=0).itertuples():
+        item_id = row.ARTWORK_ID
+        attributes = {name: getattr(row, column) for column, name in ATTRIBUTES.items()}
+
+        # the item scores itself like an identical new item, it is left out of the comparison
+        rec = [other for other in model.cold_start_recommendations(attributes, k=top_k + 1) if other != item_id]
+
+        assert rec[:top_k] == model.recommendations(item_id, k=top_k)
+        # more items than the list length (self included) score the kth stored score
+        position = model.positions([item_id])[0]
+        scores = model.similarity_scores(model.matrix @ model.matrix[position].toarray().ravel(),
+                                         model.squared_norms[position])
+        tied_cuts += np.sum(scores >= model.scores[position, -1] - 1e-6) > top_k + 1
+
+    # the catalog has many items tied at the kth score
+    assert tied_cuts > 0
+
+
+def test_cold_start_filters_and_exclusions(served, tmp_path):
+    data, model = served
+    row = data.iloc[5]
+    attributes = {name: row[column] for column, name in ATTRIBUTES.items()}
+
+    rec = model.cold_start_recommendations(attributes, k=10, filters={'max_price': 1000.0})
+    assert len(rec) > 0
+    assert (model.attributes['prices'][model.positions(rec)] <= 1000.0).all()
+
+    model.exclusions = inference.ExclusionBitmap(model, directory=str(tmp_path))
+    try:
+        first = model.cold_start_recommendations(attributes, k=10)
+        model.exclusions.update(first[:3])
+        assert model.cold_start_recommendations(attributes, k=10)[:7] == first[3:]
+    finally:
+        model.exclusions = None
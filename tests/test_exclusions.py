@@ -0,0 +1,104 @@
+import io
+
+import numpy as np
+import pytest
+
+pytest.importorskip('sagemaker_inference')
+import inference
+from inference import ArtworkModel, ExclusionBitmap, ExclusionStore
+
+
+class FakeS3:
+    """objects of one bucket, listed in key order"""
+
+    def __init__(self):
+        self.objects = {}
+        self.reads = 0
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+
+    def get_object(self, Bucket, Key):
+        self.reads += 1
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def list_objects_v2(self, Bucket, Prefix='', StartAfter='', MaxKeys=1000):
+        keys = [key for key in sorted(self.objects) if key.startswith(Prefix) and key > StartAfter]
+        return {'Contents': [{'Key': key} for key in keys[:MaxKeys]]}
+
+    def get_paginator(self, name):
+        return self
+
+    def paginate(self, **kwargs):
+        yield self.list_objects_v2(**kwargs)
+
+
+def model(n_items=50):
+    item_ids = np.arange(100, 100 + n_items, dtype=np.int64)
+    neighbours = np.tile(np.arange(5, dtype=np.int64), (n_items, 1))
+    return ArtworkModel(item_ids, neighbours, np.ones(neighbours.shape, dtype=np.float32), sorted_ids=True)
+
+
+def excluded_ids(bitmap):
+    positions = np.arange(len(bitmap.model.item_ids))
+    return set(bitmap.model.item_ids[bitmap.excluded(positions)].tolist())
+
+
+def test_compaction_keeps_the_exclusions(tmp_path):
+    bitmap = ExclusionBitmap(model(), directory=str(tmp_path), compact_bytes=20)
+    for item_id in range(100, 120):
+        bitmap.update([item_id])
+    bitmap.update([100, 101], excluded=False)
+
+    # the log is folded into the snapshot instead of growing with every update
+    assert (tmp_path / 'exclusions.log').stat().st_size <= 20 + len('+100\n')
+    assert set(range(102, 120)) == excluded_ids(bitmap)
+
+    # a new model builds its bitmap from the snapshot and the log
+    reloaded = ExclusionBitmap(model(60), directory=str(tmp_path))
+    assert excluded_ids(reloaded) == excluded_ids(bitmap)
+
+
+def test_new_instance_starts_from_the_stored_snapshot(tmp_path):
+    client = FakeS3()
+    store = ExclusionStore('s3://bucket/exclusions/', client=client)
+    instance = ExclusionBitmap(model(), directory=str(tmp_path / 'a'), store=store, compact_updates=3)
+    for item_id in range(100, 110):
+        instance.update([item_id])
+    instance.update([105], excluded=False)
+    assert 'exclusions/snapshot.json' in client.objects
+
+    client.reads = 0
+    fresh = ExclusionBitmap(model(), directory=str(tmp_path / 'b'), store=store)
+    assert excluded_ids(fresh) == excluded_ids(instance) == set(range(100, 110)) - {105}
+    # the snapshot and the updates written after it, not every stored update
+    assert client.reads == 1 + 3
+
+    # later updates of the first instance are synced as before
+    instance.update([140])
+    assert fresh.sync() == 1
+    assert 140 in excluded_ids(fresh)
+
+
+def test_excluded_items_are_skipped_down_the_stored_lists(tmp_path):
+    n_items = 20
+    neighbours = (np.arange(n_items)[:, None] + np.arange(1, 9)[None, :]) % n_items
+    served = ArtworkModel(np.arange(100, 100 + n_items, dtype=np.int64), neighbours,
+                          np.ones(neighbours.shape, dtype=np.float32), sorted_ids=True,
+                          attributes={'prices': np.arange(n_items, dtype=np.float32) * 100,
+                                      'years': np.zeros(n_items), 'medium_codes': np.zeros(n_items, dtype=np.int32),
+                                      'artist_codes': np.arange(n_items, dtype=np.int32)})
+    served.exclusions = ExclusionBitmap(served, directory=str(tmp_path))
+    assert not served.exclusions.active()
+
+    served.exclusions.update([101, 103, 999])
+    assert served.exclusions.active()
+    assert served.recommendations(100, k=3) == [102, 104, 105]
+    assert served.batch_recommendations([100, 102], k=3) == [[102, 104, 105], [104, 105, 106]]
+    assert served.neighbour_ids([100], k=7)[0].tolist() == [102, 104, 105, 106, 107, 108, -1]
+    # with the filters, the excluded items are skipped as well
+    assert served.recommendations(100, k=3, filters={'min_price': 300}) == [104, 105, 106]
+
+    served.exclusions.update([101, 103], excluded=False)
+    assert not served.exclusions.active()
+    assert served.recommendations(100, k=3) == [101, 102, 103]
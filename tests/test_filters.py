@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('sagemaker_inference')
+import inference
+from inference import ArtworkModel
+
+MEDIUMS = ['painting', 'photo', 'print']
+
+
+def model(n_items=60, top_k=20, seed=0):
+    rng = np.random.default_rng(seed)
+    item_ids = np.arange(500, 500 + n_items, dtype=np.int64)
+    neighbours = np.stack([rng.permutation(np.delete(np.arange(n_items), row))[:top_k] for row in range(n_items)])
+    prices = rng.choice(np.arange(100.0, 2100.0, 100.0), n_items).astype(np.float32)
+    prices[rng.random(n_items) < 0.1] = np.nan
+    attributes = {'prices': prices, 'years': np.full(n_items, 2000.0, dtype=np.float32),
+                  'medium_codes': rng.integers(-1, len(MEDIUMS), n_items).astype(np.int32),
+                  'artist_codes': rng.integers(-1, 8, n_items).astype(np.int32)}
+    return ArtworkModel(item_ids, neighbours.astype(np.int32), np.ones(neighbours.shape, dtype=np.float32),
+                        sorted_ids=True, attributes=attributes, medium_vocabulary=MEDIUMS)
+
+
+def passes(served, query, neighbour, filters):
+    """filters applied to one neighbour, item by item"""
+    attributes = {name: values.tolist() for name, values in served.attributes.items()}
+    artist, medium, price = (attributes['artist_codes'][neighbour], attributes['medium_codes'][neighbour],
+                             attributes['prices'][neighbour])
+    if filters.get('exclude_same_artist') and attributes['artist_codes'][query] >= 0 and \
+            artist == attributes['artist_codes'][query]:
+        return False
+    if filters.get('same_medium') and medium != attributes['medium_codes'][query]:
+        return False
+    if 'medium' in filters:
+        wanted = filters['medium'] if isinstance(filters['medium'], list) else [filters['medium']]
+        if medium < 0 or MEDIUMS[medium] not in wanted:
+            return False
+    # a missing price never passes a price filter
+    if 'min_price' in filters and not price >= filters['min_price']:
+        return False
+    if 'max_price' in filters and not price <= filters['max_price']:
+        return False
+    return True
+
+
+@pytest.mark.parametrize('filters', [
+    {'exclude_same_artist': True},
+    {'same_medium': True},
+    {'medium': 'photo'},
+    {'medium': ['painting', 'print', 'sculpture']},
+    {'min_price': 800.0},
+    {'min_price': 500.0, 'max_price': 1200.0, 'exclude_same_artist': True},
+])
+def test_filters_keep_the_first_passing_neighbours_of_the_stored_list(filters):
+    served = model()
+
+    for k in (1, 5, 20):
+        recs = served.batch_recommendations(served.item_ids.tolist(), k=k, filters=filters)
+        for query, rec in enumerate(recs):
+            stored = [neighbour for neighbour in served.neighbours[query].tolist() if neighbour >= 0]
+            expected = [int(served.item_ids[n]) for n in stored if passes(served, query, n, filters)][:k]
+            assert rec == expected
+
+
+def test_query_time_k_and_filters_through_predict_fn():
+    served = model()
+    item_id = int(served.item_ids[3])
+
+    assert inference.predict_fn({'itemId': item_id, 'k': 15}, served) == \
+        {'rec': served.item_ids[served.neighbours[3, :15]].tolist()}
+    filtered = inference.predict_fn({'itemId': item_id, 'k': 20, 'medium': 'photo', 'max_price': '1500'}, served)
+    assert filtered == {'rec': served.recommendations(item_id, k=20, filters={'medium': 'photo', 'max_price': 1500.0})}
+    # k is capped by the stored list length
+    assert inference.predict_fn({'itemIds': [item_id], 'k': 50}, served)['recs'][0] == \
+        served.item_ids[served.neighbours[3]].tolist()
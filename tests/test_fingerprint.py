@@ -0,0 +1,75 @@
+import io
+import json
+import os
+import tarfile
+import importlib.util
+from importlib.machinery import SourceFileLoader
+
+import pipeline_trigger_lambda_function as trigger
+import fingerprint
+from ingestion import read_training_data
+
+TRAIN_SCRIPT = os.path.join(os.path.dirname(__file__), '..', 'train', 'train')
+
+# header in another case and order, an extra column, missing values, quoted commas and padded text
+DATA = ('﻿Materials,ARTWORK_ID,Artist_Id,artwork_price,ARTWORK_MEDIUM,ARTWORK_YEAR,TITLE\n'
+        '"oil, canvas",1,7,100.0,painting,1990,a\n'
+        'paper,2,8,250,print,,b\n'
+        'NA,3,0042, 99.5 ,sculpture,2001.0,c\n'
+        'bronze,,9,10,sculpture,2000,no id\n'
+        ' wood ,5,,NaN,,1875,d\n')
+
+
+def test_lambda_and_training_fingerprints_are_equal(tmp_path):
+    (tmp_path / 'data.csv').write_text(DATA, encoding='utf-8')
+
+    lambda_fingerprint = trigger.DataFingerprint()
+    lambda_fingerprint.add_csv(io.StringIO(DATA, newline=''))
+    text_fingerprint = fingerprint.DataFingerprint()
+    text_fingerprint.add_csv(io.StringIO(DATA, newline=''))
+    # the training reads the data and fingerprints it in the same pass
+    training_fingerprint = fingerprint.DataFingerprint()
+    data = read_training_data(str(tmp_path), fingerprint=training_fingerprint)
+
+    assert len(data) == 4
+    assert lambda_fingerprint.hexdigest() == text_fingerprint.hexdigest() == training_fingerprint.hexdigest()
+    assert fingerprint.training_data_fingerprint(str(tmp_path)) == lambda_fingerprint.hexdigest()
+    assert lambda_fingerprint.hexdigest().startswith('v1-4-')
+
+
+def train_script():
+    """the training script, a python module without the .py extension"""
+    loader = SourceFileLoader('train_script', TRAIN_SCRIPT)
+    module = importlib.util.module_from_spec(importlib.util.spec_from_loader(loader.name, loader))
+    loader.exec_module(module)
+    return module
+
+
+def add_member(tar, name, data):
+    member = tarfile.TarInfo(name)
+    member.size = len(data)
+    tar.addfile(member, io.BytesIO(data))
+
+
+def test_previous_model_reuse_extracts_only_the_artifact(tmp_path, monkeypatch):
+    train = train_script()
+    previous, model = tmp_path / 'previous', tmp_path / 'model'
+    previous.mkdir()
+    model.mkdir()
+    monkeypatch.setattr(train, 'previous_model_path', str(previous))
+    monkeypatch.setattr(train, 'model_path', str(model))
+
+    manifest = {'files': {'item_ids': 'item_ids.npy', 'outside': '../outside.npy'}, 'cold_start': 'cold_start.json'}
+    with tarfile.open(previous / 'model.tar.gz', 'w:gz') as tar:
+        add_member(tar, './manifest.json', json.dumps(manifest).encode())
+        for name in ('item_ids.npy', 'cold_start.json', 'artwork_content_state.npz', 'placeholder', '../outside.npy'):
+            add_member(tar, name, name.encode())
+        link = tarfile.TarInfo('artwork_content_encoder.json')
+        link.type, link.linkname = tarfile.SYMTYPE, '/etc/passwd'
+        tar.addfile(link)
+    (previous / 'placeholder').write_text('')
+
+    train.reuse_previous_model()
+
+    assert sorted(os.listdir(model)) == ['artwork_content_state.npz', 'cold_start.json', 'item_ids.npy', 'manifest.json']
+    assert not (tmp_path / 'outside.npy').exists()
@@ -0,0 +1,60 @@
+import json
+
+import numpy as np
+import pytest
+
+pytest.importorskip('sagemaker_inference')
+import inference
+from inference import ModelHandle
+
+
+def publish(directory, shift, manifest=True, n_items=10):
+    """artifact recommending the items shift positions after every item"""
+    directory.mkdir(parents=True)
+    neighbours = (np.arange(n_items)[:, None] + shift + np.arange(3)[None, :]) % n_items
+    np.save(directory / 'item_ids.npy', np.arange(100, 100 + n_items, dtype=np.int64))
+    np.save(directory / 'neighbours.npy', neighbours.astype(np.int32))
+    np.save(directory / 'scores.npy', np.ones(neighbours.shape, dtype=np.float32))
+    if manifest:
+        write_manifest(directory)
+    return str(directory)
+
+
+def write_manifest(directory):
+    files = {'item_ids': 'item_ids.npy', 'neighbours': 'neighbours.npy', 'scores': 'scores.npy'}
+    (directory / inference.ARTIFACT_MANIFEST).write_text(json.dumps({'files': files, 'sorted_ids': True}))
+
+
+def test_new_artifacts_are_validated_and_swapped(tmp_path, monkeypatch):
+    monkeypatch.setattr(inference, 'EXCLUSION_DIR', '')
+    initial = publish(tmp_path / 'model', 1)
+    watch = tmp_path / 'watch'
+    watch.mkdir()
+    handle = ModelHandle(inference.load_model(initial), initial, watch_path=str(watch), interval=0)
+
+    assert not handle.check()
+    # a version still being published has no manifest yet
+    publish(watch / 'v001', 2, manifest=False)
+    assert not handle.check()
+
+    write_manifest(watch / 'v001')
+    in_flight = handle.current
+    assert handle.check()
+    assert handle.version == 1 and handle.model_dir == str(watch / 'v001')
+    assert inference.predict_fn({'itemId': 100, 'k': 3}, handle) == {'rec': [102, 103, 104]}
+    # a request holding the previous model keeps its lists
+    assert inference.predict_fn({'itemId': 100, 'k': 3}, in_flight) == {'rec': [101, 102, 103]}
+
+    # a broken artifact is rejected once, the current model keeps serving
+    broken = publish(watch / 'v002', 3)
+    np.save(watch / 'v002' / 'neighbours.npy', np.full((10, 3), 99, dtype=np.int32))
+    assert not handle.check()
+    assert broken in handle.rejected
+    assert not handle.check()
+    assert handle.version == 1
+    assert handle.recommendations(100, k=3) == [102, 103, 104]
+
+    publish(watch / 'v003', 4)
+    assert handle.check()
+    assert handle.version == 2
+    assert handle.recommendations(100, k=3) == [104, 105, 106]
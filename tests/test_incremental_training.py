@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from artwork_content_recsys import ArtworkContent
+
+
+class LowercaseNormalizer:
+    """materials normalizer without the nltk corpora, the grouping of the model still runs on its output"""
+
+    def normalize(self, texts):
+        return [str(text).lower().strip() for text in texts]
+
+
+def raw_catalog(n_items, seed=0, first_id=1):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'ARTWORK_ID': np.arange(first_id, first_id + n_items),
+        'ARTIST_ID': rng.integers(0, 60, n_items).astype(str),
+        'ARTWORK_MEDIUM': rng.choice(['painting', 'print', 'photography', 'sculpture', 'drawing'], n_items),
+        'MATERIALS': rng.choice(['oil on canvas', 'Oil on Canvas', 'acrylic on canvas', 'paper', 'bronze', 'wood',
+                                 'ink on paper', 'mixed media'], n_items),
+        'ARTWORK_YEAR': rng.integers(1950, 2021, n_items).astype(float),
+        'ARTWORK_PRICE': rng.choice(np.arange(100.0, 5100.0, 50.0), n_items),
+    })
+
+
+def fit(data, previous_state=None, capsys=None):
+    model = ArtworkContent(data.copy(), top_k=15, block_size=128)
+    model.text_normalizer = LowercaseNormalizer()
+    model.fit(previous_state)
+    log = capsys.readouterr().out if capsys is not None else ''
+    return model, log
+
+
+def saved_state(model, tmp_path, name='state.npz'):
+    model.save_state(tmp_path / name)
+    return model.load_state(tmp_path / name)
+
+
+def assert_same_model(incremental, full):
+    assert incremental.item_index.equals(full.item_index)
+    assert np.array_equal(incremental.ranked_neighbours, full.ranked_neighbours)
+    assert np.allclose(incremental.ranked_scores, full.ranked_scores)
+
+
+@pytest.fixture(scope='module')
+def catalog():
+    return raw_catalog(1200)
+
+
+@pytest.mark.parametrize('change', ['added items', 'prices out of the previous range', 'removed items'])
+def test_incremental_matches_a_full_training(catalog, tmp_path, change):
+    previous, _ = fit(catalog)
+    if change == 'added items':
+        data = pd.concat([catalog, raw_catalog(20, seed=1, first_id=5000)], ignore_index=True)
+    elif change == 'prices out of the previous range':
+        data = pd.concat([catalog, raw_catalog(20, seed=1, first_id=5000).assign(ARTWORK_PRICE=1e6)], ignore_index=True)
+    else:
+        data = catalog.iloc[15:]
+
+    incremental, _ = fit(data, saved_state(previous, tmp_path))
+    full, _ = fit(data)
+
+    assert_same_model(incremental, full)
+
+
+def test_small_delta_is_updated_incrementally(catalog, tmp_path, capsys):
+    previous, _ = fit(catalog, capsys=capsys)
+
+    # years moved to other existing years and a new medium, the refitted bins do not move
+    data = catalog.copy()
+    data.loc[:9, 'ARTWORK_YEAR'] = np.where(data.loc[:9, 'ARTWORK_YEAR'] < 2000, 2005.0, 1975.0)
+    data.loc[10:14, 'ARTWORK_MEDIUM'] = 'textile'
+
+    incremental, log = fit(data, saved_state(previous, tmp_path), capsys=capsys)
+    full, _ = fit(data, capsys=capsys)
+
+    assert 'Incremental training: 15 added/changed' in log
+    assert 'running a full training' not in log
+    assert_same_model(incremental, full)
+
+
+def test_repeated_incremental_trainings_match_a_full_training(catalog, tmp_path):
+    model, _ = fit(catalog)
+    data = catalog.copy()
+    for run in range(3):
+        data = data.copy()
+        data.loc[run * 5:run * 5 + 4, 'ARTWORK_PRICE'] = data['ARTWORK_PRICE'].iloc[::-1].to_numpy()[run * 5:run * 5 + 5]
+        model, _ = fit(data, saved_state(model, tmp_path, f'state_{run}.npz'))
+
+    assert_same_model(model, fit(data)[0])
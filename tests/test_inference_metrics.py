@@ -0,0 +1,66 @@
+import io
+import json
+
+import numpy as np
+import pytest
+
+pytest.importorskip('sagemaker_inference')
+import inference
+from inference import ArtworkModel, SampledLogger, StageMetrics
+
+
+def test_logger_samples_the_requests_and_writes_every_error():
+    stream = io.StringIO()
+    logger = SampledLogger(sample_rate=0, stream=stream)
+
+    logger.info('request', body=b'{}')
+    logger.error('prediction_failed', item_id=7)
+
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [(record['level'], record['event']) for record in records] == [('ERROR', 'prediction_failed')]
+    assert records[0]['item_id'] == 7
+
+    logger.sample_rate = 1
+    logger.info('request', body=b'{}')
+    assert json.loads(stream.getvalue().splitlines()[-1])['body'] == "b'{}'"
+
+
+def test_stage_histograms_and_counters_in_one_metric_document():
+    stream = io.StringIO()
+    metrics = StageMetrics(namespace='Test', interval=3600, stream=stream)
+
+    for seconds in (0.0004, 0.0004, 0.003, 0.7):
+        metrics.record('lookup', seconds)
+    metrics.record('decode', 120.0)
+    metrics.increment('response_cache_hits', 3)
+    metrics.increment('response_cache_misses')
+    assert stream.getvalue() == ''
+
+    metrics.flush()
+    document = json.loads(stream.getvalue())
+
+    assert document['_aws']['CloudWatchMetrics'][0]['Namespace'] == 'Test'
+    assert document['lookup_latency'] == {'Values': [0.5, 5.0, 1000.0], 'Counts': [2, 1, 1]}
+    # beyond the last bucket counts in the last bucket
+    assert document['decode_latency'] == {'Values': [60000.0], 'Counts': [1]}
+    assert document['response_cache_hits'] == 3
+    assert document['response_cache_hit_rate'] == 75.0
+
+    # nothing recorded since the flush, nothing written
+    metrics.flush()
+    assert len(stream.getvalue().splitlines()) == 1
+
+
+def test_handlers_record_their_stages(monkeypatch):
+    stream = io.StringIO()
+    monkeypatch.setattr(inference, 'metrics', StageMetrics(interval=3600, stream=stream))
+    served = ArtworkModel(np.arange(3, dtype=np.int64), np.array([[1, 2], [0, 2], [0, 1]], dtype=np.int32),
+                          np.ones((3, 2), dtype=np.float32), sorted_ids=True)
+
+    inference.output_fn(inference.predict_fn(inference.input_fn(b'[0, 1]', 'application/json'), served),
+                        'application/json')
+    inference.metrics.flush()
+
+    document = json.loads(stream.getvalue())
+    assert {'decode_latency', 'lookup_latency', 'encode_latency'} <= document.keys()
+    assert document['batch_items'] == 2
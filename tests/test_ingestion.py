@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+
+from ingestion import read_training_data
+
+
+def test_files_with_different_columns_are_read_in_chunks(tmp_path):
+    (tmp_path / 'a.csv').write_text('ARTWORK_ID,ARTIST_ID,ARTWORK_MEDIUM,MATERIALS,ARTWORK_YEAR,ARTWORK_PRICE,TITLE\n'
+                                    '1,7,painting,oil,1990,100.5,x\n'
+                                    '2,8,print,,2001,,y\n'
+                                    '3,,print,,,20,z\n')
+    # no materials nor price, lower case header, a chunk without any medium
+    (tmp_path / 'b.csv').write_text('artwork_id,artist_id,artwork_year,artwork_medium\n'
+                                    '4,9,1875,\n'
+                                    ',9,1900,\n'
+                                    '6,7,1950,sculpture\n')
+
+    data = read_training_data(str(tmp_path), chunk_size=2)
+
+    assert data['ARTWORK_ID'].tolist() == [1, 2, 3, 4, 6]
+    assert data['ARTWORK_ID'].dtype == np.int64
+    for column in ('ARTIST_ID', 'ARTWORK_MEDIUM', 'MATERIALS'):
+        assert isinstance(data[column].dtype, pd.CategoricalDtype)
+    assert data['ARTIST_ID'].astype(object).where(data['ARTIST_ID'].notna(), None).tolist() == ['7', '8', None, '9', '7']
+    assert data['ARTWORK_MEDIUM'].astype(object).where(data['ARTWORK_MEDIUM'].notna(), None).tolist() == \
+        ['painting', 'print', 'print', None, 'sculpture']
+    assert data['MATERIALS'].notna().tolist() == [True, False, False, False, False]
+    np.testing.assert_array_equal(data['ARTWORK_PRICE'], [100.5, np.nan, 20, np.nan, np.nan])
+    np.testing.assert_array_equal(data['ARTWORK_YEAR'], [1990, 2001, np.nan, 1875, 1950])
@@ -0,0 +1,42 @@
+import numpy as np
+from scipy import sparse
+
+from lsh_index import LSHIndex
+from test_similarity_engine import catalog, fitted_engine
+
+
+def exact_pair_scores(matrix, neighbours):
+    """cosine score of every (item, neighbour) pair of the lists, computed directly"""
+    dense = sparse.csr_matrix(matrix, dtype=np.float64).toarray()
+    dense /= np.linalg.norm(dense, axis=1, keepdims=True)
+    return np.einsum('if,ikf->ik', dense, dense[neighbours])
+
+
+def test_approximate_neighbours_recall_against_the_exact_engine():
+    data, features = catalog(2000)
+    model, matrix = fitted_engine(data, features, 20, approximate=True, recall_sample=300)
+
+    neighbours, scores = model.approximate_neighbours(matrix, 'cosine')
+
+    # only part of the catalog is scored, with the exact scores of the pairs
+    n_pairs = sum(len(queries) for queries, _ in LSHIndex().candidate_blocks(matrix, model.block_size))
+    assert n_pairs < len(features) * (len(features) - 1) / 4
+    assert (neighbours >= 0).all()
+    np.testing.assert_allclose(scores, exact_pair_scores(matrix, neighbours), atol=1e-9)
+    assert (np.diff(scores, axis=1) <= 1e-12).all()
+
+    assert model.recall_at_k(matrix, 'cosine', neighbours, scores) >= 0.95
+    assert model.recall_at_k(matrix, 'cosine', *model.top_k_neighbours(matrix, 'cosine')) == 1.0
+
+
+def test_recall_drops_with_fewer_collisions():
+    data, features = catalog(2000)
+    model, matrix = fitted_engine(data, features, 20, approximate=True, recall_sample=300,
+                                  lsh_params={'n_bands': 8, 'band_size': 4})
+
+    neighbours, scores = model.approximate_neighbours(matrix, 'cosine')
+
+    # items without K colliding candidates are padded, and count as misses
+    assert (neighbours < 0).any()
+    assert np.isneginf(scores[neighbours < 0]).all()
+    assert model.recall_at_k(matrix, 'cosine', neighbours, scores) < 0.95
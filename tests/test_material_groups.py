@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+from artwork_content_recsys import ArtworkContent
+
+MATERIALS = np.array(['oil canvas', 'oil canvas board', 'canvas board', 'acrylic', 'acrylic paper', 'paper',
+                      'bronze', 'bronze patina', 'wood', 'ink paper', 'ink', 'mixed medium', 'oil', ''], dtype=object)
+
+
+def reference_groups(materials, threshold):
+    """groups of the dense cosine matrix merged pair by pair, the longest string of every group first"""
+    counts = CountVectorizer().fit_transform(materials)
+    similar = cosine_similarity(counts) >= threshold
+
+    group = list(range(len(materials)))
+    for row, col in zip(*np.nonzero(similar)):
+        old, new = group[col], group[row]
+        group = [new if g == old else g for g in group]
+
+    canonical = {}
+    for position in sorted(range(len(materials)), key=lambda p: (-len(materials[p]), p)):
+        canonical.setdefault(group[position], materials[position])
+    return [canonical[g] for g in group]
+
+
+def test_groups_match_the_dense_similarity_groups():
+    rng = np.random.default_rng(0)
+    for threshold in (0.5, 0.7, 0.9):
+        model = ArtworkContent(pd.DataFrame(), block_size=3, material_threshold=threshold)
+        materials = rng.permutation(MATERIALS)
+        assert model.group_materials(materials).tolist() == reference_groups(materials, threshold)
+
+
+def test_grouping_is_transitive_and_keeps_the_longest_string():
+    model = ArtworkContent(pd.DataFrame(), block_size=2, material_threshold=0.70)
+    materials = np.array(['oil canvas', 'oil canvas board', 'canvas board', 'bronze'], dtype=object)
+
+    # 'oil canvas' and 'canvas board' are only linked through 'oil canvas board'
+    assert model.group_materials(materials).tolist() == ['oil canvas board'] * 3 + ['bronze']
+    assert model.group_materials(np.array([], dtype=object)).tolist() == []
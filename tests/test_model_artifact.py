@@ -0,0 +1,58 @@
+import pickle
+
+import numpy as np
+import pytest
+
+pytest.importorskip('sagemaker_inference')
+import inference
+from inference import ArtworkModel
+from test_incremental_training import raw_catalog, fit
+
+
+@pytest.fixture(scope='module')
+def trained(tmp_path_factory):
+    """a trained model saved in the artifact format and in the legacy pickle format"""
+    model, _ = fit(raw_catalog(400))
+    artifact, legacy = tmp_path_factory.mktemp('artifact'), tmp_path_factory.mktemp('legacy')
+    model.save_artifact(str(artifact))
+    with open(legacy / inference.LEGACY_MODEL, 'wb') as f:
+        pickle.dump(model.results_dict(model.item_index, model.ranked_neighbours, model.ranked_scores), f)
+    return model, artifact, legacy
+
+
+def test_memory_mapped_artifact_serves_the_pickled_lists(trained, monkeypatch):
+    model, artifact, legacy = trained
+    monkeypatch.setattr(inference, 'EXCLUSION_DIR', '')
+
+    mapped = inference.load_model(str(artifact))
+    pickled = inference.load_model(str(legacy))
+
+    assert isinstance(mapped.neighbours, np.memmap) and isinstance(mapped.scores, np.memmap)
+    assert not isinstance(pickled.neighbours, np.memmap)
+
+    item_ids = np.asarray(model.item_index).tolist()
+    top_k = model.ranked_neighbours.shape[1]
+    for k in (1, 10, top_k):
+        assert mapped.batch_recommendations(item_ids, k=k) == pickled.batch_recommendations(item_ids, k=k)
+    np.testing.assert_array_equal(mapped.neighbours, pickled.neighbours)
+    np.testing.assert_allclose(mapped.scores, pickled.scores)
+
+    # the lists of the legacy dictionary, in their rank order
+    results = model.results_dict(model.item_index, model.ranked_neighbours, model.ranked_scores)
+    for item_id in item_ids[::37]:
+        assert mapped.recommendations(item_id, k=top_k) == [row[0] for row in results[item_id]]
+
+
+def test_pickle_padding_and_unknown_ids(tmp_path):
+    results = {7: [[3, 0.9, 0], [5, 0.5, 1]], 3: [[7, 0.9, 0]], 5: [[7, 0.5, 0], [99, 0.1, 1]]}
+    with open(tmp_path / inference.LEGACY_MODEL, 'wb') as f:
+        pickle.dump(results, f)
+
+    model = ArtworkModel.from_pickle(str(tmp_path / inference.LEGACY_MODEL))
+
+    assert model.item_ids.tolist() == [3, 5, 7]
+    assert model.recommendations(7) == [3, 5]
+    assert model.recommendations(3) == [7]
+    # a stored neighbour that is not an item of the model is dropped
+    assert model.recommendations(5) == [7]
+    assert model.batch_recommendations([3, 4]) == [[7], None]
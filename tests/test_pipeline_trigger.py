@@ -0,0 +1,279 @@
+import json
+import logging
+
+import pytest
+
+import pipeline_trigger_lambda_function as trigger
+from pipeline_trigger_lambda_function import InMemoryIdempotencyStore, drain_pending, recheck_pipeline, trigger_pipeline
+
+PIPELINE = 'artwork-content-pipeline'
+
+
+class FakeSageMaker:
+    """pipeline executions of one pipeline, started with start_pipeline_execution"""
+
+    def __init__(self, statuses=()):
+        self.executions = [{'PipelineExecutionArn': f'arn:{n}', 'PipelineExecutionStatus': status}
+                           for n, status in enumerate(statuses)]
+        self.started = []
+
+    def list_pipeline_executions(self, **kwargs):
+        return {'PipelineExecutionSummaries': list(reversed(self.executions))}
+
+    def start_pipeline_execution(self, **kwargs):
+        self.started.append(kwargs)
+        arn = f'arn:{len(self.executions)}'
+        self.executions.append({'PipelineExecutionArn': arn, 'PipelineExecutionStatus': 'Executing'})
+        return {'PipelineExecutionArn': arn}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def finished_event(status='Succeeded', pipeline=PIPELINE):
+    return {'detail-type': trigger.PIPELINE_STATUS_DETAIL_TYPE,
+            'detail': {'pipelineArn': f'arn:aws:sagemaker:us-east-1:123:pipeline/{pipeline}',
+                       'currentPipelineExecutionStatus': status}}
+
+
+def no_sleep(seconds):
+    pass
+
+
+def test_single_upload_starts_the_pipeline():
+    sm, store = FakeSageMaker(), InMemoryIdempotencyStore()
+
+    response = trigger_pipeline(sm, store, PIPELINE, ['s3://b/data/a.csv'], 'token-1', sleep=no_sleep, clock=Clock())
+
+    assert response['msg']['PipelineExecutionArn'] == 'arn:0'
+    assert sm.started[0]['ClientRequestToken'] == 'token-1'
+    assert sm.started[0]['PipelineExecutionDescription'] == 's3://b/data/a.csv'
+    record = store.get(PIPELINE)
+    assert record['execution_arn'] == 'arn:0'
+    assert 'claim_time' not in record and not record.get('pending_keys')
+
+
+def test_burst_of_uploads_starts_one_execution():
+    sm, store, clock = FakeSageMaker(), InMemoryIdempotencyStore(), Clock()
+
+    # a second upload arrives during the quiet window of the first one
+    def second_upload(seconds):
+        store.record_upload(PIPELINE, 'token-2', clock(), ['s3://b/data/b.csv'])
+
+    first = trigger_pipeline(sm, store, PIPELINE, ['s3://b/data/a.csv'], 'token-1', sleep=second_upload, clock=clock)
+    second = trigger_pipeline(sm, store, PIPELINE, [], 'token-2', sleep=no_sleep, clock=clock)
+
+    assert first['msg'] == 'coalesced'
+    assert second['msg']['PipelineExecutionArn'] == 'arn:0'
+    assert len(sm.started) == 1
+    assert sm.started[0]['PipelineExecutionDescription'] == 's3://b/data/a.csv s3://b/data/b.csv'
+
+
+def test_live_claim_refuses_a_second_start():
+    store = InMemoryIdempotencyStore()
+    store.record_upload(PIPELINE, 'token-1', 0.0, ['s3://b/data/a.csv'])
+
+    assert store.claim(PIPELINE, 'token-1', 10.0, lease=300) == ['s3://b/data/a.csv']
+    store.record_upload(PIPELINE, 'token-2', 20.0, ['s3://b/data/b.csv'])
+    assert store.claim(PIPELINE, 'token-2', 30.0, lease=300) is None
+    # an expired claim (crashed invocation) is taken over
+    assert store.claim(PIPELINE, 'token-2', 400.0, lease=300) == ['s3://b/data/b.csv']
+
+
+def test_released_claim_can_be_taken():
+    store = InMemoryIdempotencyStore()
+    store.record_upload(PIPELINE, 'token-1', 0.0, ['s3://b/data/a.csv'])
+    store.claim(PIPELINE, 'token-1', 10.0, lease=300)
+    store.release(PIPELINE, 'token-1')
+    store.record_upload(PIPELINE, 'token-2', 20.0, ['s3://b/data/b.csv'])
+
+    assert store.claim(PIPELINE, 'token-2', 30.0, lease=300) == ['s3://b/data/b.csv']
+
+
+def test_upload_during_an_execution_is_drained_when_it_finished():
+    sm, store, clock = FakeSageMaker(['Executing']), InMemoryIdempotencyStore(), Clock()
+
+    skipped = trigger_pipeline(sm, store, PIPELINE, ['s3://b/data/a.csv'], 'token-1', sleep=no_sleep, clock=clock)
+    assert skipped['msg'] == 'skipped: execution already running'
+    assert store.get(PIPELINE)['pending_keys'] == ['s3://b/data/a.csv']
+
+    sm.executions[0]['PipelineExecutionStatus'] = 'Succeeded'
+    response = drain_pending(sm, store, PIPELINE, finished_event(), 'token-2', sleep=no_sleep, clock=clock)
+
+    assert response['msg']['PipelineExecutionArn'] == 'arn:1'
+    assert sm.started[0]['PipelineExecutionDescription'] == 's3://b/data/a.csv'
+    assert not store.get(PIPELINE).get('pending_keys')
+
+
+@pytest.mark.parametrize('event, msg', [
+    (finished_event(), 'nothing pending'),
+    (finished_event(status='Executing'), 'execution not finished'),
+    (finished_event(pipeline='other-pipeline'), 'other pipeline'),
+])
+def test_drain_without_work_starts_nothing(event, msg):
+    sm, store = FakeSageMaker(), InMemoryIdempotencyStore()
+    if msg != 'nothing pending':
+        store.record_upload(PIPELINE, 'token-1', 0.0, ['s3://b/data/a.csv'])
+
+    assert drain_pending(sm, store, PIPELINE, event, 'token-2', sleep=no_sleep, clock=Clock())['msg'] == msg
+    assert sm.started == []
+
+
+def test_upload_during_the_drain_is_coalesced_into_it():
+    sm, store, clock = FakeSageMaker(['Succeeded']), InMemoryIdempotencyStore(), Clock()
+    store.record_upload(PIPELINE, 'token-1', 0.0, ['s3://b/data/a.csv'])
+
+    def new_upload(seconds):
+        store.record_upload(PIPELINE, 'token-3', clock(), ['s3://b/data/c.csv'])
+
+    drained = drain_pending(sm, store, PIPELINE, finished_event(), 'token-2', sleep=new_upload, clock=clock)
+    started = trigger_pipeline(sm, store, PIPELINE, [], 'token-3', sleep=no_sleep, clock=clock)
+
+    assert drained['msg'] == 'coalesced'
+    assert started['msg']['PipelineExecutionArn'] == 'arn:1'
+    assert sm.started[0]['PipelineExecutionDescription'] == 's3://b/data/a.csv s3://b/data/c.csv'
+
+
+class FakeBody:
+    def __init__(self, data):
+        self.data = data
+
+    def iter_chunks(self, chunk_size):
+        for start in range(0, len(self.data), chunk_size):
+            yield self.data[start:start + chunk_size]
+
+
+class FakeS3:
+    """S3 resource of CSV objects, counting the reads"""
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.reads = []
+
+    def Object(self, bucket, key):
+        s3 = self
+
+        class Object:
+            def get(self):
+                s3.reads.append(key)
+                if key not in s3.objects:
+                    raise IOError(f'AccessDenied: {key}')
+                return {'Body': FakeBody(s3.objects[key])}
+
+        return Object()
+
+
+class FakeEndpointSageMaker(FakeSageMaker):
+    """SageMaker with an endpoint tagged with the fingerprint of its training data"""
+
+    def __init__(self, fingerprint):
+        super().__init__()
+        self.fingerprint = fingerprint
+
+    def describe_endpoint(self, EndpointName):
+        return {'EndpointArn': f'arn:endpoint/{EndpointName}'}
+
+    def list_tags(self, ResourceArn):
+        return {'Tags': [{'Key': trigger.FINGERPRINT_TAG, 'Value': self.fingerprint}]}
+
+
+DATA = (b'ARTWORK_ID,ARTIST_ID,ARTWORK_PRICE,ARTWORK_MEDIUM,MATERIALS,ARTWORK_YEAR\n'
+        b'1,7,100.0,print,paper,1990\n2,8,250.0,painting,oil on canvas,2001\n')
+
+
+def data_fingerprint(data):
+    fingerprint = trigger.DataFingerprint()
+    fingerprint.add_csv(data.decode('utf-8').splitlines(keepends=True))
+    return fingerprint.hexdigest()
+
+
+def test_unchanged_data_is_skipped_without_claiming():
+    sm, store, s3 = FakeEndpointSageMaker(data_fingerprint(DATA)), InMemoryIdempotencyStore(), FakeS3({'data/a.csv': DATA})
+
+    response = trigger_pipeline(sm, store, PIPELINE, ['s3://b/data/a.csv'], 'token-1', sleep=no_sleep, clock=Clock(),
+                                s3=s3, endpoint_name='endpoint')
+
+    assert response['msg'] == 'skipped: training data unchanged'
+    assert sm.started == []
+    record = store.get(PIPELINE)
+    assert 'claim_token' not in record and not record.get('pending_keys')
+
+
+def test_changed_data_starts_the_pipeline():
+    sm, store = FakeEndpointSageMaker('v1-0-0'), InMemoryIdempotencyStore()
+    s3 = FakeS3({'data/a.csv': DATA})
+
+    response = trigger_pipeline(sm, store, PIPELINE, ['s3://b/data/a.csv'], 'token-1', sleep=no_sleep, clock=Clock(),
+                                s3=s3, endpoint_name='endpoint')
+
+    assert response['msg']['PipelineExecutionArn'] == 'arn:0'
+
+
+def test_unreadable_uploads_start_the_pipeline():
+    sm, store, s3 = FakeEndpointSageMaker(data_fingerprint(DATA)), InMemoryIdempotencyStore(), FakeS3({})
+
+    response = trigger_pipeline(sm, store, PIPELINE, ['s3://b/data/a.csv'], 'token-1', sleep=no_sleep, clock=Clock(),
+                                s3=s3, endpoint_name='endpoint')
+
+    assert s3.reads == ['data/a.csv']
+    assert response['msg']['PipelineExecutionArn'] == 'arn:0'
+
+
+def test_uploads_are_not_read_without_an_endpoint():
+    sm, store, s3 = FakeEndpointSageMaker(data_fingerprint(DATA)), InMemoryIdempotencyStore(), FakeS3({'data/a.csv': DATA})
+
+    response = trigger_pipeline(sm, store, PIPELINE, ['s3://b/data/a.csv'], 'token-1', sleep=no_sleep, clock=Clock(),
+                                s3=s3, endpoint_name=None)
+
+    assert s3.reads == []
+    assert response['msg']['PipelineExecutionArn'] == 'arn:0'
+
+
+class FakeSQS:
+    """delayed messages of the recheck queue"""
+
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, QueueUrl, MessageBody, DelaySeconds):
+        self.messages.append((json.loads(MessageBody), DelaySeconds))
+
+
+def failing_sleep(seconds):
+    raise AssertionError('the invocation must not wait for the quiet window')
+
+
+def test_burst_of_uploads_is_rechecked_through_the_queue():
+    sm, store, sqs, clock = FakeSageMaker(), InMemoryIdempotencyStore(), FakeSQS(), Clock()
+
+    for token, upload in (('token-1', 's3://b/data/a.csv'), ('token-2', 's3://b/data/b.csv')):
+        response = trigger_pipeline(sm, store, PIPELINE, [upload], token, sleep=failing_sleep, clock=clock,
+                                    sqs=sqs, queue_url='queue')
+        assert response['msg'] == 'recheck scheduled'
+    assert [delay for _, delay in sqs.messages] == [trigger.QUIET_WINDOW_SECONDS] * 2
+
+    responses = [recheck_pipeline(sm, store, PIPELINE, message, clock=clock) for message, _ in sqs.messages]
+
+    assert responses[0]['msg'] == 'coalesced'
+    assert responses[1]['msg']['PipelineExecutionArn'] == 'arn:0'
+    assert sm.started[0]['PipelineExecutionDescription'] == 's3://b/data/a.csv s3://b/data/b.csv'
+
+
+def test_clamped_quiet_window_is_logged(caplog):
+    class Context:
+        def get_remaining_time_in_millis(self):
+            return 10000
+
+    sm, store, waited = FakeSageMaker(), InMemoryIdempotencyStore(), []
+
+    with caplog.at_level(logging.WARNING):
+        trigger_pipeline(sm, store, PIPELINE, ['s3://b/data/a.csv'], 'token-1', context=Context(), sleep=waited.append,
+                         clock=Clock())
+
+    assert waited == [0]
+    assert 'Quiet window clamped' in caplog.text
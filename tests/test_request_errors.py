@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('sagemaker_inference')
+import inference
+from inference import ArtworkModel, RequestError
+
+
+def model(n_items=20):
+    item_ids = np.arange(100, 100 + n_items, dtype=np.int64)
+    neighbours = (np.arange(n_items)[:, None] + np.arange(1, 6)[None, :]) % n_items
+    attributes = {'prices': np.linspace(100, 2000, n_items), 'years': np.full(n_items, 2000.0),
+                  'medium_codes': np.zeros(n_items, dtype=np.int64), 'artist_codes': np.arange(n_items)}
+    return ArtworkModel(item_ids, neighbours, np.ones(neighbours.shape, dtype=np.float32), sorted_ids=True,
+                        attributes=attributes, medium_vocabulary=['painting'])
+
+
+def status(call, *args):
+    with pytest.raises(RequestError) as error:
+        call(*args)
+    return error.value.status_code
+
+
+def test_only_an_unsupported_content_type_is_a_415():
+    assert status(inference.input_fn, b'{}', 'application/xml') == 415
+
+    assert status(inference.input_fn, b'{"itemId": ', 'application/json') == 400
+    assert status(inference.input_fn, b'"100"', 'application/json') == 400
+    assert status(inference.input_fn, b'\xff\xfe', 'application/json') == 400
+    assert status(inference.input_fn, b'100\nabc', 'text/csv') == 400
+    assert status(inference.input_fn, b'not an array', 'application/x-npy') == 400
+    # a JSON Lines record without its itemId
+    assert status(inference.input_fn, b'{"itemId": 100}\n{"k": 3}', 'application/jsonlines') == 400
+
+
+def test_invalid_parameters_are_400():
+    served = model()
+    assert status(inference.predict_fn, {'itemId': 100, 'min_price': 'abc'}, served) == 400
+    assert status(inference.predict_fn, {'itemIds': [100], 'max_price': [1]}, served) == 400
+    assert status(inference.predict_fn, {'itemIds': 100}, served) == 400
+    assert status(inference.predict_fn, {'itemId': 'x1'}, served) == 400
+    assert status(inference.predict_fn, {'itemId': 999}, served) == 404
+
+    assert inference.predict_fn({'itemId': 109, 'k': 5, 'min_price': '1200'}, served)['rec'] == [111, 112, 113, 114]
+
+
+def test_invalid_exclusion_ids_are_400(tmp_path):
+    served = model()
+    served.exclusions = inference.ExclusionBitmap(served, directory=str(tmp_path))
+
+    assert status(inference.predict_fn, {'exclude': [101, 'abc']}, served) == 400
+    assert status(inference.predict_fn, {'restore': 101}, served) == 400
+    # nothing is applied when one of the ids is invalid
+    assert served.exclusions.count() == 0
+    assert inference.predict_fn({'exclude': [101, '102']}, served) == {'excluded': 2}
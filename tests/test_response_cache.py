@@ -0,0 +1,57 @@
+import json
+
+import numpy as np
+import pytest
+
+pytest.importorskip('sagemaker_inference')
+import inference
+from inference import ArtworkModel, ExclusionBitmap, ResponseCache
+
+
+def model(n_items=30, top_k=15):
+    item_ids = np.arange(200, 200 + n_items, dtype=np.int64)
+    neighbours = (np.arange(n_items)[:, None] + np.arange(1, top_k + 1)[None, :]) % n_items
+    return ArtworkModel(item_ids, neighbours.astype(np.int32), np.ones(neighbours.shape, dtype=np.float32),
+                        sorted_ids=True)
+
+
+def test_default_responses_are_cached_in_a_bounded_lru():
+    served = model()
+    served.response_cache = cache = ResponseCache(served, max_items=2)
+
+    body = inference.predict_fn({'itemId': 200}, served)
+    assert json.loads(body) == {'rec': served.recommendations(200)}
+    assert inference.output_fn(body, 'application/json') is body
+    assert inference.predict_fn({'itemId': 200}, served) is body
+
+    cache.get(201)
+    cache.get(200)
+    cache.get(202)
+    # 201 was the least recently used
+    assert list(cache.entries) == [200, 202]
+
+    # a non default request is not served from the cache
+    assert inference.predict_fn({'itemId': 200, 'k': 3}, served) == {'rec': [201, 202, 203]}
+    with pytest.raises(KeyError):
+        cache.get(999)
+
+
+def test_exclusion_updates_invalidate_the_cached_responses(tmp_path):
+    served = model()
+    served.exclusions = ExclusionBitmap(served, directory=str(tmp_path))
+    served.response_cache.preload()
+    assert len(served.response_cache.entries) == len(served.item_ids)
+    stale = served.response_cache.get(200)
+
+    inference.predict_fn({'exclude': [201, 203]}, served)
+
+    body = served.response_cache.get(200)
+    assert body != stale
+    assert json.loads(body) == {'rec': [202] + list(range(204, 213))}
+
+    # an update made by another worker, through its own mapping of the bitmap
+    other = model()
+    other.exclusions = ExclusionBitmap(other, directory=str(tmp_path))
+    other.exclusions.update([201, 203], excluded=False)
+
+    assert json.loads(served.response_cache.get(200)) == {'rec': list(range(201, 211))}
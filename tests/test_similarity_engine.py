@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.spatial.distance import pdist, squareform
+
+from artwork_content_recsys import ArtworkContent
+
+FEATURES = ['artist_id', 'artwork_medium', 'materials', 'artwork_period', 'artwork_price_range']
+
+
+def catalog(n_items=600, seed=0):
+    """raw items with few distinct values, so many scores are tied, and their categorical features"""
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({
+        'artwork_id': rng.permutation(np.arange(10, 10 + 3 * n_items, 3))[:n_items],
+        'artist_id': rng.integers(0, 40, n_items).astype(str),
+        'artwork_medium': rng.choice(['painting', 'print', 'photo', 'sculpture', None], n_items),
+        'materials': rng.choice(['oil', 'acrylic', 'paper', 'canvas', 'bronze', 'wood'], n_items),
+        'artwork_year': rng.integers(1950, 2021, n_items).astype(float),
+        'artwork_price': rng.choice(np.arange(100.0, 3100.0, 100.0), n_items),
+    })
+    data.loc[rng.random(n_items) < 0.05, 'artwork_price'] = np.nan
+
+    features = data.set_index('artwork_id')[['artist_id', 'artwork_medium', 'materials']].fillna('missing')
+    features['artwork_period'] = (data['artwork_year'].to_numpy() // 15).astype(int).astype(str)
+    features['artwork_price_range'] = pd.cut(data['artwork_price'], 5, labels=False).fillna(-1).astype(int).astype(str).to_numpy()
+    return data, features.sort_index()
+
+
+def reference_ranking(data, features):
+    """ranking of the pdist + sort_results implementation the engine replaced, every item ranked"""
+    encoded = pd.get_dummies(features, columns=FEATURES)
+    similarity = pd.DataFrame(squareform(1 - pdist(encoded.to_numpy(dtype=float), 'cosine')),
+                              index=encoded.index, columns=encoded.index)
+    attributes = data.set_index('artwork_id')
+
+    results = {}
+    for idx, row in similarity.iterrows():
+        final = attributes.loc[row.drop(labels=[idx]).index].assign(score=row.drop(labels=[idx]))
+        query = attributes.loc[idx]
+        final['same_medium'] = np.where(final['artwork_medium'] == query['artwork_medium'], 1, 0)
+        final['price_sort'] = abs(final['artwork_price'] - query['artwork_price'])
+        final['year_sort'] = abs(final['artwork_year'] - query['artwork_year'])
+        final = final.sort_values(['score', 'same_medium', 'year_sort', 'price_sort'], ascending=(False, False, True, True))
+        results[idx] = final
+    return results
+
+
+def ranking_keys(final):
+    """priority of every item of a reference ranking, rounded so tied scores compare equal, missing attributes last"""
+    keys = zip(final['score'].round(9), final['same_medium'], final['year_sort'].fillna(np.inf),
+               final['price_sort'].fillna(np.inf))
+    return dict(zip(final.index, keys))
+
+
+def fitted_engine(data, features, top_k, **kwargs):
+    model = ArtworkContent(data.copy(), top_k=top_k, block_size=64, **kwargs)
+    model.item_index = features.index
+    model.rank_features = model.rerank_features(model.item_index)
+    matrix = model.one_hot_encoding(features, FEATURES)
+    return model, matrix
+
+
+@pytest.fixture(scope='module')
+def reference():
+    data, features = catalog()
+    return data, features, reference_ranking(data, features)
+
+
+def test_top_k_matches_the_previous_ranking_at_tied_scores(reference):
+    data, features, expected = reference
+    top_k = 20
+    model, matrix = fitted_engine(data, features, top_k)
+
+    neighbours, scores = model.top_k_neighbours(matrix, 'cosine')
+    results = model.sort_results(model.item_index, neighbours, scores)
+
+    tied_cuts = 0
+    for item_id, ranked in results.items():
+        final, keys = expected[item_id], ranking_keys(expected[item_id])
+        items = [neighbour for neighbour, _, _ in ranked]
+        expected_items = list(final.index[:top_k])
+        # same priority at every rank, items only differ inside groups of identical keys
+        assert [keys[n] for n in items] == [keys[n] for n in expected_items]
+        assert [score for _, score, _ in ranked] == pytest.approx(final['score'].to_numpy()[:top_k])
+        for key in {keys[n] for n in items[:-1]}:
+            assert {n for n in items if keys[n] == key} == {n for n in expected_items if keys[n] == key}
+        tied_cuts += final['score'].iloc[top_k - 1] == final['score'].iloc[top_k]
+
+    # the catalog is large enough for the Kth score to be tied
+    assert tied_cuts > len(results) // 2
+
+
+def test_unlimited_top_k_ranks_every_item(reference):
+    data, features, expected = reference
+    model, matrix = fitted_engine(data, features, None)
+
+    results = model.sort_results(model.item_index, *model.top_k_neighbours(matrix, 'cosine'))
+
+    for item_id in features.index[:50]:
+        keys = ranking_keys(expected[item_id])
+        assert [keys[n] for n, _, _ in results[item_id]] == [keys[n] for n in expected[item_id].index]
+
+
+def test_rerank_matches_the_sort_values_priority(reference):
+    data, features, _ = reference
+    model, matrix = fitted_engine(data, features, 30)
+    rng = np.random.default_rng(1)
+    n_items = len(features)
+
+    # lists in score order with many tied scores, as the engine returns them
+    neighbours = np.stack([rng.choice(np.delete(np.arange(n_items), row), 30, replace=False) for row in range(n_items)])
+    scores = -np.sort(-rng.choice([0.2, 0.4, 0.6, 0.8], neighbours.shape), axis=1)
+
+    ranked_neighbours, ranked_scores = model.rerank(model.item_index, neighbours, scores)
+
+    attributes = data.set_index('artwork_id').loc[model.item_index].reset_index()
+    for row in rng.choice(n_items, 100, replace=False):
+        final = attributes.loc[neighbours[row]].assign(score=scores[row], position=np.arange(30))
+        query = attributes.loc[row]
+        final['same_medium'] = np.where(final['artwork_medium'] == query['artwork_medium'], 1, 0)
+        final['price_sort'] = abs(final['artwork_price'] - query['artwork_price'])
+        final['year_sort'] = abs(final['artwork_year'] - query['artwork_year'])
+        final = final.sort_values(['score', 'same_medium', 'year_sort', 'price_sort', 'position'],
+                                  ascending=(False, False, True, True, True))
+        assert ranked_neighbours[row].tolist() == final.index.tolist()
+        assert ranked_scores[row].tolist() == final['score'].tolist()
+
+
+def test_sharded_search_and_rerank_match_the_serial_ones(reference):
+    data, features, _ = reference
+    serial, matrix = fitted_engine(data, features, 20)
+    sharded, _ = fitted_engine(data, features, 20, n_workers=2)
+
+    neighbours, scores = serial.top_k_neighbours(matrix, 'cosine')
+    sharded_neighbours, sharded_scores = sharded.top_k_neighbours(matrix, 'cosine')
+    np.testing.assert_array_equal(sharded_neighbours, neighbours)
+    np.testing.assert_array_equal(sharded_scores, scores)
+
+    ranked = serial.rerank(serial.item_index, neighbours, scores)
+    sharded_ranked = sharded.rerank(sharded.item_index, sharded_neighbours, sharded_scores)
+    np.testing.assert_array_equal(sharded_ranked[0], ranked[0])
+    np.testing.assert_array_equal(sharded_ranked[1], ranked[1])
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from sparse_encoder import SparseOneHotEncoder
+
+COLUMNS = ['artist_id', 'artist1', 'artwork_medium', 'materials', 'artwork_year', 'artwork_price']
+
+
+def encoded_items(n_items=300, seed=0):
+    """items as one_hot_encoding receives them: string categories, missing values left by impute_missing"""
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({
+        'artist_id': rng.integers(0, 30, n_items).astype(str),
+        'artist1': rng.choice(['12', '7', None], n_items),
+        'artwork_medium': rng.choice(['painting', 'print', 'photo', None], n_items),
+        'materials': rng.choice(['oil_canvas', 'paper', 'bronze', 'wood'], n_items),
+        'artwork_year': rng.choice(['1950-1965', '1965-1980', '1980-1995', None], n_items),
+        'artwork_price': rng.choice(['0-500', '500-1000', '1000-5000'], n_items),
+    }, index=pd.Index(np.arange(1000, 1000 + n_items), name='artwork_id'))
+    return data
+
+
+def test_gram_matrix_matches_the_dummies_encoding():
+    data = encoded_items()
+    encoder = SparseOneHotEncoder()
+
+    matrix = encoder.fit_transform(data, COLUMNS)
+    dummies = pd.get_dummies(data, columns=COLUMNS).to_numpy(dtype=float)
+
+    assert encoder.feature_names.tolist() == pd.get_dummies(data, columns=COLUMNS).columns.tolist()
+    np.testing.assert_array_equal((matrix @ matrix.T).toarray(), dummies @ dummies.T)
+
+
+def test_weighted_groups_and_unseen_values():
+    data = encoded_items()
+    encoder = SparseOneHotEncoder({'artist_id': 2.0, 'materials': 0.5})
+
+    matrix = encoder.fit_transform(data, COLUMNS)
+    dummies = pd.get_dummies(data, columns=COLUMNS)
+    # the artist split columns belong to the artist_id group
+    weights = np.array([2.0 if name.startswith('artist_id_') or name.startswith('artist1_') else
+                        0.5 if name.startswith('materials_') else 1.0 for name in dummies.columns])
+    weighted = dummies.to_numpy(dtype=float) * weights
+    np.testing.assert_allclose((matrix @ matrix.T).toarray(), weighted @ weighted.T)
+
+    new_items = data.head(2).copy()
+    new_items.iloc[0, :] = 'unseen'
+    encoded = encoder.transform(new_items)
+    assert encoded[0].nnz == 0
+    np.testing.assert_array_equal(encoded[1].toarray(), matrix[1].toarray())
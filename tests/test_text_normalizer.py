@@ -0,0 +1,46 @@
+import re
+import string
+
+import pytest
+
+nltk = pytest.importorskip('nltk')
+from nltk.corpus import wordnet, stopwords
+
+try:
+    stopwords.words('english')
+    nltk.pos_tag(['canvas'])
+    nltk.WordNetLemmatizer().lemmatize('canvases')
+except LookupError:
+    pytest.skip('the nltk data (stopwords, wordnet, tagger) is not downloaded', allow_module_level=True)
+
+from text_normalizer import TextNormalizer
+
+MATERIALS = ['Oil on Canvas', 'oil on canvas', 'Acrylic, ink and gouache on paper', 'Bronze with patina',
+             'Gelatin silver prints', 'Mixed media on wood panels', 'oil on canvas', 'Carved and painted woods',
+             'Archival pigment print; edition of 10', 'Oils & pastels on boards']
+
+
+def previous_normalization(txt):
+    """per row clean_text + lemmatization of the model before the vocabulary level normalizer"""
+    txt = txt.lower()
+    txt = "".join([c for c in txt if c not in string.punctuation])
+    tokens = [word for word in re.split(r'\W+', txt) if word not in stopwords.words('english')]
+
+    tag_dict = {"J": wordnet.ADJ, "N": wordnet.NOUN, "V": wordnet.VERB, "R": wordnet.ADV}
+    lemmatizer = nltk.WordNetLemmatizer()
+    lemmas = [lemmatizer.lemmatize(word, pos=tag_dict.get(nltk.pos_tag([word])[0][1][0].upper(), wordnet.NOUN))
+              for word in tokens]
+    return ' '.join(lemmas)
+
+
+def test_normalized_materials_match_the_per_row_normalization():
+    expected = [previous_normalization(txt) for txt in MATERIALS]
+
+    assert TextNormalizer().normalize(MATERIALS) == expected
+
+
+def test_a_cache_smaller_than_the_vocabulary_gives_the_same_lemmas():
+    normalizer = TextNormalizer(cache_size=3)
+
+    assert normalizer.normalize(MATERIALS) == [previous_normalization(txt) for txt in MATERIALS]
+    assert len(normalizer.lemma_cache) == 3
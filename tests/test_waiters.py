@@ -0,0 +1,152 @@
+import pytest
+
+from waiters import Waiter, WaiterError, pipeline_execution_poller
+
+
+class FakeClock:
+    """clock and sleep of a waiter, sleeping only advances the time"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def scripted_poll(script):
+    """poller returning the next statuses of the script on every call"""
+    calls = []
+
+    def poll(pending):
+        calls.append(list(pending))
+        return script[min(len(calls), len(script)) - 1]
+
+    return poll, calls
+
+
+def make_waiter(poll, clock, **kwargs):
+    kwargs.setdefault('rng', lambda: 0.0)
+    return Waiter(poll, success=['Succeeded'], failure=['Failed'], clock=clock.clock, sleep=clock.sleep, **kwargs)
+
+
+def test_wait_polls_only_pending_resources():
+    clock = FakeClock()
+    poll, calls = scripted_poll([{'a': 'Executing', 'b': 'Executing'},
+                                 {'a': 'Succeeded', 'b': 'Executing'},
+                                 {'b': 'Succeeded'}])
+
+    statuses = make_waiter(poll, clock).wait(['a', 'b'])
+
+    assert statuses == {'a': 'Succeeded', 'b': 'Succeeded'}
+    assert calls == [['a', 'b'], ['a', 'b'], ['b']]
+
+
+def test_exponential_backoff_is_capped():
+    clock = FakeClock()
+    poll, _ = scripted_poll([{'a': 'Executing'}] * 6 + [{'a': 'Succeeded'}])
+
+    make_waiter(poll, clock, delay=1.0, backoff=2.0, max_delay=5.0).wait(['a'])
+
+    assert clock.sleeps == [1.0, 2.0, 4.0, 5.0, 5.0, 5.0]
+
+
+def test_jitter_shortens_the_delay():
+    clock = FakeClock()
+    poll, _ = scripted_poll([{'a': 'Executing'}, {'a': 'Succeeded'}])
+
+    make_waiter(poll, clock, delay=4.0, jitter=0.5, rng=lambda: 1.0).wait(['a'])
+
+    assert clock.sleeps == [2.0]
+
+
+def test_deadline_raises_with_the_last_statuses():
+    clock = FakeClock()
+    poll, _ = scripted_poll([{'a': 'Executing'}])
+
+    with pytest.raises(WaiterError) as error:
+        make_waiter(poll, clock, delay=4.0, timeout=10.0).wait(['a'])
+
+    assert error.value.statuses == {'a': 'Executing'}
+    assert clock.now == pytest.approx(10.0)
+
+
+def test_fail_fast_raises_on_the_first_failure():
+    clock = FakeClock()
+    poll, _ = scripted_poll([{'a': 'Failed', 'b': 'Executing'}])
+
+    with pytest.raises(WaiterError) as error:
+        make_waiter(poll, clock).wait(['a', 'b'])
+
+    assert error.value.statuses == {'a': 'Failed', 'b': 'Executing'}
+    assert clock.sleeps == []
+
+
+def test_without_fail_fast_waits_for_all_resources():
+    clock = FakeClock()
+    poll, _ = scripted_poll([{'a': 'Failed', 'b': 'Executing'}, {'b': 'Succeeded'}])
+
+    with pytest.raises(WaiterError) as error:
+        make_waiter(poll, clock).wait(['a', 'b'], fail_fast=False)
+
+    assert error.value.statuses == {'a': 'Failed', 'b': 'Succeeded'}
+
+
+class Throttled(Exception):
+    response = {'Error': {'Code': 'ThrottlingException'}}
+
+
+def test_throttled_polls_are_retried():
+    clock = FakeClock()
+    responses = [Throttled(), {'a': 'Succeeded'}]
+
+    def poll(pending):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert make_waiter(poll, clock).wait(['a']) == {'a': 'Succeeded'}
+    assert len(clock.sleeps) == 1
+
+
+def test_other_errors_are_raised():
+    clock = FakeClock()
+
+    def poll(pending):
+        raise KeyError('boom')
+
+    with pytest.raises(KeyError):
+        make_waiter(poll, clock).wait(['a'])
+
+
+class FakeSageMaker:
+    """list_pipeline_executions paged two executions at a time"""
+
+    def __init__(self, executions):
+        self.executions = executions
+        self.calls = 0
+
+    def list_pipeline_executions(self, MaxResults, NextToken=None, **kwargs):
+        self.calls += 1
+        start = int(NextToken or 0)
+        page = self.executions[start:start + 2]
+        response = {'PipelineExecutionSummaries': [{'PipelineExecutionArn': arn, 'PipelineExecutionStatus': status}
+                                                   for arn, status in page]}
+        if start + 2 < len(self.executions):
+            response['NextToken'] = str(start + 2)
+        return response
+
+
+def test_pipeline_poller_stops_paging_once_all_found():
+    sm = FakeSageMaker([('e1', 'Executing'), ('e2', 'Succeeded'), ('e3', 'Failed'), ('e4', 'Succeeded')])
+    poll = pipeline_execution_poller(sm, 'pipeline')
+
+    assert poll(['e1', 'e2']) == {'e1': 'Executing', 'e2': 'Succeeded'}
+    assert sm.calls == 1
+    assert poll(['e4']) == {'e4': 'Succeeded'}
+    assert sm.calls == 3
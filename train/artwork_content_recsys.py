@@ -3,6 +3,7 @@
 import os
 import re
 import nltk
+import json
 import time
 import string
 import pickle
@@ -12,12 +13,29 @@ import pandas as pd
 from tqdm import tqdm
 
 from nltk.corpus import wordnet, stopwords
-from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
 from sklearn.feature_extraction.text import CountVectorizer
-from scipy.spatial.distance import pdist, jaccard, squareform
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from lsh_index import LSHIndex
+from text_normalizer import TextNormalizer
+from sparse_encoder import SparseOneHotEncoder
+from similarity_pool import SharedArrays, run_shards, top_k_shard, rerank_shard
 
 pd.set_option('mode.chained_assignment',None)
 
+# compact model artifact, memory mapped by scoring/inference.py
+ARTIFACT_VERSION = 2
+ARTIFACT_MANIFEST = 'manifest.json'
+ARTIFACT_FILES = {'item_ids': 'item_ids.npy', 'neighbours': 'neighbours.npy', 'scores': 'scores.npy',
+                  'prices': 'prices.npy', 'years': 'years.npy', 'medium_codes': 'medium_codes.npy',
+                  'artist_codes': 'artist_codes.npy', 'matrix_data': 'matrix_data.npy',
+                  'matrix_indices': 'matrix_indices.npy', 'matrix_indptr': 'matrix_indptr.npy',
+                  'squared_norms': 'squared_norms.npy'}
+# feature pipeline of new items (encoder, bins, materials map) for the cold start recommendations
+ARTIFACT_COLD_START = 'cold_start.json'
+
 
 # -
 
@@ -27,10 +45,26 @@ class ArtworkContent:
         
     """
 
-    def __init__(self, dataFrame):
+    def __init__(self, dataFrame, top_k=100, block_size=1024, metric='cosine', 
+                 approximate=False, lsh_params=None, recall_sample=1000, material_threshold=0.70, n_workers=1,
+                 feature_weights=None, incremental_max_dirty=0.3):
         """
         initializing the dataframe
         
+        ---------- Input ---------------
+        dataFrame: raw artwork content dataframe
+        top_k: number of similar items kept per artwork, None keeps all of them
+        block_size: number of query rows scored together by the similarity engine
+        metric: similarity metric, 'cosine', 'dice' or 'jaccard'
+        approximate: scores only the LSH candidates instead of all the items
+        lsh_params: LSHIndex parameters (hashing, n_bands, band_size, max_bucket_size, seed)
+        recall_sample: number of items sampled to measure the approximate recall@10
+        material_threshold: cosine similarity above which two materials are grouped
+        n_workers: number of processes used by the similarity search and the re-ranking
+        feature_weights: weight of every feature group in the encoded matrix, default 1.0
+        incremental_max_dirty: fraction of the items an incremental retrain may score against 
+            the whole catalog, a full training is run above it
+        
         """
         
         # renaming the raw column names to lower case names 
@@ -39,6 +73,22 @@ class ArtworkContent:
                                         'MATERIALS':'materials', 'ARTWORK_YEAR':'artwork_year', 'GALLERY_ESTABLISHED_YEAR':'gallery_established_year'
                            }, inplace = True)
         self.dataFrame = dataFrame
+        self.top_k = top_k
+        self.block_size = block_size
+        self.metric = metric
+        self.approximate = approximate
+        self.lsh_params = lsh_params or {}
+        self.recall_sample = recall_sample
+        self.material_threshold = material_threshold
+        self.text_normalizer = None
+        self.n_workers = n_workers
+        self.feature_weights = feature_weights or {}
+        self.incremental_max_dirty = incremental_max_dirty
+        self.encoder = None
+        self.materials_map = {}
+        self.year_bins = None
+        self.price_bins = None
+        self.rank_features = None
         
         
     def preprocessing(self, features):
@@ -98,6 +148,9 @@ class ArtworkContent:
             # imputing dummy values
             for item, value in nan_values.items():
                 if len(value) > 0:
+                    # categorical columns (typed ingestion) need the dummy value as a category first
+                    if isinstance(data[item].dtype, pd.CategoricalDtype) and impute_values[item] not in data[item].cat.categories:
+                        data[item] = data[item].cat.add_categories([impute_values[item]])
                     data.loc[data['artwork_id'].isin(value), item] = impute_values[item]
         else:
             data = data.reset_index()
@@ -109,131 +162,69 @@ class ArtworkContent:
         
         return data
         
-    def clean_text(self, txt):
-        """
-        cleans the given text
-        
-        ---------- Input ---------------
-        txt: text to be cleaned
-        
-        ---------- output ---------------
-        txt: cleaned text
-        
-        """   
-            
-        stopwords = nltk.corpus.stopwords.words('english')
-        txt = txt.lower()
-        txt = "".join([c for c in txt if c not in string.punctuation])
-        tokens = re.split('\W+', txt)
-        txt = [word for word in tokens if word not in stopwords]
-        return txt
-        
-    def get_wordnet_pos(self, word):
+    def similar_material_pairs(self, materials):
         """
-        Find the parts of speech of a word
+        Pairs of material strings with a cosine similarity above the
+        material threshold, computed block by block on the sparse
+        count vectors so only the pairs above the threshold are kept
         
         ---------- Input ---------------
-        word: the word 
+        materials: array of unique lemmatized material strings
         
         ---------- output ---------------
-        tag_dict.get(tag, wordnet.NOUN): pos of that word
-        
-        """  
-
-        tag = nltk.pos_tag([word])[0][1][0].upper()
-        tag_dict = {"J": wordnet.ADJ,
-                    "N": wordnet.NOUN,
-                    "V": wordnet.VERB,
-                    "R": wordnet.ADV}
-
-        return tag_dict.get(tag, wordnet.NOUN)    
+        rows, cols: positions of the similar material pairs
         
-    def lemmatization(self, token_txt):
         """
-        lemmitizes the text
-        
-        ---------- Input ---------------
-        token_txt: text to be lemmitized
-        
-        ---------- output ---------------
-        txt: lemmitized text
-        
-        """  
-        
-        lemmatizer = nltk.WordNetLemmatizer()
-        txt = [lemmatizer.lemmatize(word,  pos = self.get_wordnet_pos(word)) for word in token_txt ]
-        txt = ' '.join(str(e) for e in txt)
-        return txt
-        
-    def common_data(self, list1, list2):
+        vectorizer = CountVectorizer()
+        try:
+            count_matrix = vectorizer.fit_transform(materials)
+        except ValueError:
+            # no tokens at all in the materials, nothing to group
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        
+        count_matrix = normalize(count_matrix.astype(np.float64))
+        
+        rows, cols = [], []
+        for start in range(0, count_matrix.shape[0], self.block_size):
+            block = count_matrix[start:start + self.block_size] @ count_matrix.T
+            block = sparse.coo_matrix(block)
+            keep = block.data >= self.material_threshold
+            rows.append(block.row[keep] + start)
+            cols.append(block.col[keep])
+        
+        return np.concatenate(rows), np.concatenate(cols)
+    
+    def group_materials(self, materials):
         """
-        Finds if there any common data in two list
+        Groups similar material strings with connected components
+        (union-find) over the thresholded similarity graph and picks the
+        longest string of every group as its canonical value
         
         ---------- Input ---------------
-        list1: first list
-        list2: second list
+        materials: array of unique lemmatized material strings
         
         ---------- output ---------------
-        result: returns true if theres any common data in the list
-        
-        """ 
-        result = False
-        for x in list1:
-            for y in list2:
-                if x == y:
-                    result = True
-        return result
+        canonical: canonical material string of every input string
         
-    def combine_results(self, results):
         """
-        Combines  list of results in to one single result
-        
-        ---------- Input ---------------
-        results: list of results
-        
-        ---------- output ---------------
-        final_result: combination of all the results
+        n_materials = len(materials)
+        if n_materials == 0:
+            return np.asarray(materials, dtype=object)
         
-        """ 
-        
-        final_result = []
-        for i in results:
-            temp = []
-            for j in results:
-                i.sort()
-                j.sort()
-                if i !=j:
-                    if self.common_data(i, j):
-                        temp.append(i+j)
-            if len(temp) <= 0:
-                temp.append(i)
-            temp[0].sort()
-            final_result.append(list(set(temp[0])))
-
-        return final_result
-        
-    def choose_text(self, test, indices):
-        """
-        Chooses the final text
+        rows, cols = self.similar_material_pairs(materials)
         
-        ---------- Input ---------------
-        test: datafram
-        indices: similarity indices list
+        graph = sparse.coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n_materials, n_materials))
+        _, labels = connected_components(graph, directed=False)
         
-        ---------- output ---------------
-        final_value: final lemmitized material name (grouped)
+        # longest string of every component, the first one on equal lengths
+        lengths = np.array([len(material) for material in materials])
+        order = np.lexsort((np.arange(n_materials), -lengths, labels))
+        first_of_group = np.r_[True, labels[order][1:] != labels[order][:-1]]
         
-        """ 
+        canonical_position = np.empty(labels.max() + 1, dtype=np.int64)
+        canonical_position[labels[order][first_of_group]] = order[first_of_group]
         
-        temp_df = test.loc[indices, :]
-        counter = 0
-        final_value = ''
-        for i, r in temp_df.iterrows():
-            if len(r['lemmatized_materials']) > counter:
-                counter = len(r['lemmatized_materials'])
-                final_value = r['lemmatized_materials']
-
-        return final_value
+        return np.asarray(materials, dtype=object)[canonical_position[labels]]
         
         
     def nlp_material(self, data):
@@ -248,47 +239,23 @@ class ArtworkContent:
         
         """ 
         
-        # Data Cleaning
-        data['cleaned_text'] = data['materials'].apply(lambda x : self.clean_text(x))
-
-        # Material lemmatization
-        data['lemmatized_materials'] = data['cleaned_text'].apply(lambda x : self.lemmatization(x))
+        # Data Cleaning and lemmatization over the unique materials vocabulary
+        if self.text_normalizer is None:
+            self.text_normalizer = TextNormalizer()
+        data['lemmatized_materials'] = self.text_normalizer.normalize(data['materials'])
 
-        # Dropped cleaned_text
-        data = data.drop('cleaned_text', 1)
-
-        # Vectorizing and Finding the cosine similarity between them
-        vectorizer = CountVectorizer()
-        count_matrix = vectorizer.fit_transform(data['lemmatized_materials'])
-        cosine_similarities = cosine_similarity(count_matrix, count_matrix) 
-
-        np.fill_diagonal(cosine_similarities, 0)
-        sim_df = pd.DataFrame(cosine_similarities, index=data.index, columns= data.index)
-
-
-        # filtering out the items with similarity score greater than 0.5
-        results = []
-        for i, r in sim_df.iterrows():    
-            result = [[i,items[0]] for items in r.iteritems() if items[1] >= 0.70] 
-            if len(result) > 0:
-                results.append(result[0])
-
-        # Combining the results
-        final_result = self.combine_results(results)
-
-        # Sorting the final result and removing the duplicates
-        final_result.sort()
-        sim_list = list(k for k,_ in itertools.groupby(final_result))
-
-        # Change to common value
-        for indices in sim_list:
-            value = self.choose_text(data, indices)
-            for index in indices:
-                data.loc[data.index == index, "lemmatized_materials"] = value
+        # Grouping the similar materials over the unique strings
+        # and assigning the canonical value of every group at once
+        codes, materials = pd.factorize(data['lemmatized_materials'])
+        canonical = self.group_materials(np.asarray(materials))
+        data['lemmatized_materials'] = canonical[codes]
 
         # Replace empty space with underscore
         data['lemmatized_materials'] = data.lemmatized_materials.replace(' ', '_', regex=True)
 
+        # raw material text -> grouped value, used to encode new items at serving time
+        self.materials_map = dict(zip(data['materials'].astype(str), data['lemmatized_materials']))
+
         return data
         
     def bin_labelling(self, bins):
@@ -333,8 +300,9 @@ class ArtworkContent:
         labels = self.bin_labelling(bins)
         
         df['artwork_period'] = pd.cut(df['artwork_year'], bins=bins, labels=labels, include_lowest=True)
-        df = df.drop('materials', 1)
-        df = df.drop('artwork_year', 1)
+        self.year_bins = {'edges': [float(edge) for edge in bins], 'labels': [str(label) for label in labels]}
+        df = df.drop('materials', axis=1)
+        df = df.drop('artwork_year', axis=1)
 
         return df    
         
@@ -355,7 +323,10 @@ class ArtworkContent:
         bin_width = int(len(price)/15) + 1
         
         data['artwork_price_range'] = pd.qcut(data['artwork_price'], q=bin_width, duplicates='drop')
-        data = data.drop('artwork_price', 1)
+        intervals = data['artwork_price_range'].cat.categories
+        self.price_bins = {'edges': [float(intervals[0].left)] + [float(interval.right) for interval in intervals],
+                           'labels': [str(interval) for interval in intervals]}
+        data = data.drop('artwork_price', axis=1)
 
         return data
     
@@ -378,7 +349,7 @@ class ArtworkContent:
         artist_df = artist_df.add_prefix('artist')
         
         data = pd.concat([data, artist_df], axis=1)
-        data = data.drop('artist_id', 1)
+        data = data.drop('artist_id', axis=1)
         return data
         
     def one_hot_encoding(self, data, catergorical_columns):
@@ -390,12 +361,502 @@ class ArtworkContent:
         catergorical_columns: columns to be encoded
         
         ---------- output ---------------
-        data: encoded dataframe
+        matrix: sparse CSR matrix [items, features], the fitted
+        vocabulary is kept in self.encoder
         
         """ 
-        return pd.get_dummies(data, columns = catergorical_columns)
+        self.encoder = SparseOneHotEncoder(self.feature_weights)
+        return self.encoder.fit_transform(data, catergorical_columns)
+        
+    def metric_scores(self, intersection, norms_a, norms_b, metric):
+        """
+        Similarity scores from the dot products and squared norms of the
+        compared items, arrays are broadcast against each other
+        
+        ---------- Input ---------------
+        intersection: dot products of the compared items
+        norms_a: squared L2 norms of the first items
+        norms_b: squared L2 norms of the second items
+        metric: 'cosine', 'dice' or 'jaccard'
+        
+        ---------- output ---------------
+        scores: similarity scores
+        
+        """
+        if metric == 'cosine':
+            numerator, denominator = intersection, np.sqrt(norms_a * norms_b)
+        elif metric == 'dice':
+            numerator, denominator = 2 * intersection, norms_a + norms_b
+        elif metric == 'jaccard':
+            numerator, denominator = intersection, norms_a + norms_b - intersection
+        else:
+            raise ValueError(f"Unsupported similarity metric: {metric}")
+        
+        # empty items score 0 against everything
+        numerator, denominator = np.broadcast_arrays(numerator, denominator)
+        scores = np.zeros(numerator.shape, dtype=np.float64)
+        np.divide(numerator, denominator, out=scores, where=denominator > 0)
+        
+        return scores
+    
+    def pairwise_scores(self, block, matrix, squared_norms, block_norms, metric):
+        """
+        Similarity scores between a block of query rows and all the items
+        
+        ---------- Input ---------------
+        block: sparse matrix, encoded query rows
+        matrix: sparse matrix, encoded items
+        squared_norms: squared L2 norm of every item
+        block_norms: squared L2 norm of every query row
+        metric: 'cosine', 'dice' or 'jaccard'
+        
+        ---------- output ---------------
+        scores: dense array [block rows, items] of similarity scores
+        
+        """
+        intersection = (block @ matrix.T).toarray()
+        
+        return self.metric_scores(intersection, block_norms[:, None], squared_norms[None, :], metric)
+    
+    def tie_break_keys(self, queries, candidates):
+        """
+        np.lexsort keys ranking the candidates of equal score with the re-ranking
+        priority same_medium (desc), year_sort (asc), price_sort (asc) and then
+        the item position. Only the item position without rank_features
+        
+        ---------- Input ---------------
+        queries: item positions of the queries
+        candidates: item positions of the candidates, one per query
+        
+        ---------- output ---------------
+        keys: tuple of key arrays, least significant first
+        
+        """
+        if self.rank_features is None:
+            return (candidates,)
+        
+        medium_codes, prices, years = self.rank_features
+        same_medium = (medium_codes[candidates] == medium_codes[queries]) & (medium_codes[queries] != -1)
+        
+        return (candidates, np.abs(prices[candidates] - prices[queries]), np.abs(years[candidates] - years[queries]),
+                -same_medium.astype(np.int8))
+    
+    def select_top_k(self, scores, k, rows=None):
+        """
+        Picks the k best scored columns of every row, ordered by descending
+        score. Ties are broken with tie_break_keys, so the items kept at the
+        kth score are the ones the re-ranking puts first
+        
+        ---------- Input ---------------
+        scores: dense array [rows, items] of similarity scores
+        k: number of items to keep per row
+        rows: item positions of the rows, defaults to 0..rows-1
+        
+        ---------- output ---------------
+        neighbours: item positions [rows, k]
+        scores: similarity scores [rows, k]
+        
+        """
+        n_rows = scores.shape[0]
+        rows = np.arange(n_rows) if rows is None else np.asarray(rows)
+        
+        if k == 0:
+            return np.empty((n_rows, 0), dtype=np.int64), np.empty((n_rows, 0), dtype=scores.dtype)
+        
+        # kth best score of every row, only the items scoring at least
+        # as high are sorted and the first k of every row are kept
+        n_items = scores.shape[1]
+        kth = np.partition(scores, n_items - k, axis=1)[:, n_items - k]
+        candidate_rows, candidate_positions = np.nonzero(scores >= kth[:, None])
+        candidate_scores = scores[candidate_rows, candidate_positions]
+        
+        tie_break = self.tie_break_keys(rows[candidate_rows], candidate_positions)
+        order = np.lexsort(tie_break + (-candidate_scores, candidate_rows))
+        candidate_rows = candidate_rows[order]
+        rank = np.arange(len(order)) - np.searchsorted(candidate_rows, candidate_rows, side='left')
+        keep = order[rank < k]
+        
+        return (candidate_positions[keep].reshape(n_rows, k), candidate_scores[keep].reshape(n_rows, k))
+    
+    def top_k_block(self, matrix, squared_norms, block_rows, k, metric):
+        """
+        Top-K neighbours of one block of query rows
+        
+        ---------- Input ---------------
+        matrix: sparse CSR matrix [items, features], encoded items
+        squared_norms: squared L2 norm of every item
+        block_rows: item positions of the query rows
+        k: number of neighbours to keep
+        metric: 'cosine', 'dice' or 'jaccard'
+        
+        ---------- output ---------------
+        neighbours: item positions [block rows, k]
+        scores: similarity scores [block rows, k]
+        
+        """
+        block_scores = self.pairwise_scores(matrix[block_rows], matrix, squared_norms, 
+                                            squared_norms[block_rows], metric)
+        
+        # an item is never its own neighbour
+        block_scores[np.arange(len(block_rows)), block_rows] = -np.inf
+        
+        return self.select_top_k(block_scores, k, block_rows)
+    
+    def top_k_neighbours(self, matrix, metric, rows=None, top_k=None):
+        """
+        Blocked top-K similarity search over the sparse encoded matrix.
+        Only one block of query rows is scored at a time, so the peak
+        memory is O(N*K + block_size*N) instead of O(N^2). With n_workers > 1
+        the query rows are sharded over a process pool sharing the matrix.
+        The K kept at tied scores follow the re-ranking priority (see
+        tie_break_keys), so the lists match a re-ranking of all the items
+        
+        ---------- Input ---------------
+        matrix: sparse matrix [items, features], encoded items
+        metric: 'cosine', 'dice' or 'jaccard'
+        rows: item positions to query, defaults to all items
+        top_k: number of neighbours to keep, defaults to self.top_k
+        
+        ---------- output ---------------
+        neighbours: int32 array [rows, K] of item positions
+        scores: float array [rows, K] of similarity scores
+        
+        """
+        matrix = sparse.csr_matrix(matrix, dtype=np.float64)
+        n_items = matrix.shape[0]
+        rows = np.arange(n_items) if rows is None else np.asarray(rows)
+        top_k = self.top_k if top_k is None else top_k
+        k = n_items - 1 if top_k is None else min(top_k, n_items - 1)
+        
+        squared_norms = np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel()
+        
+        if self.n_workers > 1 and len(rows) > self.block_size:
+            return self.parallel_top_k_neighbours(matrix, squared_norms, rows, k, metric)
+        
+        neighbours = np.empty((len(rows), k), dtype=np.int32)
+        scores = np.empty((len(rows), k), dtype=np.float64)
+        
+        for start in range(0, len(rows), self.block_size):
+            block_rows = rows[start:start + self.block_size]
+            block_neighbours, block_values = self.top_k_block(matrix, squared_norms, block_rows, k, metric)
+            neighbours[start:start + len(block_rows)] = block_neighbours
+            scores[start:start + len(block_rows)] = block_values
+        
+        return neighbours, scores
+    
+    def parallel_top_k_neighbours(self, matrix, squared_norms, rows, k, metric):
+        """
+        top_k_neighbours sharded over n_workers processes. The CSR arrays are
+        placed in shared memory once, every worker owns ranges of query rows
+        and writes its top-K arrays straight into the shared outputs
+        
+        ---------- Input ---------------
+        matrix: sparse CSR matrix [items, features], encoded items
+        squared_norms: squared L2 norm of every item
+        rows: item positions to query
+        k: number of neighbours to keep
+        metric: 'cosine', 'dice' or 'jaccard'
+        
+        ---------- output ---------------
+        neighbours: int32 array [rows, K] of item positions
+        scores: float array [rows, K] of similarity scores
+        
+        """
+        shared = SharedArrays()
+        try:
+            shared.add('data', matrix.data)
+            shared.add('indices', matrix.indices)
+            shared.add('indptr', matrix.indptr)
+            shared.add('squared_norms', squared_norms)
+            shared.add('rows', rows)
+            if self.rank_features is not None:
+                for name, values in zip(('medium_codes', 'prices', 'years'), self.rank_features):
+                    shared.add(name, values)
+            neighbours = shared.empty('neighbours', (len(rows), k), np.int32)
+            scores = shared.empty('scores', (len(rows), k), np.float64)
+            
+            run_shards(type(self), self.block_size, self.n_workers, shared, top_k_shard, (k, metric), 
+                       len(rows), matrix_shape=matrix.shape)
+            
+            return neighbours.copy(), scores.copy()
+        finally:
+            shared.release()
+        
+    def approximate_neighbours(self, matrix, metric):
+        """
+        Approximate top-K similarity search, only the candidate pairs
+        colliding in the LSH index are scored. Items with fewer than K
+        candidates are padded with position -1 and score -inf
+        
+        ---------- Input ---------------
+        matrix: sparse matrix [items, features], encoded items
+        metric: 'cosine', 'dice' or 'jaccard'
+        
+        ---------- output ---------------
+        neighbours: int32 array [items, K] of item positions
+        scores: float array [items, K] of similarity scores
+        
+        """
+        matrix = sparse.csr_matrix(matrix, dtype=np.float64)
+        n_items = matrix.shape[0]
+        k = n_items - 1 if self.top_k is None else min(self.top_k, n_items - 1)
+        
+        squared_norms = np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel()
+        
+        neighbours = np.full((n_items, k), -1, dtype=np.int32)
+        scores = np.full((n_items, k), -np.inf, dtype=np.float64)
+        
+        # candidates generated, scored and ranked one block of queries at a time, the memory stays bounded
+        index = LSHIndex(**self.lsh_params)
+        n_pairs = 0
+        for queries, candidates in index.candidate_blocks(matrix, self.block_size):
+            n_pairs += len(queries)
+            
+            # exact scores of the candidate pairs
+            intersection = np.asarray(matrix[queries].multiply(matrix[candidates]).sum(axis=1)).ravel()
+            pair_scores = self.metric_scores(intersection, squared_norms[queries], squared_norms[candidates], metric)
+            
+            # keeping the k best candidates of every query, same tie break as the exact engine
+            order = np.lexsort(self.tie_break_keys(queries, candidates) + (-pair_scores, queries))
+            queries, candidates, pair_scores = queries[order], candidates[order], pair_scores[order]
+            
+            query_starts = np.searchsorted(queries, queries, side='left')
+            rank = np.arange(len(queries)) - query_starts
+            keep = rank < k
+            
+            neighbours[queries[keep], rank[keep]] = candidates[keep]
+            scores[queries[keep], rank[keep]] = pair_scores[keep]
+        
+        print(f'LSH candidate pairs: {n_pairs} ({n_pairs / max(n_items, 1):.1f} per item)')
+        
+        return neighbours, scores
+    
+    def recall_at_k(self, matrix, metric, neighbours, scores, k=10):
+        """
+        Recall@k of the approximate neighbours against the exact engine,
+        measured on a random sample of items. A neighbour counts as a hit
+        when it scores at least as high as the exact kth neighbour, so ties
+        on the kth score are not penalised
+        
+        ---------- Input ---------------
+        matrix: sparse matrix [items, features], encoded items
+        metric: 'cosine', 'dice' or 'jaccard'
+        neighbours: approximate neighbours [items, K]
+        scores: approximate scores [items, K]
+        k: recall cut off
+        
+        ---------- output ---------------
+        recall: mean recall@k over the sampled items
+        
+        """
+        n_items = matrix.shape[0]
+        k = min(k, n_items - 1, neighbours.shape[1])
+        if k <= 0:
+            return 1.0
+        
+        rng = np.random.default_rng(0)
+        sample = rng.choice(n_items, size=min(self.recall_sample, n_items), replace=False)
+        
+        _, exact_scores = self.top_k_neighbours(matrix, metric, rows=sample, top_k=k)
+        kth_scores = exact_scores[:, k - 1]
+        
+        sample_neighbours = neighbours[sample, :k]
+        sample_scores = scores[sample, :k]
+        hits = ((sample_neighbours >= 0) & (sample_scores >= kth_scores[:, None] - 1e-12)).sum(axis=1)
+        
+        return float(np.mean(hits / k))
+        
+    def feature_column_map(self, previous_names, old_matrix, new_matrix):
+        """
+        Current column of every previous feature. Features are matched by name,
+        a renamed one (refitted year/price bins, regrouped materials) is matched
+        to the current feature of the same column most of its items have now.
+        The map is one to one, so the scores between items whose encoding was
+        only renamed stay the same
+        
+        ---------- Input ---------------
+        previous_names: feature names of the previous model
+        old_matrix: sparse matrix, previous encoding of the kept items
+        new_matrix: sparse matrix, current encoding of the same items
+        
+        ---------- output ---------------
+        column_map: current column of every previous feature, -1 if none
+        
+        """
+        column_map = pd.Index(self.feature_names).get_indexer(previous_names)
+        unmatched = np.flatnonzero(column_map < 0)
+        if len(unmatched) == 0:
+            return column_map
+        
+        # encoded column ('<column>_<value>') of every feature, the longest matching prefix
+        def feature_columns(names):
+            columns = np.full(len(names), '', dtype=object)
+            for column in sorted(self.encoder.columns, key=len):
+                columns[np.char.startswith(np.asarray(names, dtype=str), f'{column}_')] = column
+            return columns
+        old_columns = feature_columns(np.asarray(previous_names)[unmatched])
+        new_columns = feature_columns(self.feature_names)
+        
+        taken = np.zeros(len(self.feature_names), dtype=bool)
+        taken[column_map[column_map >= 0]] = True
+        
+        # number of kept items with both features, the largest overlaps are matched first
+        old_active = sparse.csc_matrix(old_matrix)[:, unmatched] != 0
+        overlap = (old_active.T.astype(np.int64) @ (sparse.csr_matrix(new_matrix) != 0).astype(np.int64)).tocoo()
+        order = np.lexsort((overlap.col, overlap.row, -overlap.data))
+        for row, col in zip(overlap.row[order], overlap.col[order]):
+            if column_map[unmatched[row]] < 0 and not taken[col] and old_columns[row] == new_columns[col]:
+                column_map[unmatched[row]] = col
+                taken[col] = True
+        
+        return column_map
+    
+    def changed_items(self, matrix, previous_state):
+        """
+        Diffs the encoded catalog against the previous model state by artwork id.
+        An item is unchanged when its encoding only had features renamed (see
+        feature_column_map) and its re-ranking attributes are the same
         
-    def similarity_results(self, encoded_data, metric):
+        ---------- Input ---------------
+        matrix: sparse matrix [items, features], encoded items
+        previous_state: state of the previous model, see get_state
+        
+        ---------- output ---------------
+        dirty: bool array over the items, True for the added or changed items
+        old_to_new: position of every previous item in the current items, -1 if removed
+        
+        """
+        old_to_new = self.item_index.get_indexer(previous_state['item_ids'])
+        
+        dirty = np.ones(matrix.shape[0], dtype=bool)
+        kept = old_to_new >= 0
+        
+        # previous encoding expressed in the current feature columns,
+        # an active feature that does not exist anymore marks the item as changed
+        old_matrix = previous_state['matrix'][np.flatnonzero(kept)]
+        column_map = self.feature_column_map(previous_state['feature_names'], old_matrix, matrix[old_to_new[kept]])
+        old_matrix = old_matrix.tocoo()
+        dropped_feature = np.zeros(old_matrix.shape[0], dtype=bool)
+        dropped_feature[old_matrix.row[column_map[old_matrix.col] < 0]] = True
+        
+        valid = column_map[old_matrix.col] >= 0
+        old_matrix = sparse.csr_matrix((old_matrix.data[valid], (old_matrix.row[valid], column_map[old_matrix.col[valid]])), 
+                                       shape=(old_matrix.shape[0], matrix.shape[1]))
+        
+        difference = abs(old_matrix - matrix[old_to_new[kept]])
+        changed = (np.asarray(difference.sum(axis=1)).ravel() > 0) | dropped_feature
+        
+        # the re-ranking attributes break the ties of the lists, a new price
+        # or year inside the same bin changes the ranking too
+        mediums, prices, years = self.ranking_attributes(self.item_index[old_to_new[kept]])
+        for current, previous in ((mediums, previous_state['rank_mediums']), (prices, previous_state['rank_prices']), 
+                                  (years, previous_state['rank_years'])):
+            previous = previous[kept]
+            same = current == previous
+            if current.dtype.kind == 'f':
+                same |= np.isnan(current) & np.isnan(previous)
+            changed |= ~same
+        dirty[old_to_new[kept]] = changed
+        
+        return dirty, old_to_new
+    
+    def incremental_neighbours(self, matrix, metric, previous_state):
+        """
+        Updates the top-K neighbours of the previous model with a catalog delta.
+        The added/changed items and the items whose previous list contains
+        a changed or removed item are recomputed, the other items merge their
+        previous list with the changed items entering it. Items are ordered
+        by artwork id, so the result matches a full retrain
+        
+        ---------- Input ---------------
+        matrix: sparse matrix [items, features], encoded items
+        metric: 'cosine', 'dice' or 'jaccard'
+        previous_state: state of the previous model, see get_state
+        
+        ---------- output ---------------
+        neighbours: int32 array [items, K] of item positions
+        scores: float array [items, K] of similarity scores
+        None when the delta exceeds incremental_max_dirty
+        
+        """
+        matrix = sparse.csr_matrix(matrix, dtype=np.float64)
+        n_items = matrix.shape[0]
+        k = n_items - 1 if self.top_k is None else min(self.top_k, n_items - 1)
+        
+        dirty, old_to_new = self.changed_items(matrix, previous_state)
+        dirty_rows = np.flatnonzero(dirty)
+        
+        # previous lists expressed in current positions, -1 for removed items
+        kept = old_to_new >= 0
+        rows = old_to_new[kept]
+        old_neighbours = old_to_new[previous_state['neighbours'][kept]]
+        old_scores = previous_state['scores'][kept]
+        
+        unchanged = ~dirty[rows]
+        invalid = (old_neighbours < 0).any(axis=1) | dirty[np.maximum(old_neighbours, 0)].any(axis=1)
+        merge = unchanged & ~invalid
+        
+        recompute = np.union1d(dirty_rows, rows[unchanged & invalid])
+        print(f'Incremental training: {len(dirty_rows)} added/changed, '
+              f'{len(previous_state["item_ids"]) - kept.sum()} removed, {len(recompute)} items recomputed')
+        
+        # every recomputed and every changed item is scored against all the items,
+        # above the limit the delta costs about as much as a full training
+        dirty_fraction = (len(recompute) + len(dirty_rows)) / n_items
+        if dirty_fraction > self.incremental_max_dirty:
+            print(f'Incremental training scores {dirty_fraction:.1%} of the items '
+                  f'(limit {self.incremental_max_dirty:.1%}), running a full training')
+            return None
+        
+        neighbours = np.full((n_items, k), -1, dtype=np.int32)
+        scores = np.full((n_items, k), -np.inf, dtype=np.float64)
+        
+        if len(recompute):
+            neighbours[recompute], scores[recompute] = self.top_k_neighbours(matrix, metric, rows=recompute, top_k=k)
+        
+        merge_rows = rows[merge]
+        old_neighbours, old_scores = old_neighbours[merge], old_scores[merge]
+        
+        # a changed item enters a list when it scores at least as high as its
+        # last entry, complete lists (shorter than K) take every changed item
+        full_list = self.top_k is not None and old_neighbours.shape[1] >= self.top_k
+        threshold = np.full(n_items, -np.inf)
+        if full_list and old_scores.shape[1]:
+            threshold[merge_rows] = old_scores[:, -1]
+        
+        is_merge = np.zeros(n_items, dtype=bool)
+        is_merge[merge_rows] = True
+        
+        squared_norms = np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel()
+        entering = [[], [], []]
+        for start in range(0, len(dirty_rows), self.block_size):
+            block_rows = dirty_rows[start:start + self.block_size]
+            block_scores = self.pairwise_scores(matrix[block_rows], matrix, squared_norms, 
+                                                squared_norms[block_rows], metric)
+            block, items = np.nonzero((block_scores >= threshold[None, :]) & is_merge[None, :])
+            entering[0].append(items)
+            entering[1].append(block_rows[block])
+            entering[2].append(block_scores[block, items])
+        
+        # merging the previous lists with the entering items
+        merge_position = np.full(n_items, -1)
+        merge_position[merge_rows] = np.arange(len(merge_rows))
+        
+        queries = np.concatenate([np.repeat(merge_rows, old_neighbours.shape[1])] + entering[0])
+        candidates = np.concatenate([old_neighbours.ravel()] + entering[1])
+        pair_scores = np.concatenate([old_scores.ravel()] + entering[2])
+        
+        order = np.lexsort(self.tie_break_keys(queries, candidates) + (-pair_scores, queries))
+        queries, candidates, pair_scores = queries[order], candidates[order], pair_scores[order]
+        rank = np.arange(len(queries)) - np.searchsorted(queries, queries, side='left')
+        keep = rank < k
+        
+        neighbours[queries[keep], rank[keep]] = candidates[keep]
+        scores[queries[keep], rank[keep]] = pair_scores[keep]
+        
+        return neighbours, scores
+    
+    def similarity_results(self, encoded_data, metric, index=None):
 
         """
         Calculate the Similarity between two 
@@ -403,81 +864,385 @@ class ArtworkContent:
         with the given distance metric.
 
         ---------- Input ---------------
-        dataFrame: Input content Dataframe
+        encoded_data: sparse matrix from one_hot_encoding, or a
+            one hot encoded dataframe of the original dataframe.
 
-        encoded_data: Dataframe, One hot encoded dataframe of 
-            the original dataframe.
+        metric : str,
+            The similarity metric to use. 
+            Similarity metrics: 'cosine', 'dice', 'jaccard'.
 
-        metric : str or function,
-            The distance metric to use. 
-            Distance metrics: 'cosine', 'dice', 'jaccard'.
+        index: artwork ids of the encoded rows, defaults to the
+            dataframe index or the fitted items
 
         ---------- Output ---------------
         results: Dictionary, A dictionary containing the Key 
-        value pair of item and Similar items
+        value pair of item and its top K similar items
 
         """
-
-        sim =  1 - pdist(encoded_data, metric)
-
-        similarity_matrix = pd.DataFrame(squareform(sim), index=encoded_data.index, columns= encoded_data.index)
-
+        
+        if isinstance(encoded_data, pd.DataFrame):
+            index = encoded_data.index if index is None else index
+            matrix = sparse.csr_matrix(encoded_data.to_numpy(dtype=np.float32))
+        else:
+            index = self.item_index if index is None else index
+            matrix = encoded_data
+        index = pd.Index(index)
+        
+        neighbours, scores = self.top_k_neighbours(matrix, metric)
+        
         results = {}
-
-        for idx, row in similarity_matrix.iterrows():
-            item_list = row.drop(labels = [idx])
-            sorted_list = item_list.sort_values(ascending = False)    
-            results[idx] = [items for items in sorted_list.iteritems()]  
+        
+        for position, idx in enumerate(index):
+            results[idx] = list(zip(index[neighbours[position]], scores[position]))
 
         return results
         
-    def sort_results(self, similarity_results):
+    def ranking_attributes(self, index):
         """
-        sorts the final results based on the given priority
+        Raw re-ranking attributes of every item, aligned to the item
+        positions of the encoded matrix
         
         ---------- Input ---------------
-        similarity_results: similarity results
+        index: artwork ids in encoded matrix order
         
         ---------- output ---------------
-        final_result: final sorted results
+        mediums: artwork medium as text, '' if missing
+        prices: artwork prices
+        years: artwork years
         
-        """ 
-
-        final_result = {}
+        """
         key = 'artwork_id'
-        sort_features = ['artwork_medium', 'artwork_price', 'artwork_year']
-
-        for i in tqdm(similarity_results.keys()):
-            df = pd.DataFrame(similarity_results[i])
-            df.rename( columns={0:'artwork_id', 1: 'score'}, inplace=True )
-
-            final=pd.merge(df, self.dataFrame, how='left', left_on=[key], right_on=[key])
-            inp = [list(self.dataFrame[self.dataFrame[key] == i][feature])[0] for feature in sort_features]
-
-            final['same_medium'] =  np.where(final['artwork_medium'] == inp[0], 1, 0)
-            final['price_sort'] =  abs(final['artwork_price'] - inp[1])
-            final['year_sort'] =  abs(final['artwork_year'] - inp[2])
-
-            priority_order = ['score', "same_medium", "year_sort", "price_sort"]
-            ascending = (False, False, True, True)
-
-            temp_df = final.sort_values(priority_order, ascending = ascending)
-            temp_df = temp_df.reset_index()
-
-            sorted_result = [[row['artwork_id'], row['score'], idx] for idx, row in temp_df.iterrows()]
-            final_result[i] = sorted_result
+        features = self.dataFrame.drop_duplicates(subset=[key]).set_index(key).reindex(index)
+        
+        mediums = features['artwork_medium'].astype(object)
+        mediums = mediums.where(mediums.notna(), '').astype(str).to_numpy()
+        prices = pd.to_numeric(features['artwork_price'], errors='coerce').to_numpy(dtype=np.float64)
+        years = pd.to_numeric(features['artwork_year'], errors='coerce').to_numpy(dtype=np.float64)
+        
+        return mediums, prices, years
+    
+    def rerank_features(self, index):
+        """
+        Precomputes the re-ranking attributes of every item once,
+        aligned to the item positions of the encoded matrix
+        
+        ---------- Input ---------------
+        index: artwork ids in encoded matrix order
+        
+        ---------- output ---------------
+        medium_codes: integer code of the artwork medium, -1 if missing
+        prices: artwork prices
+        years: artwork years
+        
+        """
+        mediums, prices, years = self.ranking_attributes(index)
+        
+        medium_codes, _ = pd.factorize(np.where(mediums == '', None, mediums))
+        
+        return medium_codes, prices, years
+        
+    def rerank_block(self, rows, neighbours, scores, medium_codes, prices, years):
+        """
+        Re-ranks the neighbours of a block of items with a single lexsort
+        
+        ---------- Input ---------------
+        rows: item positions of the block
+        neighbours: item positions [N, K] ordered by score
+        scores: similarity scores [N, K]
+        medium_codes, prices, years: re-ranking attributes, see rerank_features
+        
+        ---------- output ---------------
+        neighbours: re-ranked item positions [block rows, K]
+        scores: re-ranked similarity scores [block rows, K]
+        
+        """
+        block = neighbours[rows]
+        block_scores = scores[rows]
+        tie_break = np.broadcast_to(np.arange(block.shape[1]), block.shape)
+        
+        same_medium = (medium_codes[block] == medium_codes[rows, None]) & (medium_codes[rows, None] != -1)
+        year_sort = np.abs(years[block] - years[rows, None])
+        price_sort = np.abs(prices[block] - prices[rows, None])
+        
+        # np.lexsort sorts by the last key first, the original
+        # order (item position, see tie_break_keys) settles the remaining ties
+        order = np.lexsort((tie_break, price_sort, year_sort, -same_medium.astype(np.int8), -block_scores), axis=1)
+        
+        return np.take_along_axis(block, order, axis=1), np.take_along_axis(block_scores, order, axis=1)
+        
+    def rerank(self, index, neighbours, scores):
+        """
+        Re-ranks the neighbours of every item with the priority
+        score (desc), same_medium (desc), year_sort (asc), price_sort (asc).
+        Only the K given neighbours are reordered, they match the previous
+        full ranking when the K cut kept the ties in the same priority
+        (see select_top_k). Items are processed in blocks, sharded over n_workers processes
+        
+        ---------- Input ---------------
+        index: artwork ids in encoded matrix order
+        neighbours: item positions [N, K] ordered by score
+        scores: similarity scores [N, K]
+        
+        ---------- output ---------------
+        neighbours: re-ranked item positions [N, K]
+        scores: re-ranked similarity scores [N, K]
+        
+        """
+        medium_codes, prices, years = self.rerank_features(index)
+        
+        if self.n_workers > 1 and len(neighbours) > self.block_size:
+            shared = SharedArrays()
+            try:
+                shared_neighbours = shared.add('neighbours', neighbours)
+                shared_scores = shared.add('scores', scores)
+                shared.add('medium_codes', medium_codes)
+                shared.add('prices', prices)
+                shared.add('years', years)
+                
+                run_shards(type(self), self.block_size, self.n_workers, shared, rerank_shard, (), len(neighbours))
+                
+                return shared_neighbours.copy(), shared_scores.copy()
+            finally:
+                shared.release()
+        
+        neighbours = neighbours.copy()
+        scores = scores.copy()
+        
+        for start in range(0, len(neighbours), self.block_size):
+            rows = np.arange(start, min(start + self.block_size, len(neighbours)))
+            neighbours[rows], scores[rows] = self.rerank_block(rows, neighbours, scores, medium_codes, prices, years)
+            
+        return neighbours, scores
+        
+    def results_dict(self, index, neighbours, scores):
+        """
+        Legacy (pickled dictionary) form of the ranked results
+        
+        ---------- Input ---------------
+        index: artwork ids in encoded matrix order
+        neighbours: ranked item positions [N, K], -1 for padding
+        scores: ranked similarity scores [N, K]
+        
+        ---------- output ---------------
+        final_result: dictionary of artwork id -> [[artwork id, score, rank], ...]
+        
+        """
+        item_ids = np.asarray(index)
+        ranks = list(range(neighbours.shape[1]))
+        
+        final_result = {}
+        for position, item_id in enumerate(item_ids.tolist()):
+            # dropping the padding of the approximate search
+            valid = neighbours[position] >= 0
+            final_result[item_id] = [list(result) for result in 
+                                     zip(item_ids[neighbours[position][valid]].tolist(), scores[position][valid].tolist(), ranks)]
             
         return  final_result
     
-    def fit(self):
+    def sort_results(self, index, neighbours, scores):
         """
-        Driver function for trining the Artwork content model
+        sorts the final results based on the given priority
+        
+        ---------- Input ---------------
+        index: artwork ids in encoded matrix order
+        neighbours: item positions [N, K] ordered by score, -1 for padding
+        scores: similarity scores [N, K]
+        
+        ---------- output ---------------
+        final_result: final sorted results
         
         """ 
-        start_time = time.time()
-        print('\n------ Artwork content model training started ------')
-#         model = ArtworkContent(dataFrame)
-
+        neighbours, scores = self.rerank(index, neighbours, scores)
+        
+        return self.results_dict(index, neighbours, scores)
+    
+    def item_attributes(self, index):
+        """
+        Per item attributes shipped with the artifact for the query time
+        filters, aligned to the item positions of the encoded matrix
+        
+        ---------- Input ---------------
+        index: artwork ids in encoded matrix order
+        
+        ---------- output ---------------
+        attributes: dictionary of prices, years (float32, NaN if missing),
+            medium_codes and artist_codes (int32, -1 if missing)
+        medium_vocabulary: artwork medium of every medium code
+        artist_vocabulary: primary artist id of every artist code
+        
+        """
+        key = 'artwork_id'
+        features = self.dataFrame.drop_duplicates(subset=[key]).set_index(key).reindex(index)
+        
+        medium_codes, medium_vocabulary = pd.factorize(features['artwork_medium'].astype(object), sort=True)
+        
+        # the first artist of multi artist artworks ('12,34') is the primary artist
+        artists = features['artist_id'].astype(object)
+        artists = artists.where(artists.isna(), artists.astype(str).str.split(',').str[0].str.strip())
+        artist_codes, artist_vocabulary = pd.factorize(artists, sort=True)
+        
+        attributes = {
+            'prices': pd.to_numeric(features['artwork_price'], errors='coerce').to_numpy(dtype=np.float32),
+            'years': pd.to_numeric(features['artwork_year'], errors='coerce').to_numpy(dtype=np.float32),
+            'medium_codes': medium_codes.astype(np.int32),
+            'artist_codes': artist_codes.astype(np.int32),
+        }
+        
+        return attributes, [str(medium) for medium in medium_vocabulary], [str(artist) for artist in artist_vocabulary]
+    
+    def save_artifact(self, model_dir, score_dtype='float32', data_fingerprint=None, model_fingerprint=None):
+        """
+        Saves the ranked results in the compact memory-mappable format:
+        item id index, int32 neighbour matrix [N, K] (positions in the
+        item index, -1 for padding), score matrix [N, K], the per item
+        filter attributes, the encoded item matrix with the feature pipeline
+        of new items (cold start) and a manifest
+        
+        ---------- Input ---------------
+        model_dir: output directory
+        score_dtype: 'float32' or 'float16'
+        data_fingerprint: fingerprint of the training data, stored in the manifest
+        model_fingerprint: fingerprint of the data, hyperparameters and code, stored in the manifest
+        
+        """
+        item_ids = np.asarray(self.item_index, dtype=np.int64)
+        
+        np.save(os.path.join(model_dir, ARTIFACT_FILES['item_ids']), item_ids)
+        np.save(os.path.join(model_dir, ARTIFACT_FILES['neighbours']), self.ranked_neighbours.astype(np.int32))
+        np.save(os.path.join(model_dir, ARTIFACT_FILES['scores']), self.ranked_scores.astype(score_dtype))
+        
+        attributes, medium_vocabulary, artist_vocabulary = self.item_attributes(self.item_index)
+        for name, values in attributes.items():
+            np.save(os.path.join(model_dir, ARTIFACT_FILES[name]), values)
+        
+        matrix = sparse.csr_matrix(self.matrix)
+        np.save(os.path.join(model_dir, ARTIFACT_FILES['matrix_data']), matrix.data.astype(np.float32))
+        np.save(os.path.join(model_dir, ARTIFACT_FILES['matrix_indices']), matrix.indices)
+        np.save(os.path.join(model_dir, ARTIFACT_FILES['matrix_indptr']), matrix.indptr)
+        np.save(os.path.join(model_dir, ARTIFACT_FILES['squared_norms']), 
+                np.asarray(matrix.multiply(matrix).sum(axis=1), dtype=np.float64).ravel())
+        
+        cold_start = {
+            'encoder': self.encoder.get_state(),
+            'year_bins': self.year_bins,
+            'price_bins': self.price_bins,
+            'materials_map': self.materials_map,
+            'artist_vocabulary': artist_vocabulary,
+        }
+        with open(os.path.join(model_dir, ARTIFACT_COLD_START), 'w') as f:
+            json.dump(cold_start, f)
+        
+        manifest = {
+            'format_version': ARTIFACT_VERSION,
+            'n_items': int(len(item_ids)),
+            'top_k': int(self.ranked_neighbours.shape[1]),
+            'metric': self.metric,
+            'score_dtype': np.dtype(score_dtype).name,
+            'sorted_ids': bool(np.all(item_ids[1:] > item_ids[:-1])),
+            'medium_vocabulary': medium_vocabulary,
+            'n_features': int(matrix.shape[1]),
+            'cold_start': ARTIFACT_COLD_START,
+            'files': ARTIFACT_FILES,
+            'data_fingerprint': data_fingerprint,
+            'model_fingerprint': model_fingerprint,
+        }
+        with open(os.path.join(model_dir, ARTIFACT_MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2)
+    
+    def get_state(self):
+        """
+        State of the fitted model needed by an incremental retrain
+        
+        ---------- output ---------------
+        state: dictionary of the item ids, encoded matrix, feature
+        names, the score ordered neighbours (before re-ranking) and
+        the re-ranking attributes
+        
+        """
+        mediums, prices, years = self.ranking_attributes(self.item_index)
+        
+        return {
+            'item_ids': np.asarray(self.item_index),
+            'feature_names': self.feature_names,
+            'matrix': sparse.csr_matrix(self.matrix),
+            'neighbours': self.neighbours,
+            'scores': self.scores,
+            'top_k': -1 if self.top_k is None else self.top_k,
+            'metric': self.metric,
+            'approximate': self.approximate,
+            'rank_mediums': np.asarray(mediums, dtype=str),
+            'rank_prices': prices,
+            'rank_years': years,
+        }
+    
+    def save_state(self, path):
+        """
+        Saves the model state as a .npz file
+        
+        ---------- Input ---------------
+        path: output file path
+        
+        """
+        state = self.get_state()
+        matrix = state.pop('matrix')
+        np.savez(path, matrix_data=matrix.data, matrix_indices=matrix.indices, 
+                 matrix_indptr=matrix.indptr, matrix_shape=np.asarray(matrix.shape), **state)
+    
+    def load_state(self, path):
+        """
+        Loads a model state saved by save_state
+        
+        ---------- Input ---------------
+        path: .npz file path
+        
+        ---------- output ---------------
+        state: dictionary, see get_state
+        
+        """
+        with np.load(path, allow_pickle=False) as saved:
+            state = {key: saved[key] for key in saved.files}
+        
+        state['matrix'] = sparse.csr_matrix((state.pop('matrix_data'), state.pop('matrix_indices'), 
+                                             state.pop('matrix_indptr')), shape=tuple(state.pop('matrix_shape')))
+        state['top_k'] = None if int(state['top_k']) < 0 else int(state['top_k'])
+        state['metric'] = str(state['metric'])
+        state['approximate'] = bool(state['approximate'])
+        
+        return state
+    
+    def incremental_compatible(self, previous_state):
+        """
+        Checks if the previous state can be updated incrementally
+        
+        ---------- Input ---------------
+        previous_state: state of the previous model, see get_state
+        
+        ---------- output ---------------
+        compatible: True if an incremental retrain matches a full retrain
+        
+        """
+        reasons = []
+        if previous_state['top_k'] != self.top_k:
+            reasons.append('top_k changed')
+        if previous_state['metric'] != self.metric:
+            reasons.append('metric changed')
+        if previous_state['approximate'] or self.approximate:
+            reasons.append('approximate mode')
+        if 'rank_prices' not in previous_state:
+            reasons.append('previous state without the re-ranking attributes')
+        if not pd.Index(previous_state['item_ids']).is_unique:
+            reasons.append('duplicated artwork ids')
+        
+        if reasons:
+            print(f'Incremental training not possible ({", ".join(reasons)}), running a full training')
+        
+        return not reasons
+    
+    def encode_items(self):
+        """
+        Runs the feature pipeline and one hot encodes the items, ordered by artwork id
+        
+        """
         features = ['artwork_id', 'artist_id', 'artwork_medium', 'materials', 'artwork_year', 'artwork_price']
         data, nan_values = self.preprocessing(features)
 
@@ -494,11 +1259,51 @@ class ArtworkContent:
         catergorical_columns = list(data.columns)
         print(f'Features: {catergorical_columns}')
 
-        encoded_data = self.one_hot_encoding(data, catergorical_columns)
-        print(f'Encoded data shape: {encoded_data.shape}')
+        # ordering the items by artwork id keeps the tie break
+        # of the similarity engine stable between retrains
+        data = data.sort_index(kind='stable')
 
-        self.similarity_results = self.similarity_results(encoded_data, 'cosine')
+        self.matrix = self.one_hot_encoding(data, catergorical_columns)
+        print(f'Encoded data shape: {self.matrix.shape}, {self.matrix.nnz} non zero values')
+        
+        self.item_index = data.index
+        self.feature_names = self.encoder.feature_names
+        self.rank_features = self.rerank_features(self.item_index)
+    
+    def fit(self, previous_state=None):
+        """
+        Driver function for trining the Artwork content model
+        
+        ---------- Input ---------------
+        previous_state: state of the previous model (see load_state), 
+            when given only the catalog delta is recomputed
+        
+        """ 
+        start_time = time.time()
+        print('\n------ Artwork content model training started ------')
+#         model = ArtworkContent(dataFrame)
+
+        # the features are always refitted on the whole catalog like a full
+        # training, the previous model only saves the similarity search
+        incremental = previous_state is not None and self.incremental_compatible(previous_state)
+        self.encode_items()
+        
+        if incremental and not self.item_index.is_unique:
+            print('Incremental training not possible (duplicated artwork ids), running a full training')
+            incremental = False
+        
+        if self.approximate:
+            self.neighbours, self.scores = self.approximate_neighbours(self.matrix, self.metric)
+            self.recall = self.recall_at_k(self.matrix, self.metric, self.neighbours, self.scores)
+            print(f'Approximate recall@10: {self.recall:.4f}')
+        else:
+            neighbours = None
+            if incremental:
+                neighbours = self.incremental_neighbours(self.matrix, self.metric, previous_state)
+            if neighbours is None:
+                neighbours = self.top_k_neighbours(self.matrix, self.metric)
+            self.neighbours, self.scores = neighbours
 
-        self.result = self.sort_results(self.similarity_results)
+        self.ranked_neighbours, self.ranked_scores = self.rerank(self.item_index, self.neighbours, self.scores)
 
         print("Time taken to train Artwork content model: %s seconds" % (time.time() - start_time))
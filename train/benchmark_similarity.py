@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Benchmark of the similarity search and re-ranking stages of ArtworkContent
+on a synthetic one hot encoded catalog, for several worker counts.
+
+    python benchmark_similarity.py --items 50000 --workers 1 2 4
+"""
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from artwork_content_recsys import ArtworkContent
+
+
+def synthetic_catalog(n_items, seed=0):
+    """
+    Synthetic raw catalog and its one hot encoded matrix
+
+    ---------- Input ---------------
+    n_items: number of artworks
+    seed: random seed
+
+    ---------- output ---------------
+    dataFrame: raw artwork dataframe
+    matrix: sparse CSR matrix [items, features]
+
+    """
+    rng = np.random.default_rng(seed)
+    dataFrame = pd.DataFrame({
+        'artwork_id': np.arange(n_items),
+        'artwork_medium': rng.choice(['painting', 'photography', 'sculpture', 'drawing', 'print'], n_items),
+        'artwork_price': rng.lognormal(8, 1, n_items).round(),
+        'artwork_year': rng.integers(1950, 2023, n_items),
+        'artist_id': rng.integers(0, n_items // 20 + 1, n_items),
+        'materials': rng.integers(0, 300, n_items),
+    })
+
+    features = pd.DataFrame({
+        'artwork_medium': dataFrame['artwork_medium'],
+        'materials': dataFrame['materials'],
+        'artwork_year': dataFrame['artwork_year'] // 10,
+        'artwork_price': pd.qcut(dataFrame['artwork_price'], 20, labels=False),
+        'artist_id': dataFrame['artist_id'],
+    })
+
+    columns, offset = [], 0
+    for feature in features:
+        codes, uniques = pd.factorize(features[feature])
+        columns.append(codes + offset)
+        offset += len(uniques)
+
+    indices = np.stack(columns, axis=1).ravel()
+    indptr = np.arange(0, len(indices) + 1, len(columns))
+    matrix = sparse.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(n_items, offset))
+
+    return dataFrame, matrix
+
+
+def benchmark(n_items, workers, top_k, block_size, metric):
+    """
+    Times the similarity search and the re-ranking for every worker count
+
+    """
+    dataFrame, matrix = synthetic_catalog(n_items)
+    print(f'Catalog: {matrix.shape[0]} items, {matrix.shape[1]} features, top_k={top_k}, block_size={block_size}')
+    print(f'{"workers":>8} {"similarity (s)":>15} {"rerank (s)":>11} {"total (s)":>10} {"speedup":>8}')
+
+    baseline = None
+    reference = None
+    for n_workers in workers:
+        model = ArtworkContent(dataFrame.copy(), top_k=top_k, block_size=block_size, n_workers=n_workers)
+
+        start = time.time()
+        neighbours, scores = model.top_k_neighbours(matrix, metric)
+        similarity_time = time.time() - start
+
+        start = time.time()
+        neighbours, scores = model.rerank(dataFrame['artwork_id'], neighbours, scores)
+        rerank_time = time.time() - start
+
+        total = similarity_time + rerank_time
+        baseline = baseline or total
+        if reference is None:
+            reference = neighbours
+        elif not np.array_equal(reference, neighbours):
+            print(f'WARNING: results with {n_workers} workers differ from the first run')
+
+        print(f'{n_workers:>8} {similarity_time:>15.2f} {rerank_time:>11.2f} {total:>10.2f} {baseline / total:>7.2f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=50000)
+    parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, 2, os.cpu_count() or 1}))
+    parser.add_argument('--top_k', type=int, default=100)
+    parser.add_argument('--block_size', type=int, default=1024)
+    parser.add_argument('--metric', type=str, default='cosine')
+    args = parser.parse_args()
+
+    benchmark(args.items, args.workers, args.top_k, args.block_size, args.metric)
@@ -0,0 +1,172 @@
+# +
+# Importing required packages
+import os
+import csv
+import json
+import hashlib
+
+from ingestion import FIT_DTYPES, PARQUET_EXTENSIONS, list_input_files, read_csv_chunks, read_parquet_chunks
+
+
+# -
+
+# The fingerprint is also computed by the pipeline trigger Lambda on the uploaded
+# files (pipeline_trigger_lambda_function.py), both implementations must stay identical
+FINGERPRINT_VERSION = 'v1'
+
+# fit columns in the order they are hashed
+FINGERPRINT_COLUMNS = list(FIT_DTYPES)
+NUMERIC_COLUMNS = ('artwork_id', 'artwork_year', 'artwork_price')
+
+# values read as missing by pandas
+NA_VALUES = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+             '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'}
+
+HASH_MODULUS = 2 ** 128
+
+# hyperparameters that do not change the trained model, left out of the model fingerprint
+RUNTIME_HYPERPARAMETERS = ('chunk_size', 'n_workers', 'skip_unchanged')
+
+
+def normalize_value(column, value):
+    """
+    Normalized text of a raw value, identical for the CSV text and the typed Parquet value
+
+    ---------- Input ---------------
+    column: lower case fit column
+    value: raw value (text, number or None)
+
+    ---------- output ---------------
+    value: normalized text, '' for missing values
+
+    """
+    value = '' if value is None else str(value).strip()
+    if value in NA_VALUES:
+        return ''
+    if column not in NUMERIC_COLUMNS:
+        return value
+
+    try:
+        number = float(value)
+    except ValueError:
+        return value
+    if number != number:
+        return ''
+    if column == 'artwork_id' and number.is_integer():
+        return str(int(number))
+    return repr(number)
+
+
+class DataFingerprint:
+    """
+    Order independent content hash of the normalized fit columns: the sum of
+    the row hashes, so the same rows in any order, file split or column
+    order give the same fingerprint
+    """
+
+    def __init__(self):
+        self.n_rows = 0
+        self.total = 0
+
+    def add_row(self, values):
+        """
+        ---------- Input ---------------
+        values: dictionary of lower case fit column -> raw value, rows without an artwork id are skipped
+
+        """
+        row = [normalize_value(column, values.get(column)) for column in FINGERPRINT_COLUMNS]
+        if not row[0]:
+            return
+        digest = hashlib.blake2b('\x1f'.join(row).encode('utf-8'), digest_size=16).digest()
+        self.total = (self.total + int.from_bytes(digest, 'big')) % HASH_MODULUS
+        self.n_rows += 1
+
+    def add_csv(self, lines):
+        """
+        ---------- Input ---------------
+        lines: iterable of the text lines of a CSV file, header included
+
+        """
+        reader = csv.reader(lines)
+        header = next(reader, None)
+        if header is None:
+            return
+        header = [name.lstrip('\ufeff').strip().lower() for name in header]
+        columns = [(position, name) for position, name in enumerate(header) if name in FIT_DTYPES]
+        for record in reader:
+            if record:
+                self.add_row({name: record[position] for position, name in columns if position < len(record)})
+
+    def add_frame(self, frame):
+        """
+        ---------- Input ---------------
+        frame: dataframe of the fit columns (any case) as read by the ingestion readers, the
+        typed values normalize to the same text as the CSV values they were parsed from
+
+        """
+        columns = {column.lower(): column for column in frame.columns}
+        values = [frame[columns[name]].tolist() if name in columns else [None] * len(frame)
+                  for name in FINGERPRINT_COLUMNS]
+        for row in zip(*values):
+            self.add_row(dict(zip(FINGERPRINT_COLUMNS, row)))
+
+    def hexdigest(self):
+        return f'{FINGERPRINT_VERSION}-{self.n_rows}-{self.total:032x}'
+
+
+def training_data_fingerprint(path, chunk_size=100000):
+    """
+    Fingerprint of the fit columns of every CSV/Parquet file of the training channel, without
+    keeping the data. The training computes it while reading the data instead, see
+    ingestion.read_training_data
+
+    ---------- Input ---------------
+    path: training channel directory
+    chunk_size: number of rows read at a time
+
+    ---------- output ---------------
+    fingerprint: '<version>-<number of rows>-<hash>' string
+
+    """
+    fingerprint = DataFingerprint()
+    for file in list_input_files(path):
+        reader = read_parquet_chunks if file.lower().endswith(PARQUET_EXTENSIONS) else read_csv_chunks
+        for chunk in reader(file, chunk_size):
+            fingerprint.add_frame(chunk)
+
+    return fingerprint.hexdigest()
+
+
+def code_fingerprint(directory):
+    """
+    Hash of the training code: the python modules and the train script of the directory
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and (name.endswith('.py') or name == 'train'):
+            with open(path, 'rb') as f:
+                digest.update(name.encode('utf-8') + b'\x1f' + hashlib.blake2b(f.read(), digest_size=16).digest())
+    return digest.hexdigest()
+
+
+def model_fingerprint(data_fingerprint, hyperparameters, artifact_version, code_directory):
+    """
+    Fingerprint of a trained model, equal fingerprints train the same model
+
+    ---------- Input ---------------
+    data_fingerprint: fingerprint of the training data, see training_data_fingerprint
+    hyperparameters: hyperparameters of the training job, the runtime only ones are ignored
+    artifact_version: format version of the saved artifact
+    code_directory: directory of the training code
+
+    ---------- output ---------------
+    fingerprint: '<version>-<hash>' string
+
+    """
+    parameters = {name: value if isinstance(value, str) else json.dumps(value, sort_keys=True)
+                  for name, value in hyperparameters.items()
+                  if name not in RUNTIME_HYPERPARAMETERS and not name.startswith('sagemaker_')}
+    content = json.dumps({'data': data_fingerprint, 'hyperparameters': parameters,
+                          'artifact_version': artifact_version, 'code': code_fingerprint(code_directory)}, sort_keys=True)
+    return f'{FINGERPRINT_VERSION}-{hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()}'
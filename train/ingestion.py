@@ -0,0 +1,202 @@
+# +
+# Importing required packages
+import os
+import numpy as np
+import pandas as pd
+
+
+# -
+
+# raw columns read by ArtworkContent.fit (lower case) and their dtypes,
+# the string columns are read as categories to keep the memory low
+FIT_DTYPES = {
+    'artwork_id': 'Int64',
+    'artist_id': 'category',
+    'artwork_medium': 'category',
+    'materials': 'category',
+    'artwork_year': 'float64',
+    'artwork_price': 'float64',
+}
+
+CSV_EXTENSIONS = ('.csv', '.csv.gz', '.csv.bz2', '.csv.zip')
+PARQUET_EXTENSIONS = ('.parquet', '.parq', '.pq')
+
+
+def list_input_files(path):
+    """
+    Lists every CSV or Parquet file under the channel directory (partitions included)
+
+    ---------- Input ---------------
+    path: channel directory
+
+    ---------- output ---------------
+    files: sorted list of file paths
+
+    """
+    files = []
+    for root, _, names in os.walk(path):
+        for name in names:
+            if name.lower().endswith(CSV_EXTENSIONS + PARQUET_EXTENSIONS) and not name.startswith('.'):
+                files.append(os.path.join(root, name))
+
+    return sorted(files)
+
+
+def column_dtypes(columns):
+    """
+    Maps the raw column names of a file (any case) to the dtypes of the fit columns
+
+    ---------- Input ---------------
+    columns: raw column names of the file
+
+    ---------- output ---------------
+    dtypes: dictionary of raw column name -> dtype, only the fit columns
+
+    """
+    return {column: FIT_DTYPES[column.lower()] for column in columns if column.lower() in FIT_DTYPES}
+
+
+def read_csv_chunks(path, chunk_size):
+    """
+    Reads the fit columns of a CSV file chunk by chunk with explicit dtypes
+
+    ---------- Input ---------------
+    path: CSV file path
+    chunk_size: number of rows per chunk
+
+    ---------- output ---------------
+    chunks: generator of dataframes
+
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    dtypes = column_dtypes(header)
+
+    yield from pd.read_csv(path, usecols=list(dtypes), dtype=dtypes, chunksize=chunk_size)
+
+
+def read_parquet_chunks(path, chunk_size):
+    """
+    Reads the fit columns of a Parquet file batch by batch with explicit dtypes
+
+    ---------- Input ---------------
+    path: Parquet file path
+    chunk_size: number of rows per batch
+
+    ---------- output ---------------
+    chunks: generator of dataframes
+
+    """
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(path)
+    dtypes = column_dtypes(parquet_file.schema_arrow.names)
+
+    for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=list(dtypes)):
+        yield batch.to_pandas().astype(dtypes)
+
+
+class ChunkColumns:
+    """
+        Fit columns of the chunks appended one after the other. A chunk is
+        reduced to compact arrays as soon as it is read: the categorical
+        values become int32 codes of a vocabulary shared by all the files,
+        the numbers stay in their dtype. So the raw chunks are not all kept,
+        and the peak memory is about twice the final dataframe. A file
+        without one of the fit columns gets missing values for it
+
+    """
+
+    def __init__(self, dtypes):
+        """
+        ---------- Input ---------------
+        dtypes: dictionary of column name -> dtype
+
+        """
+        self.dtypes = dtypes
+        self.vocabularies = {column: {} for column, dtype in dtypes.items() if dtype == 'category'}
+        self.parts = {column: [] for column in dtypes}
+
+    def append(self, chunk):
+        """
+        ---------- Input ---------------
+        chunk: dataframe with some or all of the columns, the other columns are ignored
+
+        """
+        for column, dtype in self.dtypes.items():
+            if column in self.vocabularies:
+                if column in chunk.columns:
+                    values = chunk[column].astype('category').array
+                    vocabulary = self.vocabularies[column]
+                    # chunk category codes -> codes of the shared vocabulary, -1 stays missing
+                    mapping = np.array([vocabulary.setdefault(value, len(vocabulary)) for value in values.categories]
+                                       + [-1], dtype=np.int32)
+                    codes = mapping[values.codes]
+                else:
+                    codes = np.full(len(chunk), -1, dtype=np.int32)
+                self.parts[column].append(codes)
+            elif column in chunk.columns:
+                self.parts[column].append(chunk[column].astype(dtype).array)
+            else:
+                self.parts[column].append(pd.array([None] * len(chunk), dtype=dtype))
+
+    def frame(self):
+        """
+        ---------- output ---------------
+        data: dataframe of all the appended rows, the parts are released
+
+        """
+        columns = {}
+        for column, parts in self.parts.items():
+            if column in self.vocabularies:
+                codes = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int32)
+                columns[column] = pd.Categorical.from_codes(codes, categories=list(self.vocabularies[column]))
+            else:
+                columns[column] = pd.concat([pd.Series(part, copy=False) for part in parts], ignore_index=True) \
+                    if parts else pd.Series([], dtype=self.dtypes[column])
+            parts.clear()
+
+        return pd.DataFrame(columns)
+
+
+def read_training_data(path, chunk_size=100000, fingerprint=None):
+    """
+    Reads every CSV/Parquet file of the training channel, only the
+    columns used by ArtworkContent.fit and with explicit dtypes
+
+    ---------- Input ---------------
+    path: training channel directory
+    chunk_size: number of rows read at a time
+    fingerprint: optional fingerprint.DataFingerprint, fed with the raw chunks in the same pass
+
+    ---------- output ---------------
+    data: raw artwork dataframe
+
+    """
+    files = list_input_files(path)
+    if not files:
+        raise ValueError(f'No CSV or Parquet file found in {path}')
+
+    # files may spell the columns in any case, the model uses the upper case names
+    chunks = ChunkColumns({column.upper(): dtype for column, dtype in FIT_DTYPES.items()})
+    for file in files:
+        reader = read_parquet_chunks if file.lower().endswith(PARQUET_EXTENSIONS) else read_csv_chunks
+        file_rows = 0
+        for chunk in reader(file, chunk_size):
+            chunk.columns = [column.upper() for column in chunk.columns]
+            if fingerprint is not None:
+                fingerprint.add_frame(chunk)
+            chunks.append(chunk)
+            file_rows += len(chunk)
+        print(f'Read {file_rows} rows from {file}')
+
+    data = chunks.frame()
+
+    # artworks without an id can not be recommended
+    data = data[data['ARTWORK_ID'].notna()]
+    data['ARTWORK_ID'] = data['ARTWORK_ID'].astype('int64')
+    data = data.reset_index(drop=True)
+
+    print(f'Training data: {data.shape[0]} rows, {len(files)} files, '
+          f'{data.memory_usage(deep=True).sum() / 2 ** 20:.1f} MiB')
+
+    return data
@@ -0,0 +1,229 @@
+# +
+# Importing required packages
+import numpy as np
+from scipy import sparse
+
+
+# -
+
+class LSHIndex:
+    """
+        Locality sensitive hashing candidate index over the one hot encoded
+        artwork features, using MinHash or random projection (sign) banding.
+        
+        MinHash approximates the jaccard/dice similarity of the active features.
+        Every encoded artwork has about the same number of active features
+        (one per categorical column), so cosine is a monotonic function of
+        the jaccard similarity and MinHash candidates serve it as well.
+        Random projection hashing is kept for weighted encodings
+
+    """
+
+    # Mersenne prime used by the universal hash functions of MinHash
+    prime = (1 << 31) - 1
+
+    def __init__(self, hashing='minhash', n_bands=32, band_size=3, max_bucket_size=200, max_candidates=256, seed=42):
+        """
+        initializing the index parameters
+
+        ---------- Input ---------------
+        hashing: 'minhash' or 'projection'
+        n_bands: number of hash tables (bands), more bands gives a higher recall
+        band_size: number of hashes per band, larger bands give fewer candidates
+        max_bucket_size: buckets larger than this are split, bounding the candidates per item and band
+        max_candidates: candidates kept per item (the ones colliding in the most bands), 0 for all
+        seed: random seed for the hash functions
+
+        """
+        self.hashing = hashing
+        self.n_bands = n_bands
+        self.band_size = band_size
+        self.max_bucket_size = max_bucket_size
+        self.max_candidates = max_candidates
+        self.seed = seed
+
+    def minhash_signatures(self, matrix, hashes=slice(None), chunk_size=10000):
+        """
+        MinHash signatures of the set of active features of every item
+
+        ---------- Input ---------------
+        matrix: sparse CSR matrix [items, features]
+        hashes: slice of the n_bands * band_size hash functions to compute
+        chunk_size: number of items hashed together
+
+        ---------- output ---------------
+        signatures: int64 array [items, hashes]
+
+        """
+        n_hashes = self.n_bands * self.band_size
+        rng = np.random.default_rng(self.seed)
+        a = rng.integers(1, self.prime, n_hashes, dtype=np.int64)[hashes]
+        b = rng.integers(0, self.prime, n_hashes, dtype=np.int64)[hashes]
+
+        signatures = np.full((matrix.shape[0], len(a)), self.prime, dtype=np.int64)
+
+        for start in range(0, matrix.shape[0], chunk_size):
+            chunk = matrix[start:start + chunk_size]
+            non_empty = np.diff(chunk.indptr) > 0
+            if not non_empty.any():
+                continue
+
+            hashed = (chunk.indices[:, None].astype(np.int64) * a + b) % self.prime
+            minimum = np.minimum.reduceat(hashed, chunk.indptr[:-1][non_empty], axis=0)
+            signatures[start + np.flatnonzero(non_empty)] = minimum
+
+        return signatures
+
+    def projection_signatures(self, matrix, hashes=slice(None), chunk_size=10000):
+        """
+        Random projection signatures (signs of the projections) of every item
+
+        ---------- Input ---------------
+        matrix: sparse CSR matrix [items, features]
+        hashes: slice of the n_bands * band_size hash functions to compute
+        chunk_size: number of items projected together
+
+        ---------- output ---------------
+        signatures: bool array [items, hashes]
+
+        """
+        n_hashes = self.n_bands * self.band_size
+        rng = np.random.default_rng(self.seed)
+        planes = rng.standard_normal((matrix.shape[1], n_hashes))[:, hashes]
+
+        signatures = np.empty((matrix.shape[0], planes.shape[1]), dtype=bool)
+
+        for start in range(0, matrix.shape[0], chunk_size):
+            signatures[start:start + chunk_size] = (matrix[start:start + chunk_size] @ planes) > 0
+
+        return signatures
+
+    def signatures(self, matrix, hashes=slice(None)):
+        """
+        Hash signatures of every item for the configured hashing
+
+        ---------- Input ---------------
+        matrix: sparse matrix [items, features]
+        hashes: slice of the n_bands * band_size hash functions to compute
+
+        ---------- output ---------------
+        signatures: array [items, hashes]
+
+        """
+        matrix = sparse.csr_matrix(matrix)
+
+        if self.hashing == 'minhash':
+            return self.minhash_signatures(matrix, hashes)
+        elif self.hashing == 'projection':
+            return self.projection_signatures(matrix, hashes)
+        else:
+            raise ValueError(f"Unsupported LSH hashing: {self.hashing}")
+
+    def band_chunks(self, matrix):
+        """
+        Bucket chunks of every band: the items sorted by bucket, buckets
+        larger than max_bucket_size split in consecutive chunks. The
+        signatures are hashed one band at a time, only the int32 chunk
+        tables are kept
+
+        ---------- Input ---------------
+        matrix: sparse matrix [items, features]
+
+        ---------- output ---------------
+        bands: list of (order, chunk_of_item, chunk_starts), the members of chunk c
+            are order[chunk_starts[c]:chunk_starts[c + 1]]
+
+        """
+        matrix = sparse.csr_matrix(matrix)
+        n_items = matrix.shape[0]
+
+        # random multipliers folding the hashes of a band into a single bucket key
+        rng = np.random.default_rng(self.seed + 1)
+        multipliers = rng.integers(1, np.iinfo(np.int64).max, self.band_size, dtype=np.int64).astype(np.uint64)
+
+        bands = []
+        for band in range(self.n_bands):
+            band_signature = self.signatures(matrix, slice(band * self.band_size, (band + 1) * self.band_size))
+            bucket_ids = (band_signature.astype(np.uint64) * multipliers).sum(axis=1, dtype=np.uint64)
+
+            order = np.argsort(bucket_ids, kind='stable')
+            sorted_ids = bucket_ids[order]
+
+            # position of every item inside its bucket, used to split the large buckets
+            new_bucket = np.r_[True, sorted_ids[1:] != sorted_ids[:-1]]
+            bucket_starts = np.flatnonzero(new_bucket)
+            rank = np.arange(n_items) - np.repeat(bucket_starts, np.diff(np.r_[bucket_starts, n_items]))
+            new_chunk = new_bucket | (rank % self.max_bucket_size == 0)
+
+            chunk_of_item = np.empty(n_items, dtype=np.int32)
+            chunk_of_item[order] = np.cumsum(new_chunk) - 1
+            chunk_starts = np.r_[np.flatnonzero(new_chunk), n_items].astype(np.int32)
+            bands.append((order.astype(np.int32), chunk_of_item, chunk_starts))
+
+        return bands
+
+    def candidate_blocks(self, matrix, block_size=1024):
+        """
+        Unique (query, candidate) pairs of items colliding in at least one
+        band, generated for one block of query items at a time so the memory
+        is bounded by block_size * n_bands * max_bucket_size. Every query
+        keeps at most max_candidates candidates, the ones colliding in the
+        most bands (ties by position)
+
+        ---------- Input ---------------
+        matrix: sparse matrix [items, features]
+        block_size: number of query items per block
+
+        ---------- output ---------------
+        blocks: generator of (queries, candidates) item position arrays, sorted by query
+
+        """
+        n_items = matrix.shape[0]
+        bands = self.band_chunks(matrix)
+
+        for start in range(0, n_items, block_size):
+            block = np.arange(start, min(start + block_size, n_items))
+
+            pair_keys = []
+            for order, chunk_of_item, chunk_starts in bands:
+                chunks = chunk_of_item[block]
+                firsts = chunk_starts[chunks].astype(np.int64)
+                sizes = chunk_starts[chunks + 1] - firsts
+
+                # every query is paired with every member of its chunk
+                queries = np.repeat(np.arange(len(block), dtype=np.int64), sizes)
+                offsets = np.arange(len(queries)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+                pair_keys.append(queries * n_items + order[np.repeat(firsts, sizes) + offsets])
+
+            pair_keys, collisions = np.unique(np.concatenate(pair_keys), return_counts=True)
+            queries, candidates = pair_keys // n_items + start, pair_keys % n_items
+            not_self = queries != candidates
+            queries, candidates, collisions = queries[not_self], candidates[not_self], collisions[not_self]
+
+            if self.max_candidates:
+                order = np.lexsort((candidates, -collisions, queries))
+                queries, candidates = queries[order], candidates[order]
+                rank = np.arange(len(queries)) - np.searchsorted(queries, queries, side='left')
+                keep = rank < self.max_candidates
+                queries, candidates = queries[keep], candidates[keep]
+
+            yield queries, candidates
+
+    def candidate_pairs(self, matrix, block_size=1024):
+        """
+        Unique (query, candidate) pairs of items colliding in at least one band
+
+        ---------- Input ---------------
+        matrix: sparse matrix [items, features]
+        block_size: number of query items per block
+
+        ---------- output ---------------
+        queries: item positions
+        candidates: candidate item positions of the query items
+
+        """
+        blocks = list(self.candidate_blocks(matrix, block_size))
+        if not blocks:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        return np.concatenate([queries for queries, _ in blocks]), np.concatenate([candidates for _, candidates in blocks])
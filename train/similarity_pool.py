@@ -0,0 +1,197 @@
+# +
+# Importing required packages
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+
+# -
+
+# state of a pool worker process, set once by init_worker
+worker_state = {}
+
+
+class SharedArrays:
+    """
+        Numpy arrays held in shared memory blocks. The parent copies the
+        inputs once, the pool workers attach to the blocks by name so
+        nothing is pickled per task, and write their results in place
+
+    """
+
+    def __init__(self):
+        """
+        initializing the shared blocks
+
+        """
+        self.blocks = {}
+        self.spec = {}
+
+    def add(self, name, array):
+        """
+        copies an array into a new shared memory block
+
+        ---------- Input ---------------
+        name: array name
+        array: numpy array
+
+        ---------- output ---------------
+        shared: view of the shared copy
+
+        """
+        array = np.ascontiguousarray(array)
+        shared = self.empty(name, array.shape, array.dtype)
+        shared[...] = array
+        return shared
+
+    def empty(self, name, shape, dtype):
+        """
+        allocates an uninitialised array in a new shared memory block
+
+        ---------- Input ---------------
+        name: array name
+        shape: array shape
+        dtype: array dtype
+
+        ---------- output ---------------
+        shared: view of the shared array
+
+        """
+        dtype = np.dtype(dtype)
+        block = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+        self.blocks[name] = block
+        self.spec[name] = (block.name, tuple(shape), dtype.str)
+        return np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    def release(self):
+        """
+        frees the shared memory blocks, the arrays must not be used afterwards
+
+        """
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = {}
+
+
+def attach(spec):
+    """
+    Attaches to the shared arrays of a SharedArrays spec
+
+    ---------- Input ---------------
+    spec: SharedArrays.spec
+
+    ---------- output ---------------
+    arrays: dictionary of array views
+    blocks: shared memory handles, kept alive with the views
+
+    """
+    arrays, blocks = {}, []
+    for name, (block_name, shape, dtype) in spec.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    return arrays, blocks
+
+
+def init_worker(engine_class, block_size, spec, matrix_shape):
+    """
+    Pool initializer, attaches the shared arrays once per worker process
+
+    ---------- Input ---------------
+    engine_class: ArtworkContent class providing top_k_block / rerank_block
+    block_size: number of query rows scored together
+    spec: SharedArrays.spec
+    matrix_shape: shape of the shared encoded matrix, None if not shared
+
+    """
+    arrays, blocks = attach(spec)
+    worker_state['engine'] = engine_class(pd.DataFrame(), block_size=block_size)
+    if 'medium_codes' in arrays:
+        # tie break of the similarity search, see ArtworkContent.tie_break_keys
+        worker_state['engine'].rank_features = (arrays['medium_codes'], arrays['prices'], arrays['years'])
+    worker_state['arrays'] = arrays
+    worker_state['blocks'] = blocks
+
+    if matrix_shape is not None:
+        worker_state['matrix'] = sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                                                   shape=matrix_shape, copy=False)
+
+
+def top_k_shard(start, stop, k, metric):
+    """
+    Top-K neighbours of the query rows [start, stop), written in the shared output arrays
+
+    """
+    engine, arrays, matrix = worker_state['engine'], worker_state['arrays'], worker_state['matrix']
+
+    for block_start in range(start, stop, engine.block_size):
+        block_stop = min(block_start + engine.block_size, stop)
+        block_rows = arrays['rows'][block_start:block_stop]
+
+        neighbours, scores = engine.top_k_block(matrix, arrays['squared_norms'], block_rows, k, metric)
+        arrays['neighbours'][block_start:block_stop] = neighbours
+        arrays['scores'][block_start:block_stop] = scores
+
+    return stop - start
+
+
+def rerank_shard(start, stop):
+    """
+    Re-ranks the neighbour rows [start, stop) of the shared arrays in place
+
+    """
+    engine, arrays = worker_state['engine'], worker_state['arrays']
+
+    for block_start in range(start, stop, engine.block_size):
+        rows = np.arange(block_start, min(block_start + engine.block_size, stop))
+        neighbours, scores = engine.rerank_block(rows, arrays['neighbours'], arrays['scores'], arrays['medium_codes'],
+                                                 arrays['prices'], arrays['years'])
+        arrays['neighbours'][rows] = neighbours
+        arrays['scores'][rows] = scores
+
+    return stop - start
+
+
+def shards(n_rows, n_workers, block_size):
+    """
+    Splits the rows in contiguous ranges, a few per worker for load balancing
+
+    ---------- Input ---------------
+    n_rows: number of rows
+    n_workers: number of worker processes
+    block_size: the ranges are multiples of the block size
+
+    ---------- output ---------------
+    ranges: list of (start, stop) row ranges
+
+    """
+    n_shards = max(1, min(n_workers * 4, -(-n_rows // block_size)))
+    shard_size = -(-n_rows // n_shards)
+    shard_size = -(-shard_size // block_size) * block_size
+
+    return [(start, min(start + shard_size, n_rows)) for start in range(0, n_rows, shard_size)]
+
+
+def run_shards(engine_class, block_size, n_workers, shared, task, args, n_rows, matrix_shape=None):
+    """
+    Runs a shard task over all the rows with a process pool
+
+    ---------- Input ---------------
+    engine_class: ArtworkContent class
+    block_size: number of rows processed together
+    n_workers: number of worker processes
+    shared: SharedArrays with the task inputs and outputs
+    task: top_k_shard or rerank_shard
+    args: extra task arguments
+    n_rows: number of rows to process
+    matrix_shape: shape of the shared encoded matrix, if any
+
+    """
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker,
+                             initargs=(engine_class, block_size, shared.spec, matrix_shape)) as pool:
+        futures = [pool.submit(task, start, stop, *args) for start, stop in shards(n_rows, n_workers, block_size)]
+        for future in futures:
+            future.result()
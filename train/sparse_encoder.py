@@ -0,0 +1,189 @@
+# +
+# Importing required packages
+import re
+import json
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+# -
+
+class SparseOneHotEncoder:
+    """
+        One hot encoder emitting a scipy CSR matrix straight from the
+        categorical codes of every column, without a dense dummies frame.
+        The fitted vocabulary is kept so new items can be encoded later,
+        and every feature group can be given its own weight
+
+    """
+
+    def __init__(self, feature_weights=None):
+        """
+        initializing the encoder
+
+        ---------- Input ---------------
+        feature_weights: dictionary of feature group -> weight, groups default to 1.0.
+            The artist split columns (artist1, artist2, ...) belong to the 'artist_id' group
+
+        """
+        self.feature_weights = feature_weights or {}
+        self.columns = []
+        self.vocabularies = {}
+
+    def feature_group(self, column):
+        """
+        feature group of a column
+
+        ---------- Input ---------------
+        column: column name
+
+        ---------- output ---------------
+        group: feature group name
+
+        """
+        return re.sub(r'^artist\d+$', 'artist_id', column)
+
+    def column_weight(self, column):
+        """
+        weight of a column, the column name takes precedence over its group
+
+        ---------- Input ---------------
+        column: column name
+
+        ---------- output ---------------
+        weight: float
+
+        """
+        return float(self.feature_weights.get(column, self.feature_weights.get(self.feature_group(column), 1.0)))
+
+    def category_values(self, values):
+        """
+        categorical values as strings, missing values stay missing
+
+        ---------- Input ---------------
+        values: pandas series
+
+        ---------- output ---------------
+        values: object series of strings and NaN
+
+        """
+        values = values.astype(object)
+        return values.where(values.isna(), values.astype(str))
+
+    def fit(self, data, catergorical_columns):
+        """
+        Fits the vocabulary of every categorical column
+
+        ---------- Input ---------------
+        data: dataframe
+        catergorical_columns: columns to be encoded
+
+        ---------- output ---------------
+        self: fitted encoder
+
+        """
+        self.columns = list(catergorical_columns)
+        self.vocabularies = {}
+        for column in self.columns:
+            values = self.category_values(data[column]).dropna()
+            self.vocabularies[column] = sorted(values.unique())
+
+        return self
+
+    @property
+    def feature_names(self):
+        """
+        names of the encoded features, '<column>_<value>' like pd.get_dummies
+
+        """
+        return np.array([f'{column}_{value}' for column in self.columns for value in self.vocabularies[column]], dtype=str)
+
+    def transform(self, data):
+        """
+        Encodes the categorical columns, unseen and missing values have no active feature
+
+        ---------- Input ---------------
+        data: dataframe
+
+        ---------- output ---------------
+        matrix: sparse CSR matrix [rows, features]
+
+        """
+        n_rows = len(data)
+        rows, cols, values = [], [], []
+
+        offset = 0
+        for column in self.columns:
+            vocabulary = self.vocabularies[column]
+            # -1 for the missing and the unseen values
+            codes = pd.Index(vocabulary, dtype=object).get_indexer(self.category_values(data[column]))
+            present = codes >= 0
+
+            rows.append(np.flatnonzero(present))
+            cols.append(codes[present].astype(np.int64) + offset)
+            values.append(np.full(present.sum(), self.column_weight(column), dtype=np.float32))
+            offset += len(vocabulary)
+
+        rows, cols, values = np.concatenate(rows), np.concatenate(cols), np.concatenate(values)
+
+        return sparse.csr_matrix((values, (rows, cols)), shape=(n_rows, offset))
+
+    def fit_transform(self, data, catergorical_columns):
+        """
+        Fits the vocabulary and encodes the categorical columns
+
+        ---------- Input ---------------
+        data: dataframe
+        catergorical_columns: columns to be encoded
+
+        ---------- output ---------------
+        matrix: sparse CSR matrix [rows, features]
+
+        """
+        return self.fit(data, catergorical_columns).transform(data)
+
+    def get_state(self):
+        """
+        JSON serializable state of the fitted encoder
+
+        ---------- output ---------------
+        state: dictionary of the columns, vocabularies and weights
+
+        """
+        return {
+            'columns': self.columns,
+            'vocabularies': self.vocabularies,
+            'feature_weights': {column: self.column_weight(column) for column in self.columns},
+        }
+
+    def save(self, path):
+        """
+        Saves the encoder state as JSON
+
+        ---------- Input ---------------
+        path: output file path
+
+        """
+        with open(path, 'w') as f:
+            json.dump(self.get_state(), f)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads an encoder saved by save
+
+        ---------- Input ---------------
+        path: JSON file path
+
+        ---------- output ---------------
+        encoder: fitted encoder
+
+        """
+        with open(path, 'r') as f:
+            state = json.load(f)
+
+        encoder = cls(state['feature_weights'])
+        encoder.columns = state['columns']
+        encoder.vocabularies = state['vocabularies']
+        return encoder
@@ -0,0 +1,131 @@
+# +
+# Importing required packages
+import re
+import nltk
+import string
+from collections import OrderedDict
+
+from nltk.corpus import wordnet, stopwords
+
+
+# -
+
+class TextNormalizer:
+    """
+        Cleans and lemmatizes free text (artwork materials) at the vocabulary
+        level. Every distinct text is cleaned once, the unseen tokens are POS
+        tagged in a single batch and the token -> lemma mapping is kept in a
+        bounded LRU cache, so the cost scales with the vocabulary size rather
+        than with rows x tokens
+
+    """
+
+    def __init__(self, cache_size=100000):
+        """
+        loading the stopwords and the lemmatizer once, the nltk
+        data has to be downloaded before
+
+        ---------- Input ---------------
+        cache_size: maximum number of token -> lemma entries kept in the cache
+
+        """
+        # first letter of the Penn Treebank tag -> WordNet POS
+        self.tag_dict = {"J": wordnet.ADJ,
+                         "N": wordnet.NOUN,
+                         "V": wordnet.VERB,
+                         "R": wordnet.ADV}
+        
+        self.stopwords = set(stopwords.words('english'))
+        self.punctuation = str.maketrans('', '', string.punctuation)
+        self.lemmatizer = nltk.WordNetLemmatizer()
+        self.cache_size = cache_size
+        self.lemma_cache = OrderedDict()
+
+    def clean_text(self, txt):
+        """
+        cleans the given text
+
+        ---------- Input ---------------
+        txt: text to be cleaned
+
+        ---------- output ---------------
+        txt: list of cleaned tokens
+
+        """
+        txt = txt.lower().translate(self.punctuation)
+        tokens = re.split(r'\W+', txt)
+        return [word for word in tokens if word not in self.stopwords]
+
+    def cache_lemmas(self, tokens):
+        """
+        POS tags the tokens missing from the cache in one batch and caches their lemmas
+
+        ---------- Input ---------------
+        tokens: iterable of tokens
+
+        """
+        missing = [token for token in dict.fromkeys(tokens) if token not in self.lemma_cache]
+
+        # every token is tagged on its own, as a one word sentence
+        tagged = nltk.pos_tag_sents([[token] for token in missing])
+
+        for sentence in tagged:
+            token, tag = sentence[0]
+            pos = self.tag_dict.get(tag[0].upper() if tag else '', wordnet.NOUN)
+            self.put(token, self.lemmatizer.lemmatize(token, pos=pos))
+
+    def put(self, token, lemma):
+        """
+        adds a lemma to the LRU cache, evicting the least recently used entry when full
+
+        ---------- Input ---------------
+        token: the word
+        lemma: lemma of the word
+
+        """
+        self.lemma_cache[token] = lemma
+        self.lemma_cache.move_to_end(token)
+        if len(self.lemma_cache) > self.cache_size:
+            self.lemma_cache.popitem(last=False)
+
+    def lemma(self, token):
+        """
+        lemma of a token, looked up in the cache first
+
+        ---------- Input ---------------
+        token: the word
+
+        ---------- output ---------------
+        lemma: lemma of the word
+
+        """
+        if token in self.lemma_cache:
+            self.lemma_cache.move_to_end(token)
+            return self.lemma_cache[token]
+
+        self.cache_lemmas([token])
+        return self.lemma_cache.get(token, token)
+
+    def normalize(self, texts):
+        """
+        cleans and lemmatizes a batch of texts
+
+        ---------- Input ---------------
+        texts: array of texts, possibly with repetitions
+
+        ---------- output ---------------
+        normalized: list of lemmatized texts (space separated), aligned to the input
+
+        """
+        texts = list(texts)
+        unique_texts = list(dict.fromkeys(texts))
+
+        cleaned = {txt: self.clean_text(txt) for txt in unique_texts}
+
+        vocabulary = dict.fromkeys(token for tokens in cleaned.values() for token in tokens)
+        if len(vocabulary) <= self.cache_size:
+            self.cache_lemmas(vocabulary)
+
+        lemmatized = {txt: ' '.join(self.lemma(token) for token in tokens) for txt, tokens in cleaned.items()}
+
+        return [lemmatized[txt] for txt in texts]
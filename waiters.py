@@ -0,0 +1,175 @@
+#Import libraries
+import time
+import random
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# error codes of throttled AWS calls, retried at the next poll
+THROTTLING_CODES = ('Throttling', 'ThrottlingException', 'ThrottledException', 'RequestLimitExceeded',
+                    'TooManyRequestsException', 'ProvisionedThroughputExceededException')
+
+# terminal statuses of the SageMaker resources
+PIPELINE_SUCCESS = ('Succeeded',)
+PIPELINE_FAILURE = ('Failed', 'Stopped')
+ENDPOINT_SUCCESS = ('InService',)
+ENDPOINT_FAILURE = ('Failed', 'OutOfService', 'RollingBack')
+
+
+class WaiterError(Exception):
+    """
+    A resource reached a failure status, or the deadline passed before all resources finished
+    """
+
+    def __init__(self, message, statuses):
+        super().__init__(message)
+        # last known status of every resource
+        self.statuses = statuses
+
+
+def is_throttling(error):
+    """True for a throttled AWS call (botocore ClientError or any error carrying its response)"""
+    return getattr(error, 'response', {}).get('Error', {}).get('Code') in THROTTLING_CODES
+
+
+class Waiter:
+    """
+    Waits for many resources at once: one batched status call per poll for
+    all the pending resources, exponential backoff with jitter between the
+    polls, and a single deadline for the whole wait.
+
+    poll(pending_ids) returns {resource id: status} for the resources it
+    found, the ones missing keep their last status.
+    """
+
+    def __init__(self, poll, success, failure=(), delay=2.0, max_delay=60.0, backoff=2.0, jitter=0.5,
+                 timeout=900.0, clock=time.monotonic, sleep=time.sleep, rng=random.random):
+        self.poll = poll
+        self.success = tuple(success)
+        self.failure = tuple(failure)
+        self.delay = delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.jitter = jitter
+        self.timeout = timeout
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = rng
+        self.n_calls = 0
+
+    def next_delay(self, attempt):
+        """delay before the next poll: exponential, capped, and randomly shortened by up to `jitter`"""
+        delay = min(self.max_delay, self.delay * self.backoff ** attempt)
+        return delay * (1 - self.jitter * self.rng())
+
+    def wait(self, resource_ids, fail_fast=True):
+        """
+        Polls until every resource reached a success or failure status
+
+        ---------- Input ---------------
+        resource_ids: ids (names or ARNs) of the resources
+        fail_fast: raise as soon as one resource failed, otherwise wait for all of them
+
+        ---------- output ---------------
+        statuses: dictionary of resource id -> terminal status
+
+        """
+        resource_ids = list(dict.fromkeys(resource_ids))
+        statuses = dict.fromkeys(resource_ids)
+        deadline = self.clock() + self.timeout
+        attempt = 0
+
+        while True:
+            pending = [resource_id for resource_id in resource_ids
+                       if statuses[resource_id] not in self.success + self.failure]
+            if pending:
+                try:
+                    self.n_calls += 1
+                    statuses.update({resource_id: status for resource_id, status in self.poll(pending).items()
+                                     if resource_id in statuses})
+                except Exception as e:
+                    if not is_throttling(e):
+                        raise
+                    logger.info('Status call throttled, backing off: %s', e)
+
+            failed = [resource_id for resource_id in resource_ids if statuses[resource_id] in self.failure]
+            pending = [resource_id for resource_id in resource_ids
+                       if statuses[resource_id] not in self.success + self.failure]
+            if failed and (fail_fast or not pending):
+                raise WaiterError(f'{len(failed)} resources failed: {failed}', dict(statuses))
+            if not pending:
+                return dict(statuses)
+
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                raise WaiterError(f'{len(pending)} resources not finished within {self.timeout}s: {pending}',
+                                  dict(statuses))
+            self.sleep(min(self.next_delay(attempt), remaining))
+            attempt += 1
+
+
+def describe_poller(describe, status_of):
+    """
+    Poller calling describe(resource_id) for every pending resource, for the
+    APIs without a list call returning the statuses
+    """
+    def poll(pending):
+        return {resource_id: status_of(describe(resource_id)) for resource_id in pending}
+
+    return poll
+
+
+def pipeline_execution_poller(sm, pipeline_name, page_size=50):
+    """
+    Poller of the pipeline executions of one pipeline, list_pipeline_executions
+    pages (newest first) until all the pending executions were seen
+    """
+    def poll(pending):
+        pending = set(pending)
+        statuses = {}
+        kwargs = {'PipelineName': pipeline_name, 'SortBy': 'CreationTime', 'SortOrder': 'Descending',
+                  'MaxResults': page_size}
+        while True:
+            response = sm.list_pipeline_executions(**kwargs)
+            for execution in response['PipelineExecutionSummaries']:
+                if execution['PipelineExecutionArn'] in pending:
+                    statuses[execution['PipelineExecutionArn']] = execution['PipelineExecutionStatus']
+            if len(statuses) == len(pending) or not response.get('NextToken'):
+                return statuses
+            kwargs['NextToken'] = response['NextToken']
+
+    return poll
+
+
+def endpoint_poller(sm, name_contains=None, page_size=100):
+    """
+    Poller of SageMaker endpoints by name, list_endpoints pages (filtered by
+    name_contains, e.g. the common prefix) until all the pending endpoints were seen
+    """
+    def poll(pending):
+        pending = set(pending)
+        statuses = {}
+        kwargs = {'MaxResults': page_size}
+        if name_contains:
+            kwargs['NameContains'] = name_contains
+        while True:
+            response = sm.list_endpoints(**kwargs)
+            for endpoint in response['Endpoints']:
+                if endpoint['EndpointName'] in pending:
+                    statuses[endpoint['EndpointName']] = endpoint['EndpointStatus']
+            if len(statuses) == len(pending) or not response.get('NextToken'):
+                return statuses
+            kwargs['NextToken'] = response['NextToken']
+
+    return poll
+
+
+def pipeline_execution_waiter(sm, pipeline_name, **kwargs):
+    """Waiter of pipeline executions (ARNs) of one pipeline"""
+    return Waiter(pipeline_execution_poller(sm, pipeline_name), PIPELINE_SUCCESS, PIPELINE_FAILURE, **kwargs)
+
+
+def endpoint_waiter(sm, name_contains=None, **kwargs):
+    """Waiter of SageMaker endpoints (names) reaching InService"""
+    return Waiter(endpoint_poller(sm, name_contains), ENDPOINT_SUCCESS, ENDPOINT_FAILURE, **kwargs)